@@ -1,7 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from app.model.main_model import GenerateDfaRequest
-from app.service.main_service import generate_dfa
+from app.model.main_model import BuildBudget, GenerateDfaRequest, DeltaGenerateDfaRequest, EventBatch, FireRequest, MonitorRequest
+from app.model.marking_explorer import StateSpaceLimitExceeded
+from app.model.build_control import BudgetExceeded
+from app.service.main_service import estimate_dfa, get_pool_cache_stats, get_pool_store_stats, get_result_store_stats, resolve_pool_references, InvalidPoolReference
+from app.service.session_service import create_session, get_session, session_snapshot, fire, reset_session, delete_session, get_session_stats
+from app.service.monitor_service import create_monitor, get_monitor, monitor_snapshot, advance, case_status, delete_monitor, get_monitor_stats, MonitorNotReady, TooManyCases
+from app.service.wire_format import JSON, encode_response, negotiate
+from app.service.job_service import submit_job, get_job, job_response, spool_chunks, wait_for_output, cancel_job, cancel_client_jobs, cache_counters, get_job_stats, job_events, DONE, JOB_MAX_ESTIMATED_BYTES, ClientLimitReached, QueueFull, WorkersUnavailable
+
+# seconds a client turned away for load is told to wait before trying again
+RETRY_AFTER = "5"
 
 
 router = APIRouter()
@@ -11,10 +22,225 @@ def init():
     return {"message" : "FastAPI server up and running"}
 
 @router.post("/generateDfa")
-def generate_dfa_endpoint(request: GenerateDfaRequest):
-    return generate_dfa(request.models, request.constrains)
+def generate_dfa_endpoint(request: GenerateDfaRequest, http_request: Request):
+    # the build runs in the worker pool like every job, this request just waits for it
+    return respond(admit_job(request.models, request.constrains, http_request, request.budget), http_request)
 
-@router.post("/stop")
-def stop():
-    return "Generation stopped", 200
+@router.post("/generateDfaDelta")
+def generate_dfa_delta_endpoint(request: DeltaGenerateDfaRequest, http_request: Request):
+    bpmn_models, missing = resolve_references(request)
+    if missing:
+        return {"missing": missing}
+    # unchanged pools hit the pool cache and an unchanged request the result store (if RESULT_STORE_PATH is set)
+    return respond(admit_job(bpmn_models, request.constrains, http_request, request.budget), http_request)
+
+@router.post("/estimate")
+def estimate_endpoint(request: DeltaGenerateDfaRequest):
+    # dry run: bounds of the hybrid DFA and whether a job for it would be admitted, nothing is built
+    bpmn_models, missing = resolve_references(request)
+    if missing:
+        return {"missing": missing}
+    try:
+        estimate = estimate_dfa(bpmn_models, request.constrains)
+    except StateSpaceLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=f"State space too large: {e}")
+    return {**estimate, "admitted": not JOB_MAX_ESTIMATED_BYTES or estimate["bytes"]["min"] <= JOB_MAX_ESTIMATED_BYTES}
+
+@router.post("/jobs")
+def submit_job_endpoint(request: DeltaGenerateDfaRequest, http_request: Request):
+    # same hash negotiation as /generateDfaDelta, the build itself runs in the background; the Accept header
+    # picks the format the result is encoded in, like for the synchronous endpoints
+    bpmn_models, missing = resolve_references(request)
+    if missing:
+        return {"missing": missing}
+    job = admit_job(bpmn_models, request.constrains, http_request, request.budget)
+    return JSONResponse(job.snapshot(), status_code=202)
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return find_job(job_id).snapshot()
+
+@router.get("/jobs/{job_id}/events")
+def job_progress(job_id: str):
+    job = find_job(job_id)
+    return StreamingResponse(job_events(job), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/jobs/{job_id}/result")
+def job_result(job_id: str, http_request: Request):
+    job = find_job(job_id)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.current_status()}")
+    return respond(job, http_request)
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job_endpoint(job_id: str):
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.snapshot()
+
+@router.post("/sessions")
+def create_session_endpoint(request: DeltaGenerateDfaRequest):
+    # monitoring without the hybrid: states and colours are explored on the server as the simulation fires activities
+    bpmn_models, missing = resolve_references(request)
+    if missing:
+        return {"missing": missing}
+    try:
+        return JSONResponse(create_session(bpmn_models, request.constrains), status_code=201)
+    except StateSpaceLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=f"State space too large: {e}")
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=422, detail={"message": f"Session {e}", **e.report()})
+
+@router.get("/sessions/{session_id}")
+def session_status(session_id: str):
+    return explored(session_snapshot, find_session(session_id))
+
+@router.post("/sessions/{session_id}/fire")
+def fire_endpoint(session_id: str, request: FireRequest):
+    return explored(fire, find_session(session_id), request.activity)
+
+@router.post("/sessions/{session_id}/reset")
+def reset_session_endpoint(session_id: str):
+    return explored(reset_session, find_session(session_id))
+
+@router.delete("/sessions/{session_id}")
+def delete_session_endpoint(session_id: str):
+    if not delete_session(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return {"message": "Session closed"}
+
+def find_session(session_id: str):
+    session = get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return session
+
+def explored(operation, *args):
+    # colours of states not seen before are explored on the spot, within SESSION_MAX_EXPLORED
+    try:
+        return operation(*args)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=422, detail={"message": f"Session {e}", **e.report()})
 
+@router.post("/monitors")
+def create_monitor_endpoint(request: MonitorRequest):
+    # many cases against the colored DFA of a finished job, fed in batches over POST or the WebSocket
+    try:
+        return JSONResponse(create_monitor(find_job(request.job_id)), status_code=201)
+    except MonitorNotReady as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/monitors/{monitor_id}")
+def monitor_status(monitor_id: str):
+    return monitor_snapshot(find_monitor(monitor_id))
+
+@router.post("/monitors/{monitor_id}/events")
+def monitor_events(monitor_id: str, request: EventBatch):
+    try:
+        return advance(find_monitor(monitor_id), request.events)
+    except (ValueError, TooManyCases) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/monitors/{monitor_id}/cases/{case_id}")
+def monitor_case(monitor_id: str, case_id: str):
+    case = case_status(find_monitor(monitor_id), case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Unknown case")
+    return case
+
+@router.delete("/monitors/{monitor_id}")
+def delete_monitor_endpoint(monitor_id: str):
+    if not delete_monitor(monitor_id):
+        raise HTTPException(status_code=404, detail="Unknown monitor")
+    return {"message": "Monitor deleted"}
+
+@router.websocket("/monitors/{monitor_id}/ws")
+async def monitor_feed(websocket: WebSocket, monitor_id: str):
+    # every message is an EventBatch, it is answered with the colour changes of the batch (or an error)
+    monitor = get_monitor(monitor_id)
+    if monitor is None:
+        await websocket.close(code=4404, reason="Unknown monitor")
+        return
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                # a batch is applied off the event loop, like the POST endpoint
+                reply = await run_in_threadpool(advance, monitor, EventBatch.model_validate_json(message).events)
+            except (ValueError, TooManyCases) as e:
+                reply = {"error": str(e)}
+            await websocket.send_json(reply)
+    except WebSocketDisconnect:
+        pass
+
+def find_monitor(monitor_id: str):
+    monitor = get_monitor(monitor_id)
+    if monitor is None:
+        raise HTTPException(status_code=404, detail="Unknown monitor")
+    return monitor
+
+def resolve_references(request: DeltaGenerateDfaRequest):
+    try:
+        return resolve_pool_references(request.models)
+    except InvalidPoolReference as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def client_host(http_request: Request):
+    # jobs belong to the address they were submitted from
+    return http_request.client.host if http_request.client is not None else None
+
+def admit_job(bpmn_models, constrains, http_request: Request, budget: BuildBudget = None):
+    try:
+        return submit_job(bpmn_models, constrains, client_host(http_request), budget, negotiate(http_request.headers.get("accept")))
+    except ClientLimitReached as e:
+        raise HTTPException(status_code=429, detail=f"Too many builds: {e}", headers={"Retry-After": RETRY_AFTER})
+    except (QueueFull, WorkersUnavailable) as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": RETRY_AFTER})
+
+def check_job(job):
+    if job.status != DONE:
+        detail = job.error or f"Job {job.status}"
+        # a build stopped by its budget names the budget, the phase and the constraint it was working on
+        raise HTTPException(status_code=job.error_code or 500, detail={"message": detail, **job.details} if job.details else detail)
+
+def respond(job, http_request: Request):
+    # plain JSON unless the client asks for the columnar colored DFA (JSON, binary or MessagePack) in its Accept header;
+    # a response the worker spools (STREAM_RESPONSES) in the asked format is streamed while the worker still writes it
+    media_type = negotiate(http_request.headers.get("accept"))
+    headers = {"Vary": "Accept"} if media_type != JSON else None
+    if job.spool is not None:
+        wait_for_output(job)
+        if job.done.is_set():
+            check_job(job)
+        if media_type == job.media_type:
+            return StreamingResponse(spool_chunks(job), media_type=media_type, headers=headers)
+    job.done.wait()
+    check_job(job)
+    if media_type == JSON and job.spool is not None and job.media_type != JSON:
+        raise HTTPException(status_code=406, detail=f"The result of this job is only available in columnar form, as {job.media_type}")
+    # the job was submitted for another format: converted from the whole response
+    result = job_response(job)
+    if media_type == JSON:
+        return result
+    return Response(encode_response(result, media_type), media_type=media_type, headers=headers)
+
+def find_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@router.get("/cacheStats")
+def cache_stats():
+    # builds run in the worker processes, their cache lookups are added to those of the server
+    workers = cache_counters()
+    return {"pool_cache": get_pool_cache_stats(workers["pool_cache"]), "result_store": get_result_store_stats(workers["result_store"]), "pool_store": get_pool_store_stats(),
+            "jobs": get_job_stats(), "sessions": get_session_stats(), "monitors": get_monitor_stats()}
+
+@router.post("/stop")
+def stop(http_request: Request):
+    # cancels the queued and running jobs of the calling client, they stop at their next checkpoint
+    client = client_host(http_request)
+    return {"message": "Generation stopped", "cancelled": cancel_client_jobs(client) if client is not None else []}
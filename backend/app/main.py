@@ -1,8 +1,19 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.api import main_api
+from app.service import job_service
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the build workers are started with the server, not with the first request
+    job_service.start_workers()
+    yield
+    job_service.stop_workers()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(main_api.router)
 
 app.add_middleware(
@@ -11,4 +22,4 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"]
-)
\ No newline at end of file
+)
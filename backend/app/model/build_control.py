@@ -0,0 +1,154 @@
+import contextlib
+import os
+import threading
+import time
+
+
+class BuildCancelled(RuntimeError):
+    """Raised inside a build whose job has been cancelled."""
+
+
+class BudgetExceeded(BuildCancelled):
+    """Raised inside a build that outgrew one of its budgets (hybrid states, wall time or memory)."""
+
+    def __init__(self, budget, limit, value, phase, constraint=None):
+        where = f"{phase} of constraint {constraint}" if constraint is not None else phase
+        super().__init__(f"{budget} budget of {limit:,} exceeded ({value:,}) during {where}")
+        self.budget = budget
+        self.limit = limit
+        self.value = value
+        self.phase = phase
+        self.constraint = constraint
+
+    def report(self) -> dict:
+        return {"budget": self.budget, "limit": self.limit, "value": self.value, "phase": self.phase, "constraint": self.constraint}
+
+
+class BuildTimedOut(BudgetExceeded):
+    """Raised inside a build that ran past its deadline."""
+
+
+PHASES = ("ingestion", "multi-process product", "constraint product", "fused product", "colouring", "minimization", "serialization")
+
+# seconds between two looks at the resident memory of the process
+RSS_CHECK_INTERVAL = 0.05
+
+# layout of the values of one control: cancel flag, phase index, states, transitions, constraints left (-1 for none)
+CANCEL, PHASE, STATES, TRANSITIONS, CONSTRAINTS_LEFT = range(5)
+CONTROL_SIZE = 5
+
+
+class BuildControl:
+    """
+    Progress, budgets and cooperative cancellation of one build.
+
+    The product and colouring loops report to the control of their thread once per explored state (once
+    per frontier level in the compact engine); checkpoint() and check() raise BuildCancelled as soon as
+    cancel() has been called and BudgetExceeded once the build outgrows one of its budgets. The values can
+    live in shared memory (values/offset), so a build in a worker process is followed and cancelled from the server.
+    """
+
+    def __init__(self, values=None, offset: int = 0, seconds: float = None, max_states: int = None, max_rss: int = None, partial: bool = False):
+        self.values = values if values is not None else [0, -1, 0, 0, -1]
+        self.offset = offset
+        # budgets, None for no limit: wall time from now, states of the product being built, resident bytes of the process
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds if seconds is not None else None
+        self.max_states = max_states
+        self.max_rss = max_rss
+        self.rss_checked = 0.0
+        # a budget hit while adding constraints keeps the hybrid with the constraints added so far
+        self.partial = partial
+        # constraint the current phase works on, reported when a budget is hit
+        self.constraint = None
+        # budget hit that ended the constraint product of a partial build early, and the constraints left out
+        self.stopped_by = None
+        self.skipped_constraints = []
+
+    def reset(self):
+        self.values[self.offset:self.offset + CONTROL_SIZE] = [0, -1, 0, 0, -1]
+
+    def cancel(self):
+        self.values[self.offset + CANCEL] = 1
+
+    @property
+    def cancelled(self) -> bool:
+        return self.values[self.offset + CANCEL] != 0
+
+    def enter_phase(self, phase, constraints_left=None, constraint=None):
+        self.check()
+        self.values[self.offset + PHASE] = PHASES.index(phase)
+        self.values[self.offset + CONSTRAINTS_LEFT] = -1 if constraints_left is None else constraints_left
+        self.constraint = constraint
+
+    def checkpoint(self, states, transitions):
+        self.values[self.offset + STATES] = states
+        self.values[self.offset + TRANSITIONS] = transitions
+        if self.max_states is not None and states > self.max_states:
+            raise BudgetExceeded("states", self.max_states, states, self.phase, self.constraint)
+        self.check()
+
+    def check(self):
+        if self.values[self.offset + CANCEL]:
+            raise BuildCancelled(f"cancelled during {self.phase}")
+        if self.deadline is None and self.max_rss is None:
+            return
+        now = time.monotonic()
+        if self.deadline is not None and now > self.deadline:
+            raise BuildTimedOut("seconds", self.seconds, round(now - self.started, 3), self.phase, self.constraint)
+        if self.max_rss is not None and now - self.rss_checked > RSS_CHECK_INTERVAL:
+            self.rss_checked = now
+            rss = resident_bytes()
+            if rss > self.max_rss:
+                raise BudgetExceeded("rss_bytes", self.max_rss, rss, self.phase, self.constraint)
+
+    def stop_early(self, exceeded: BudgetExceeded, skipped_constraints):
+        self.stopped_by = exceeded
+        self.skipped_constraints = skipped_constraints
+        # the hybrid is complete with the constraints that fit, colouring them may take the time it needs
+        self.deadline = None
+        self.max_states = None
+
+    @property
+    def phase(self):
+        phase = self.values[self.offset + PHASE]
+        return PHASES[phase] if phase >= 0 else None
+
+    def progress(self) -> dict:
+        constraints_left = self.values[self.offset + CONSTRAINTS_LEFT]
+        return {
+            "phase": self.phase,
+            "states": self.values[self.offset + STATES],
+            "transitions": self.values[self.offset + TRANSITIONS],
+            "constraints_left": constraints_left if constraints_left >= 0 else None,
+        }
+
+
+def resident_bytes() -> int:
+    # current resident set of this process, the peak where /proc is not available
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+_local = threading.local()
+
+
+def current_control() -> BuildControl:
+    # builds outside of a job get a control nobody can cancel
+    control = getattr(_local, "control", None)
+    return control if control is not None else BuildControl()
+
+
+@contextlib.contextmanager
+def using_control(control: BuildControl):
+    previous = getattr(_local, "control", None)
+    _local.control = control
+    try:
+        yield control
+    finally:
+        _local.control = previous
@@ -0,0 +1,155 @@
+import time
+from itertools import repeat
+from operator import itemgetter
+
+import numpy as np
+
+# table entry of a symbol the state has no edge for, the case stays where it is
+NO_EDGE = -1
+# colour code of the error sink, it has no colours
+NO_COLOUR = -1
+
+
+class CaseMonitor:
+    """
+    Many cases monitored against one colored DFA at once.
+
+    The DFA is a dense int32 transition table (state x symbol -> target, NO_EDGE) and an int8 matrix of
+    colour codes (state x constraint), the position of every case is an entry of one int32 array. A batch
+    of (case, activity) events is advanced with a gather on the table per round, where a round holds at
+    most one event per case, so events of the same case are applied in the order they arrived.
+    """
+
+    def __init__(self, columnar: dict, initial_capacity: int = 1024):
+        """
+        Args:
+            columnar: the colored DFA in the columnar form of wire_format.columnar_colored_dfa
+            initial_capacity: cases the position array has room for before it grows
+        """
+        self.states = columnar["states"]
+        self.alphabet = columnar["alphabet"]
+        self.constraints = columnar["constraints"]
+        self.statuses = columnar["statuses"]
+        self.symbol_ids = {symbol: id for id, symbol in enumerate(self.alphabet)}
+        self.initial = columnar["init_state"]
+
+        offsets = np.asarray(columnar["offsets"], dtype=np.int64)
+        default_targets = np.asarray(columnar["default_targets"], dtype=np.int32)
+        self.table = np.repeat(default_targets.reshape(-1, 1), len(self.alphabet), axis=1)
+        rows = np.repeat(np.arange(len(self.states)), np.diff(offsets))
+        self.table[rows, np.asarray(columnar["symbols"], dtype=np.int64)] = np.asarray(columnar["targets"], dtype=np.int32)
+
+        palette = np.asarray(columnar["palette"], dtype=np.int8).reshape(-1, max(len(self.constraints), 1))
+        colors = np.asarray(columnar["colors"], dtype=np.int64)
+        self.colours = np.full((len(self.states), len(self.constraints)), NO_COLOUR, dtype=np.int8)
+        self.colours[colors >= 0] = palette[colors[colors >= 0]]
+
+        self.case_ids: dict[str, int] = dict()
+        self.case_names: list[str] = []
+        self.positions = np.full(initial_capacity, self.initial, dtype=np.int32)
+        self.events = 0
+        self.seconds = 0.0
+
+    def case_indexes(self, case_ids) -> np.ndarray:
+        # cases seen for the first time start in the initial state, only they are looked at one by one
+        indexes = np.fromiter(map(self.case_ids.get, case_ids, repeat(-1)), dtype=np.int64, count=len(case_ids))
+        for event in np.flatnonzero(indexes < 0).tolist():
+            case_id = case_ids[event]
+            index = self.case_ids.get(case_id)
+            if index is None:
+                index = len(self.case_names)
+                self.case_ids[case_id] = index
+                self.case_names.append(case_id)
+            indexes[event] = index
+        if len(self.case_names) > self.positions.size:
+            grown = np.full(max(len(self.case_names), 2 * self.positions.size), self.initial, dtype=np.int32)
+            grown[:self.positions.size] = self.positions
+            self.positions = grown
+        return indexes
+
+    def advance(self, events) -> list[dict]:
+        """
+        Apply a batch of events.
+
+        Args:
+            events: (case id, activity) pairs of strings in the order they happened
+
+        Returns:
+            One entry per event that changed a colour of its case: the case, the position of the event in
+            the batch, the new state and the changed colours as {constraint id: status}, None for the error sink
+        """
+        if not events:
+            return []
+        start_time = time.perf_counter()
+        cases = self.case_indexes(list(map(itemgetter(0), events)))
+        symbols = np.fromiter(map(self.symbol_ids.get, map(itemgetter(1), events), repeat(-1)), dtype=np.int64, count=len(events))
+
+        # round of every event: how many earlier events of the batch belong to the same case
+        order = np.argsort(cases, kind="stable")
+        sorted_cases = cases[order]
+        starts = np.flatnonzero(np.r_[True, sorted_cases[1:] != sorted_cases[:-1]])
+        group_sizes = np.diff(np.r_[starts, sorted_cases.size])
+        rounds = np.empty(cases.size, dtype=np.int64)
+        rounds[order] = np.arange(cases.size) - np.repeat(starts, group_sizes)
+
+        by_round = np.argsort(rounds, kind="stable")
+        bounds = np.r_[0, np.cumsum(np.bincount(rounds))]
+
+        before = np.empty(cases.size, dtype=np.int32)
+        after = np.empty(cases.size, dtype=np.int32)
+        for step in range(bounds.size - 1):
+            batch = by_round[bounds[step]:bounds[step + 1]]
+            batch_cases = cases[batch]
+            batch_symbols = symbols[batch]
+            current = self.positions[batch_cases]
+            # unknown activities and symbols without an edge leave the case where it is
+            known = batch_symbols >= 0
+            targets = current.copy()
+            targets[known] = self.table[current[known], batch_symbols[known]]
+            targets = np.where(targets == NO_EDGE, current, targets)
+            self.positions[batch_cases] = targets
+            before[batch] = current
+            after[batch] = targets
+        changes = self.colour_changes(cases, before, after)
+        self.events += len(events)
+        self.seconds += time.perf_counter() - start_time
+        return changes
+
+    def colour_changes(self, cases, before, after) -> list[dict]:
+        # one (event, constraint) pair per changed colour, grouped by event in batch order
+        events, constraints = np.nonzero(self.colours[before] != self.colours[after])
+        states = after[events]
+        codes = self.colours[states, constraints]
+        changes = []
+        last = -1
+        for event, case, state, j, code in zip(events.tolist(), cases[events].tolist(), states.tolist(), constraints.tolist(), codes.tolist()):
+            if event != last:
+                last = event
+                colors = dict()
+                changes.append({"case": self.case_names[case], "event": event, "state": self.states[state], "colors": colors})
+            colors[self.constraints[j]] = self.status(code)
+        return changes
+
+    def status(self, code) -> str | None:
+        return self.statuses[code] if code != NO_COLOUR else None
+
+    def case(self, case_id: str) -> dict | None:
+        index = self.case_ids.get(case_id)
+        if index is None:
+            return None
+        state = int(self.positions[index])
+        return {
+            "case": case_id,
+            "state": self.states[state],
+            "colors": [{constraint: self.status(self.colours[state, j])} for j, constraint in enumerate(self.constraints)],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "states": len(self.states),
+            "symbols": len(self.alphabet),
+            "constraints": len(self.constraints),
+            "cases": len(self.case_names),
+            "events": self.events,
+            "events_per_second": self.events / self.seconds if self.seconds else None,
+        }
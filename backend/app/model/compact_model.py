@@ -0,0 +1,439 @@
+import itertools
+import math
+
+import numpy as np
+
+from app.model.main_model import DeterministicFiniteAutomaton, ColoredDFA, symbol_classes
+from app.model.minimization import hopcroft
+from app.model.build_control import current_control
+
+# sentinel used in the transition table for the (merged) error sink
+ERROR_STATE = -1
+ERROR_STATE_NAME = "ERROR_STATE"
+
+# colour codes, ordered from best to worst like the colours in drawColoredDFA
+SATISFIED = 0
+TEMPORARY_SATISFIED = 1
+TEMPORARY_VIOLATED = 2
+VIOLATED = 3
+COLOUR_NAMES = ["satisfied", "temporary_satisfied", "temporary_violated", "violated"]
+
+class CompactDFA:
+    """
+    Integer-interned variant of DeterministicFiniteAutomaton.
+
+    A state is a row index. Its components (one per process and constraint) are stored
+    as interned ids in `components`, the names only live once in `component_names`.
+    Transitions are kept in a dense int32 table (state x symbol -> target). Every edge
+    into an error state points to the ERROR_STATE sentinel, so the error sink itself
+    is never materialized and rewire_Errors has nothing left to do.
+    """
+
+    def __init__(self):
+        self.id: str
+        self.alphabet: list[str] = []
+        self.symbol_index: dict[str, int] = dict()
+        self.component_names: list[list[str]] = []
+        self.components = np.zeros((0, 0), dtype=np.int32)
+        self.transition_table = np.zeros((0, 0), dtype=np.int32)
+        self.initial_states: set[int] = set()
+        self.accepting = np.zeros(0, dtype=bool)
+
+    def __str__(self):
+        return (
+            f"CompactDFA(id={getattr(self, 'id', None)})\n"
+            f"States: {self.num_states}\n"
+            f"Input Symbols: {sorted(self.alphabet)}\n"
+            f"Initial States: {[self.state_name(s) for s in sorted(self.initial_states)]}\n"
+            f"Accepting States: {int(self.accepting.sum())}"
+        )
+
+    @property
+    def num_states(self):
+        return self.transition_table.shape[0]
+
+    @property
+    def states(self):
+        return range(self.num_states)
+
+    @property
+    def transition_function(self):
+        return self.transition_table
+
+    @property
+    def default_transitions(self):
+        # the dense table spells out every edge
+        return dict()
+
+    @property
+    def accepting_states(self):
+        return set(np.flatnonzero(self.accepting).tolist())
+
+    @property
+    def error_states(self):
+        if (self.transition_table == ERROR_STATE).any():
+            return {ERROR_STATE}
+        return set()
+
+    @classmethod
+    def from_dfa(cls, dfa: DeterministicFiniteAutomaton):
+        # Error states of the source automaton are folded into the ERROR_STATE sentinel.
+        compact = cls()
+        compact.id = getattr(dfa, "id", None)
+        compact.alphabet = sorted(dfa.alphabet)
+        compact.symbol_index = {symbol: i for i, symbol in enumerate(compact.alphabet)}
+
+        names = sorted(state for state in dfa.states if state not in dfa.error_states)
+        state_index = {state: i for i, state in enumerate(names)}
+        table = np.full((len(names), len(compact.alphabet)), ERROR_STATE, dtype=np.int32)
+        for state, target in dfa.default_transitions.items():
+            if state in state_index and target in state_index:
+                table[state_index[state], :] = state_index[target]
+        for state, transitions in dfa.transition_function.items():
+            if state not in state_index:
+                continue
+            row = state_index[state]
+            for symbol, target in transitions.items():
+                table[row, compact.symbol_index[symbol]] = state_index.get(target, ERROR_STATE)
+
+        compact.component_names = [names]
+        compact.components = np.arange(len(names), dtype=np.int32).reshape(-1, 1)
+        compact.transition_table = table
+        compact.initial_states = {state_index[s] for s in dfa.initial_states if s in state_index}
+        compact.accepting = np.zeros(len(names), dtype=bool)
+        for state in dfa.accepting_states:
+            if state in state_index:
+                compact.accepting[state_index[state]] = True
+        return compact
+
+    @classmethod
+    def from_product(cls, processes, constraints, classes=None):
+        # Fused n-ary product: processes and constraints are explored together from the combined
+        # initial states, one level at a time. A product state is keyed in a mixed radix over its
+        # component ids, moves follow the staged add_process/add_constraint pipeline.
+        parts = [process if isinstance(process, CompactDFA) else cls.from_dfa(process) for process in processes]
+        compact = cls()
+        compact.id = "hybrid_DFA"
+        compact.alphabet = sorted(set().union(*(part.alphabet for part in parts), *(constraint.alphabet for constraint in constraints)))
+        compact.symbol_index = {symbol: i for i, symbol in enumerate(compact.alphabet)}
+        n_symbols = len(compact.alphabet)
+
+        # process moves over the common alphabet, symbols outside a process alphabet are an error move for it
+        process_tables = []
+        for part in parts:
+            table = np.full((part.num_states, n_symbols), ERROR_STATE, dtype=np.int64)
+            table[:, [compact.symbol_index[symbol] for symbol in part.alphabet]] = part.transition_table
+            process_tables.append(table)
+        columns, representatives = compact.class_columns(classes, constraints)
+        constraint_names, constraint_inits, constraint_tables = [], [], []
+        for constraint in constraints:
+            names, constraint_index, table = cls.constraint_table(constraint, representatives)
+            constraint_names.append(names)
+            constraint_inits.append([constraint_index[init] for init in constraint.initial_states])
+            constraint_tables.append(table)
+
+        radices = [part.num_states for part in parts] + [len(names) for names in constraint_names]
+        if math.prod(radices) >= 2 ** 62:
+            raise OverflowError("product state space too large for a 64 bit key")
+        strides = [math.prod(radices[i + 1:]) for i in range(len(radices))]
+
+        def decode(keys):
+            return [(keys // stride) % radix for stride, radix in zip(strides, radices)]
+
+        def successors(keys):
+            components = decode(keys)
+            targets = np.full((keys.size, n_symbols), ERROR_STATE, dtype=np.int64)
+            # a symbol is taken by the first process with a non error move
+            for position, table in enumerate(process_tables):
+                moves = table[components[position]]
+                take = (targets == ERROR_STATE) & (moves != ERROR_STATE)
+                targets = np.where(take, keys[:, None] + (moves - components[position][:, None]) * strides[position], targets)
+            # all constraints move together, evaluated once per symbol class
+            step = np.zeros((keys.size, len(representatives)), dtype=np.int64)
+            for offset, table in enumerate(constraint_tables):
+                position = len(parts) + offset
+                step += (table[components[position]] - components[position][:, None]) * strides[position]
+            return np.where(targets == ERROR_STATE, ERROR_STATE, targets + step[:, columns])
+
+        initial_keys = np.unique(np.array([sum(component * stride for component, stride in zip(combination, strides))
+                                           for combination in itertools.product(*([sorted(part.initial_states) for part in parts] + constraint_inits))], dtype=np.int64))
+        seen = initial_keys
+        frontier = initial_keys
+        levels = []
+        rows = []
+        control = current_control()
+        expanded = 0
+        while frontier.size:
+            control.checkpoint(seen.size, expanded)
+            expanded += frontier.size
+            levels.append(frontier)
+            rows.append(successors(frontier))
+            candidates = np.unique(rows[-1][rows[-1] >= 0])
+            positions = np.minimum(np.searchsorted(seen, candidates), max(seen.size - 1, 0))
+            frontier = candidates[seen[positions] != candidates]
+            seen = np.sort(np.concatenate([seen, frontier]), kind="stable")
+
+        keys = np.concatenate(levels) if levels else np.zeros(0, dtype=np.int64)
+        targets = np.concatenate(rows) if rows else np.zeros((0, n_symbols), dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        ids = order[np.searchsorted(keys[order], np.maximum(targets, 0))]
+        components = decode(keys)
+
+        compact.component_names = [names for part in parts for names in part.component_names] + constraint_names
+        compact.components = np.concatenate([part.components[components[position]] for position, part in enumerate(parts)]
+                                            + [components[len(parts) + offset].astype(np.int32).reshape(-1, 1) for offset in range(len(constraints))], axis=1).astype(np.int32)
+        compact.transition_table = np.where(targets < 0, ERROR_STATE, ids).astype(np.int32)
+        compact.initial_states = set(order[np.searchsorted(keys[order], initial_keys)].tolist())
+        compact.accepting = np.ones(keys.size, dtype=bool)
+        for position, part in enumerate(parts):
+            compact.accepting &= part.accepting[components[position]]
+        return compact
+
+    def state_components(self, state):
+        if state == ERROR_STATE:
+            return (ERROR_STATE_NAME,)
+        return tuple(self.component_names[position][component] for position, component in enumerate(self.components[state]))
+
+    def state_name(self, state):
+        return f"({','.join(self.state_components(state))})"
+
+    def state_names(self):
+        # decode all states at once, used at the API boundary only
+        decoded = [np.array(names, dtype=object)[self.components[:, position]] for position, names in enumerate(self.component_names)]
+        return ["(" + ",".join(parts) + ")" for parts in zip(*decoded)]
+
+    def add_process(self, process, reachable_only=False):
+        other = process if isinstance(process, CompactDFA) else CompactDFA.from_dfa(process)
+        n_self, n_other = self.num_states, other.num_states
+
+        alphabet = self.alphabet + [symbol for symbol in other.alphabet if symbol not in self.symbol_index]
+        symbol_index = {symbol: i for i, symbol in enumerate(alphabet)}
+        columns = np.array([symbol_index[symbol] for symbol in other.alphabet], dtype=np.int64)
+
+        def product_rows(own, others):
+            # successor keys of the product states (own, others), the pair (s, o) is keyed as s * n_other + o
+            rows = np.full((own.size, len(alphabet)), ERROR_STATE, dtype=np.int64)
+            targets = self.transition_table[own].astype(np.int64)
+            rows[:, :len(self.alphabet)] = np.where(targets == ERROR_STATE, ERROR_STATE, targets * n_other + others[:, None])
+            # symbols shared by both sides keep the move of the first process unless it is an error
+            targets = other.transition_table[others].astype(np.int64)
+            moved = np.where(targets == ERROR_STATE, ERROR_STATE, own[:, None] * n_other + targets)
+            if columns.size:
+                current = rows[:, columns]
+                rows[:, columns] = np.where(current == ERROR_STATE, moved, current)
+            return rows
+
+        initial_keys = np.unique(np.array([s * n_other + o for s in self.initial_states for o in other.initial_states], dtype=np.int64))
+        if reachable_only:
+            # breadth first exploration from the combined initial states, one level at a time
+            index = np.full(n_self * n_other, -1, dtype=np.int64)
+            frontier = initial_keys
+            index[frontier] = np.arange(frontier.size)
+            count = frontier.size
+            levels = []
+            rows = []
+            control = current_control()
+            while frontier.size:
+                control.checkpoint(count, count - frontier.size)
+                levels.append(frontier)
+                rows.append(product_rows(frontier // n_other, frontier % n_other))
+                candidates = rows[-1][rows[-1] >= 0]
+                new = np.unique(candidates[index[candidates] < 0])
+                index[new] = np.arange(count, count + new.size)
+                count += new.size
+                frontier = new
+            keys = np.concatenate(levels) if levels else np.zeros(0, dtype=np.int64)
+            targets = np.concatenate(rows) if rows else np.zeros((0, len(alphabet)), dtype=np.int64)
+            table = np.where(targets < 0, ERROR_STATE, index[np.maximum(targets, 0)])
+            initial_states = set(index[initial_keys].tolist())
+        else:
+            keys = np.arange(n_self * n_other, dtype=np.int64)
+            table = product_rows(keys // n_other, keys % n_other)
+            initial_states = set(initial_keys.tolist())
+        own, others = keys // n_other, keys % n_other
+
+        self.alphabet = alphabet
+        self.symbol_index = symbol_index
+        self.component_names = self.component_names + other.component_names
+        self.components = np.concatenate([self.components[own], other.components[others]], axis=1)
+        self.transition_table = table.astype(np.int32)
+        self.initial_states = initial_states
+        self.accepting = self.accepting[own] & other.accepting[others]
+        return self
+
+    @staticmethod
+    def constraint_table(constraint: DeterministicFiniteAutomaton, representatives):
+        # constraint automaton as a dense (state x symbol class) table, symbols it has no edge for keep its state
+        names = set(constraint.states) | set(constraint.transition_function) | set(constraint.default_transitions) | set(constraint.default_transitions.values())
+        for transitions in constraint.transition_function.values():
+            names.update(transitions.values())
+        names = sorted(names)
+        constraint_index = {state: i for i, state in enumerate(names)}
+        table = np.repeat(np.arange(len(names), dtype=np.int64).reshape(-1, 1), len(representatives), axis=1)
+        for state in names:
+            for column, representative in enumerate(representatives):
+                target = constraint.next_state(state, representative)
+                if target is not None:
+                    table[constraint_index[state], column] = constraint_index[target]
+        return names, constraint_index, table
+
+    def class_columns(self, classes, constraints, alphabet=None):
+        # symbol class of every column of the transition table (or of the given, widened alphabet)
+        alphabet = self.alphabet if alphabet is None else alphabet
+        class_of, representatives = classes if classes is not None else (dict(), [])
+        if any(symbol not in class_of for symbol in alphabet):
+            class_of, representatives = symbol_classes(constraints, alphabet)
+        return np.array([class_of[symbol] for symbol in alphabet], dtype=np.int64), representatives
+
+    def add_constraint(self, constraint: DeterministicFiniteAutomaton, classes=None):
+        # symbols only the constraint knows get error columns; the widened table is kept aside until the
+        # product is done, so a stop during the exploration leaves this hybrid as it was
+        added = sorted(set(constraint.alphabet) - set(self.alphabet))
+        alphabet = self.alphabet + added
+        symbol_index = {**self.symbol_index, **{symbol: len(self.alphabet) + i for i, symbol in enumerate(added)}}
+        transition_table = np.concatenate([self.transition_table, np.full((self.num_states, len(added)), ERROR_STATE, dtype=np.int32)], axis=1)
+        columns, representatives = self.class_columns(classes, [constraint], alphabet)
+        names, constraint_index, constraint_table = self.constraint_table(constraint, representatives)
+        n_constraint = len(names)
+
+        # breadth first exploration of the reachable product, one level at a time;
+        # product state (h, c) is keyed as h * n_constraint + c
+        index = np.full(self.num_states * n_constraint, -1, dtype=np.int64)
+        frontier = np.unique(np.array([h * n_constraint + constraint_index[c] for h in self.initial_states for c in constraint.initial_states], dtype=np.int64))
+        index[frontier] = np.arange(frontier.size)
+        initial_keys = frontier
+        count = frontier.size
+        levels = []
+        rows = []
+        control = current_control()
+        while frontier.size:
+            control.checkpoint(count, count - frontier.size)
+            hybrid, current = frontier // n_constraint, frontier % n_constraint
+            targets = transition_table[hybrid].astype(np.int64)
+            # the constraint moves are looked up once per symbol class and then spread over the columns
+            keys = np.where(targets == ERROR_STATE, -1, targets * n_constraint + constraint_table[current][:, columns])
+            levels.append(frontier)
+            rows.append(keys)
+            candidates = keys[keys >= 0]
+            new = np.unique(candidates[index[candidates] < 0])
+            index[new] = np.arange(count, count + new.size)
+            count += new.size
+            frontier = new
+
+        keys = np.concatenate(levels) if levels else np.zeros(0, dtype=np.int64)
+        targets = np.concatenate(rows) if rows else np.zeros((0, len(alphabet)), dtype=np.int64)
+        hybrid, current = keys // n_constraint, keys % n_constraint
+
+        self.alphabet = alphabet
+        self.symbol_index = symbol_index
+        self.component_names = self.component_names + [names]
+        self.components = np.concatenate([self.components[hybrid], current.astype(np.int32).reshape(-1, 1)], axis=1)
+        self.transition_table = np.where(targets < 0, ERROR_STATE, index[np.maximum(targets, 0)]).astype(np.int32)
+        self.initial_states = set(index[initial_keys].tolist())
+        self.accepting = self.accepting[hybrid]
+        return self
+
+    def rewire_Errors(self, num_processes):
+        # error states are merged into the ERROR_STATE sentinel while building
+        return self
+
+class CompactColoredDFA(ColoredDFA):
+    """ColoredDFA over a CompactDFA, colours are kept as an int8 (state x constraint) array of colour codes."""
+
+    def __init__(self, dfa: CompactDFA):
+        super().__init__(dfa)
+        self.automaton = dfa
+        self.constraint_ids: list[str] = []
+        self.colors = np.zeros((dfa.num_states, 0), dtype=np.int8)
+
+    def add_colours(self, num_processes, constraint_DFAs):
+        self.constraint_ids = [constraint.id for constraint in constraint_DFAs]
+        self.colors = np.empty((self.automaton.num_states, len(constraint_DFAs)), dtype=np.int8)
+        for index, constraint in enumerate(constraint_DFAs):
+            position = num_processes + index
+            accepting = np.array([name in constraint.accepting_states for name in self.automaton.component_names[position]], dtype=bool)
+            self.colors[:, index] = np.where(accepting[self.automaton.components[:, position]], SATISFIED, VIOLATED)
+        return self
+
+    def minimize(self):
+        # Hopcroft minimization, states are only merged if they agree on accepting and every colour;
+        # the error sink gets its own label so nothing is merged into it
+        dfa = self.automaton
+        n = dfa.num_states
+        table = np.where(dfa.transition_table == ERROR_STATE, n, dfa.transition_table)
+        labels = list(zip(dfa.accepting.tolist(), map(tuple, self.colors.tolist()))) + [("error",)]
+        block_of = np.array(hopcroft(table.tolist() + [[n] * len(dfa.alphabet)], labels), dtype=np.int64)
+
+        # blocks are numbered by first occurrence, so the sink block comes last and the first member of a block represents it
+        sink = block_of[n]
+        _, representatives = np.unique(block_of[:n], return_index=True)
+        merged = block_of[table[representatives]]
+        dfa.transition_table = np.where(merged == sink, ERROR_STATE, merged).astype(np.int32)
+        dfa.components = dfa.components[representatives]
+        dfa.accepting = dfa.accepting[representatives]
+        dfa.initial_states = {int(block_of[state]) for state in dfa.initial_states}
+        self.colors = self.colors[representatives]
+        self.current = int(block_of[self.current])
+        self.states = dfa.states
+        self.transition_function = dfa.transition_function
+        self.initial_states = dfa.initial_states
+        self.accepting_states = dfa.accepting_states
+        self.error_states = dfa.error_states
+        self.predecessors = None
+        return self
+
+    def reverse_transitions(self):
+        # reverse edges in CSR form: the predecessors of state t are sources[offsets[t]:offsets[t + 1]]
+        table = self.automaton.transition_table
+        n = self.automaton.num_states
+        sources = np.repeat(np.arange(n, dtype=np.int64), table.shape[1])
+        targets = table.ravel().astype(np.int64)
+        keep = targets != ERROR_STATE
+        sources, targets = sources[keep], targets[keep]
+        order = np.argsort(targets, kind="stable")
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=n), out=offsets[1:])
+        return offsets, sources[order]
+
+    def backward_reachable(self, predecessors, targets):
+        # level synchronous breadth first search on the reversed edges
+        offsets, sources = predecessors
+        reached = targets.copy()
+        frontier = np.flatnonzero(targets)
+        edges = 0
+        control = current_control()
+        while frontier.size:
+            control.check()
+            starts = offsets[frontier]
+            counts = offsets[frontier + 1] - starts
+            total = int(counts.sum())
+            edges += total
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+            candidates = sources[positions]
+            frontier = np.unique(candidates[~reached[candidates]])
+            reached[frontier] = True
+        return reached, edges
+
+    def colour_constraint(self, index, constraintName):
+        # the colours of ColoredDFA.colour_constraint (outcome of the reachable finished runs, an inconclusive
+        # state leans the way its constraint state does), on boolean masks over the CSR reverse index
+        if self.predecessors is None:
+            self.predecessors = self.reverse_transitions()
+
+        colours = self.colors[:, index]
+        accepting = self.automaton.accepting
+        satReach, satEdges = self.backward_reachable(self.predecessors, accepting & (colours == SATISFIED))
+        violReach, violEdges = self.backward_reachable(self.predecessors, accepting & (colours != SATISFIED))
+
+        leaning = np.where(colours == SATISFIED, TEMPORARY_SATISFIED, TEMPORARY_VIOLATED)
+        self.colors[:, index] = np.where(~satReach, VIOLATED, np.where(~violReach, SATISFIED, leaning))
+
+        counter = self.automaton.num_states + satEdges + violEdges
+        self.colouring_stats[constraintName] = {
+            "states": self.automaton.num_states,
+            "edges": satEdges + violEdges,
+            "sat_reach": int(satReach.sum()),
+            "viol_reach": int(violReach.sum()),
+            "counter": counter,
+        }
+        return counter
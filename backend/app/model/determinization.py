@@ -0,0 +1,70 @@
+from collections import deque
+
+
+def subset_construction(edges, initial_states, accepting_states, silent):
+    """
+    Epsilon closure and subset construction of a labelled transition system.
+
+    Args:
+        edges: iterable of (source, label, target) triples, several edges with the same source and label are allowed
+        initial_states: states the system starts in
+        accepting_states: final states of the system
+        silent: set of labels that are followed without consuming a symbol
+
+    Returns:
+        tuple (subsets, transitions, initial, accepting, kernels) with
+            subsets: list of the reachable subsets (frozensets of original states) in discovery order
+            transitions: dict subset -> dict label -> subset
+            initial: the subset the automaton starts in
+            accepting: set of subsets that contain an accepting state
+            kernels: dict subset -> frozenset of the states the subset was first entered through (before the closure)
+    """
+    visible = dict()
+    epsilon = dict()
+    for source, label, target in edges:
+        if label in silent:
+            epsilon.setdefault(source, set()).add(target)
+        else:
+            visible.setdefault(source, dict()).setdefault(label, set()).add(target)
+
+    closures = dict()
+
+    def closure(states):
+        result = set()
+        for state in states:
+            if state not in closures:
+                reached = {state}
+                stack = [state]
+                while stack:
+                    for target in epsilon.get(stack.pop(), ()):
+                        if target not in reached:
+                            reached.add(target)
+                            stack.append(target)
+                closures[state] = frozenset(reached)
+            result |= closures[state]
+        return frozenset(result)
+
+    kernel = frozenset(initial_states)
+    initial = closure(kernel)
+    kernels = {initial: kernel}
+    subsets = [initial]
+    transitions = dict()
+    queue = deque([initial])
+    while queue:
+        subset = queue.popleft()
+        moves = dict()
+        for state in subset:
+            for label, targets in visible.get(state, dict()).items():
+                moves.setdefault(label, set()).update(targets)
+        transitions[subset] = dict()
+        for label in sorted(moves, key=str):
+            kernel = frozenset(moves[label])
+            target = closure(kernel)
+            if target not in kernels:
+                kernels[target] = kernel
+                subsets.append(target)
+                queue.append(target)
+            transitions[subset][label] = target
+
+    accepting = {subset for subset in subsets if not subset.isdisjoint(accepting_states)}
+    return subsets, transitions, initial, accepting, kernels
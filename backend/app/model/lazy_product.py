@@ -0,0 +1,197 @@
+import itertools
+from collections import OrderedDict, deque
+
+from app.model.main_model import DeterministicFiniteAutomaton, process_move
+from app.model.build_control import current_control
+
+# the merged error sink of the hybrid, it has no colours
+ERROR_STATE = ("ERROR_STATE",)
+
+SATISFIED = "satisfied"
+TEMPORARY_SATISFIED = "temporary_satisfied"
+TEMPORARY_VIOLATED = "temporary_violated"
+VIOLATED = "violated"
+
+
+class LazyHybridDFA:
+    """
+    The hybrid DFA of processes and constraints, explored only where it is asked for.
+
+    States are the tuples of init_hybrid_dfa (one state per process, then one per constraint) and move the
+    same way. Constraints only observe the processes, they never restrict a move, so the colour of constraint
+    j in a state depends on nothing but the process part and the state of constraint j: it is found on the
+    product of the processes with that one constraint, explored forward from there. The moves of process
+    parts and the colours of every state such an exploration reaches are memoized in LRUs of max_entries.
+    """
+
+    def __init__(self, processes: list[DeterministicFiniteAutomaton], constraints: list[DeterministicFiniteAutomaton], max_entries: int):
+        self.processes = processes
+        self.constraints = constraints
+        self.alphabet = set().union(*(process.alphabet for process in processes))
+        self.max_entries = max_entries
+        # process part -> ({symbol: next process part or ERROR_STATE}, whether every other symbol leads to the error)
+        self.moves: OrderedDict[tuple, tuple[dict, bool]] = OrderedDict()
+        # (constraint index, process part, constraint state) -> colour
+        self.colours: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # states visited by all colour explorations
+        self.explored = 0
+
+    def initial_state(self) -> tuple:
+        return next(itertools.product(*(process.initial_states for process in self.processes), *(constraint.initial_states for constraint in self.constraints)))
+
+    def process_moves(self, part: tuple) -> tuple[dict, bool]:
+        entry = self.moves.get(part)
+        if entry is not None:
+            self.moves.move_to_end(part)
+            return entry
+        # when every process falls back to an error, so does the product and only explicit symbols need a move
+        keep_default = all(process.default_transitions.get(part[i]) in process.error_states for i, process in enumerate(self.processes))
+        if keep_default:
+            symbols = set().union(*(process.transition_function.get(part[i], dict()).keys() for i, process in enumerate(self.processes)))
+        else:
+            symbols = self.alphabet
+        moves = dict()
+        for symbol in symbols:
+            move = process_move(self.processes, part, symbol)
+            if move is None:
+                continue
+            i, target = move
+            moves[symbol] = ERROR_STATE if target in self.processes[i].error_states else part[:i] + (target,) + part[i + 1:]
+        entry = (moves, keep_default)
+        remember(self.moves, part, entry, self.max_entries)
+        return entry
+
+    def step(self, state: tuple, symbol) -> tuple | None:
+        # the state symbol leads to, None if the hybrid has no edge for it
+        if state == ERROR_STATE:
+            return ERROR_STATE if symbol in self.alphabet else None
+        number_processes = len(self.processes)
+        moves, keep_default = self.process_moves(state[:number_processes])
+        if symbol in moves:
+            target = moves[symbol]
+        elif keep_default and symbol in self.alphabet:
+            target = ERROR_STATE
+        else:
+            return None
+        if target == ERROR_STATE:
+            return ERROR_STATE
+        return target + tuple(constraint.next_state(state[number_processes + j], symbol) or state[number_processes + j]
+                              for j, constraint in enumerate(self.constraints))
+
+    def available_symbols(self, state: tuple) -> list:
+        # symbols that do not lead into the error sink; every symbol missing from the moves leads there or has no edge
+        if state == ERROR_STATE:
+            return []
+        moves, _ = self.process_moves(state[:len(self.processes)])
+        return sorted(symbol for symbol, target in moves.items() if target != ERROR_STATE)
+
+    def is_accepting(self, state: tuple) -> bool:
+        return state != ERROR_STATE and all(state[i] in process.accepting_states for i, process in enumerate(self.processes))
+
+    def state_colours(self, state: tuple) -> list[dict] | None:
+        # the colours of a state like those of ColoredDFA (one {constraint id: colour} per constraint), None for the error sink
+        if state == ERROR_STATE:
+            return None
+        number_processes = len(self.processes)
+        part = state[:number_processes]
+        return [{constraint.id: self.colour(j, part, state[number_processes + j])} for j, constraint in enumerate(self.constraints)]
+
+    def colour(self, j: int, part: tuple, constraint_state) -> str:
+        key = (j, part, constraint_state)
+        colour = self.colours.get(key)
+        if colour is not None:
+            self.colours.move_to_end(key)
+            self.hits += 1
+            return colour
+        self.misses += 1
+        return self.explore(j, part, constraint_state)
+
+    def explore(self, j: int, part: tuple, constraint_state) -> str:
+        """
+        Colour the product of the processes and constraint j forward from (part, constraint_state).
+
+        Every state reached has its whole future in the explored part, so all of them are coloured (and
+        memoized) at once, by the rules of ColoredDFA.colour_constraint: a state that cannot reach a finished
+        run satisfying the constraint is violated, one that cannot reach a violating one is satisfied. The
+        others are inconclusive and lean the way the constraint state does right now (temporary_satisfied
+        when it is accepting, temporary_violated otherwise).
+        """
+        constraint = self.constraints[j]
+        control = current_control()
+        control.enter_phase("colouring", constraint=constraint.id)
+        start = (part, constraint_state)
+        predecessors = {start: []}
+        sat_final = []
+        viol_final = []
+        frontier = deque([start])
+        edges = 0
+        while frontier:
+            node = frontier.popleft()
+            control.checkpoint(len(predecessors), edges)
+            node_part, node_constraint = node
+            if all(node_part[i] in process.accepting_states for i, process in enumerate(self.processes)):
+                (sat_final if node_constraint in constraint.accepting_states else viol_final).append(node)
+            moves, _ = self.process_moves(node_part)
+            for symbol, target in moves.items():
+                # the error sink reaches no finished run
+                if target == ERROR_STATE:
+                    continue
+                successor = (target, constraint.next_state(node_constraint, symbol) or node_constraint)
+                edges += 1
+                if successor not in predecessors:
+                    predecessors[successor] = []
+                    frontier.append(successor)
+                predecessors[successor].append(node)
+        self.explored += len(predecessors)
+
+        sat_reach = backward_reachable(predecessors, sat_final)
+        viol_reach = backward_reachable(predecessors, viol_final)
+        colours = dict()
+        for node in predecessors:
+            if node not in sat_reach:
+                colours[node] = VIOLATED
+            elif node not in viol_reach:
+                colours[node] = SATISFIED
+            elif node[1] in constraint.accepting_states:
+                colours[node] = TEMPORARY_SATISFIED
+            else:
+                colours[node] = TEMPORARY_VIOLATED
+
+        # the state asked for goes in last, so it is the last one evicted
+        start_colour = colours.pop(start)
+        for node, colour in colours.items():
+            remember(self.colours, (j, *node), colour, self.max_entries)
+        remember(self.colours, (j, *start), start_colour, self.max_entries)
+        return start_colour
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "moves": len(self.moves),
+            "colours": len(self.colours),
+            "max_entries": self.max_entries,
+            "explored": self.explored,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def backward_reachable(predecessors, targets) -> set:
+    reached = set(targets)
+    frontier = deque(reached)
+    while frontier:
+        for predecessor in predecessors[frontier.popleft()]:
+            if predecessor not in reached:
+                reached.add(predecessor)
+                frontier.append(predecessor)
+    return reached
+
+
+def remember(entries: OrderedDict, key, value, max_entries: int):
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > max_entries:
+        entries.popitem(last=False)
@@ -1,6 +1,12 @@
 from pydantic import BaseModel
 import graphviz
 import copy
+from collections import deque
+import itertools
+
+from app.model.minimization import minimize_automaton
+from app.model.determinization import subset_construction
+from app.model.build_control import current_control
 
 class BpmnData(BaseModel):
     id: str
@@ -12,9 +18,94 @@ class ConstraintData(BaseModel):
     targetRef: str
     constraintType: str
 
+class BuildBudget(BaseModel):
+    # limits of one build, None leaves the server's own limit; a build that outgrows one is stopped
+    max_states: int | None = None
+    max_seconds: float | None = None
+    max_rss_mb: int | None = None
+    # when the constraint product outgrows the budget, return the hybrid of the constraints that fit
+    partial: bool = False
+
 class GenerateDfaRequest(BaseModel):
     models: list[BpmnData]
     constrains: list[ConstraintData]
+    budget: BuildBudget | None = None
+
+class PoolReference(BaseModel):
+    id: str
+    # sha256 of the pool's XML (UTF-8), the XML itself is only sent when the server asks for it;
+    # clients that cannot hash send the XML right away
+    hash: str | None = None
+    xml: str | None = None
+
+class DeltaGenerateDfaRequest(BaseModel):
+    models: list[PoolReference]
+    constrains: list[ConstraintData]
+    budget: BuildBudget | None = None
+
+class FireRequest(BaseModel):
+    # the activity (BPMN element id) a monitoring session is fired with
+    activity: str
+
+class MonitorRequest(BaseModel):
+    # the finished job whose colored DFA the cases are monitored against
+    job_id: str
+
+class EventBatch(BaseModel):
+    # (case id, activity) pairs in the order they happened
+    events: list[tuple[str, str]]
+
+# stands for every activity a constraint template does not name (neither source nor target)
+OTHER_ACTIVITY = object()
+
+def symbol_classes(constraints, alphabet):
+    """
+    Coarsest partition of the alphabet into symbols that every constraint DFA treats identically.
+
+    Args:
+        constraints: constraint DFAs
+        alphabet: symbols to partition
+
+    Returns:
+        (class_of, representatives): class index of every symbol and one member per class
+    """
+    constraint_states = [sorted(set(constraint.states) | set(constraint.transition_function) | set(constraint.default_transitions), key=str) for constraint in constraints]
+
+    def signature(symbol):
+        return tuple(tuple(constraint.next_state(state, symbol) for state in states) for constraint, states in zip(constraints, constraint_states))
+
+    # symbols no constraint names explicitly all follow the default edges
+    explicit = set()
+    for constraint in constraints:
+        for transitions in constraint.transition_function.values():
+            explicit.update(transitions)
+    other = signature(OTHER_ACTIVITY)
+
+    classes = dict()
+    class_of = dict()
+    representatives = []
+    for symbol in sorted(alphabet):
+        key = signature(symbol) if symbol in explicit else other
+        if key not in classes:
+            classes[key] = len(representatives)
+            representatives.append(symbol)
+        class_of[symbol] = classes[key]
+    return class_of, representatives
+
+def process_move(processes, state, symbol):
+    # the process taking symbol in a product state (one state per process first): the first one with a move
+    # that is not an error, else the last one with an error move, as (index, target); None if no process has a move
+    move = None
+    for i, process in enumerate(processes):
+        if symbol not in process.alphabet:
+            continue
+        target = process.next_state(state[i], symbol)
+        if target is None:
+            continue
+        move = (i, target)
+        if target not in process.error_states:
+            break
+    return move
 
 class DeterministicFiniteAutomaton:
 
@@ -22,16 +113,22 @@ class DeterministicFiniteAutomaton:
         self.id: str
         self.states: set[str] = set()
         self.alphabet: set[str] = set()
-        self.transition_function: dict[str, set[tuple[str, str]]] = dict()
+        self.transition_function: dict[str, dict[str, str]] = dict()
         self.initial_states: set[str] = set()
         self.accepting_states: set[str] = set()
         self.error_states: set[str] = set()
+        # per state target for every symbol of the alphabet without an explicit edge
+        self.default_transitions: dict[str, str] = dict()
+        # states of the original transition system every state stands for (only set for determinized process DFAs)
+        self.state_mapping: dict[str, set[str]] = dict()
     
     def __str__(self):
         transitions_str = ""
-        for state, trans_set in self.transition_function.items():
-            for symbol, dest in trans_set:
+        for state, trans_map in self.transition_function.items():
+            for symbol, dest in trans_map.items():
                 transitions_str += f"    {state} --{symbol}--> {dest}\n"
+        for state, dest in self.default_transitions.items():
+            transitions_str += f"    {state} --*--> {dest}\n"
 
         return (
             f"DeterministicFiniteAutomaton(id={getattr(self, 'id', None)})\n"
@@ -42,28 +139,49 @@ class DeterministicFiniteAutomaton:
             f"Transitions:\n{transitions_str if transitions_str else '    None'}"
         )
 
+    def next_state(self, state, symbol):
+        # explicit edge first, otherwise the default edge of the state (None if there is neither)
+        return self.transition_function.get(state, dict()).get(symbol, self.default_transitions.get(state))
+
     def updateSingleDFA(self):
-        transitions = self.transition_function.copy()
+        # every symbol without an explicit edge leads to the error state
+        transitions = {state: dict(targets) for state, targets in self.transition_function.items()}
         self.states.add(("ERROR_STATE"))
         self.error_states.add(("ERROR_STATE"))
-        transitions[("ERROR_STATE")] = set()
+        transitions[("ERROR_STATE")] = dict()
         
         for state in self.states:
             if state not in transitions:
-                transitions[state] = set()
-
-        for state in transitions: 
-            existing_transitions = set()
-            for transition, target in transitions[state]: 
-                existing_transitions.add(transition)
-            #print(existing_transitions, self.alphabet)
-            for transition in self.alphabet - existing_transitions:
-                transitions[state].add((transition,("ERROR_STATE")))
-                
+                transitions[state] = dict()
+            self.default_transitions[state] = ("ERROR_STATE")
 
         self.transition_function = transitions
 
-    def init_multi_process_dfa(self, states, alphabet, transition_function, initial_states, accepting_states, error_states):
+    def template_activities(self, multi_process_alphabet, *activities):
+        # the templates only tell source and target apart from the rest of the alphabet, so the rest is
+        # represented by a single stand-in activity whose edges become the default transitions
+        return list(dict.fromkeys(activity for activity in activities if activity in multi_process_alphabet)) + [OTHER_ACTIVITY]
+
+    def collapse_default_transitions(self):
+        for state, transitions in self.transition_function.items():
+            if OTHER_ACTIVITY not in transitions:
+                continue
+            default = transitions.pop(OTHER_ACTIVITY)
+            self.default_transitions[state] = default
+            for activity in [activity for activity, target in transitions.items() if target == default]:
+                del transitions[activity]
+
+    def minimize(self):
+        # Hopcroft minimization, accepting and error states stay apart
+        merged = minimize_automaton(self, lambda state: None)
+        if self.state_mapping:
+            state_mapping = dict()
+            for state, members in self.state_mapping.items():
+                state_mapping.setdefault(merged.get(state, state), set()).update(members)
+            self.state_mapping = state_mapping
+        return self
+
+    def init_multi_process_dfa(self, states, alphabet, transition_function, initial_states, accepting_states, error_states, default_transitions=None):
         self.id = "multi_process_DFA"
         self.states = states
         self.alphabet = alphabet
@@ -71,6 +189,94 @@ class DeterministicFiniteAutomaton:
         self.initial_states = initial_states
         self.accepting_states = accepting_states
         self.error_states = error_states
+        self.default_transitions = default_transitions if default_transitions is not None else dict()
+        return self
+
+    def init_determinized_dfa(self, id, edges, initial_states, accepting_states, silent):
+        # epsilon closure over the silent (routing) labels and subset construction, every subset is named
+        # after the states it is entered through and remembers all states of its closure
+        subsets, transitions, initial, accepting, kernels = subset_construction(edges, initial_states, accepting_states, silent)
+        names = {subset: "+".join(sorted(kernels[subset], key=str)) for subset in subsets}
+
+        self.id = id
+        self.states = set(names.values())
+        self.transition_function = {names[subset]: {label: names[target] for label, target in targets.items()} for subset, targets in transitions.items()}
+        self.alphabet = {label for targets in self.transition_function.values() for label in targets}
+        self.initial_states = {names[initial]}
+        self.accepting_states = {names[subset] for subset in accepting}
+        self.state_mapping = {names[subset]: set(subset) for subset in subsets}
+        return self
+
+    def init_hybrid_dfa(self, processes, constraints, classes=None):
+        # n-ary synchronous product of all processes and constraints, explored forward in a single pass.
+        # Moves follow the staged add_process/add_constraint/rewire_Errors pipeline: a symbol is taken by
+        # the first process with a non error move, every constraint follows it (or stays), and edges
+        # into an error state go straight to the merged error sink
+        error = tuple(("ERROR_STATE",))
+        numberProcesses = len(processes)
+
+        self.id = "hybrid_DFA"
+        self.alphabet = set().union(*(process.alphabet for process in processes), *(constraint.alphabet for constraint in constraints))
+        self.states = set()
+        self.transition_function = dict()
+        self.default_transitions = dict()
+        self.initial_states = set()
+        self.accepting_states = set()
+        self.error_states = set()
+        class_of, representatives = classes if classes is not None else symbol_classes(constraints, self.alphabet)
+
+        for init in itertools.product(*(process.initial_states for process in processes), *(constraint.initial_states for constraint in constraints)):
+            self.initial_states.add(init)
+            self.states.add(init)
+        frontier = deque(self.initial_states)
+
+        control = current_control()
+        while frontier:
+            state = frontier.popleft()
+            control.checkpoint(len(self.states), len(self.transition_function))
+            if all(state[i] in process.accepting_states for i, process in enumerate(processes)):
+                self.accepting_states.add(state)
+
+            # when every process falls back to an error, so does the product and only explicit symbols need an edge
+            keep_default = all(process.default_transitions.get(state[i]) in process.error_states for i, process in enumerate(processes))
+            if keep_default:
+                symbols = set().union(*(process.transition_function.get(state[i], dict()).keys() for i, process in enumerate(processes)))
+            else:
+                symbols = self.alphabet
+
+            successors = dict()
+            # the constraint side only depends on the class of a symbol, so it is evaluated once per class
+            constraint_moves = dict()
+            for symbol in symbols:
+                move = process_move(processes, state, symbol)
+                if move is None:
+                    continue
+                i, target = move
+                if target in processes[i].error_states:
+                    successors[symbol] = error
+                    continue
+                symbol_class = class_of[symbol]
+                if symbol_class not in constraint_moves:
+                    representative = representatives[symbol_class]
+                    constraint_moves[symbol_class] = tuple(
+                        constraint.next_state(state[numberProcesses + j], representative) or state[numberProcesses + j]
+                        for j, constraint in enumerate(constraints))
+                next_state = state[:i] + (target,) + state[i + 1:numberProcesses] + constraint_moves[symbol_class]
+                successors[symbol] = next_state
+                if next_state not in self.states:
+                    self.states.add(next_state)
+                    frontier.append(next_state)
+            if successors:
+                self.transition_function[state] = successors
+            if keep_default:
+                self.default_transitions[state] = error
+            if keep_default or error in successors.values():
+                self.error_states.add(error)
+
+        if self.error_states:
+            self.states.add(error)
+            self.transition_function[error] = dict()
+            self.default_transitions[error] = error
         return self
 
     def init_constraint_dfa(self, constraint: ConstraintData, multi_process_alphabet):
@@ -133,14 +339,15 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"existence_1", "existence_2"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["existence_1"] = set()
-            self.transition_function["existence_2"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["existence_1"] = dict()
+            self.transition_function["existence_2"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source):
                 if activity == source:
-                    self.transition_function["existence_1"].add((activity, "existence_2"))
+                    self.transition_function["existence_1"][activity] = "existence_2"
                 if activity != source:
-                    self.transition_function["existence_1"].add((activity, "existence_1"))
-                self.transition_function["existence_2"].add((activity, "existence_2"))
+                    self.transition_function["existence_1"][activity] = "existence_1"
+                self.transition_function["existence_2"][activity] = "existence_2"
+            self.collapse_default_transitions()
             self.initial_states = {"existence_1"}
             self.accepting_states = {"existence_2"}
             self.error_states = set()
@@ -166,17 +373,18 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"absence2_1", "absence2_2", "absence2_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["absence2_1"] = set()
-            self.transition_function["absence2_2"] = set()
-            self.transition_function["absence2_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["absence2_1"] = dict()
+            self.transition_function["absence2_2"] = dict()
+            self.transition_function["absence2_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source):
                 if activity == source:
-                    self.transition_function["absence2_1"].add((activity, "absence2_2"))
-                    self.transition_function["absence2_2"].add((activity, "absence2_3"))
+                    self.transition_function["absence2_1"][activity] = "absence2_2"
+                    self.transition_function["absence2_2"][activity] = "absence2_3"
                 if activity != source:
-                    self.transition_function["absence2_1"].add((activity, "absence2_1"))
-                    self.transition_function["absence2_2"].add((activity, "absence2_2"))
-                self.transition_function["absence2_3"].add((activity, "absence2_3"))
+                    self.transition_function["absence2_1"][activity] = "absence2_1"
+                    self.transition_function["absence2_2"][activity] = "absence2_2"
+                self.transition_function["absence2_3"][activity] = "absence2_3"
+            self.collapse_default_transitions()
             self.initial_states = {"absence2_1"}
             self.accepting_states = {"absence2_1", "absence2_2"}
             self.error_states = set()
@@ -199,14 +407,15 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"choice_1", "choice_2"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["choice_1"] = set()
-            self.transition_function["choice_2"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["choice_1"] = dict()
+            self.transition_function["choice_2"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == source or activity == target:
-                    self.transition_function["choice_1"].add((activity, "choice_2"))
+                    self.transition_function["choice_1"][activity] = "choice_2"
                 if activity != source and activity != target:
-                    self.transition_function["choice_1"].add((activity, "choice_1"))
-                self.transition_function["choice_2"].add((activity, "choice_2"))
+                    self.transition_function["choice_1"][activity] = "choice_1"
+                self.transition_function["choice_2"][activity] = "choice_2"
+            self.collapse_default_transitions()
             self.initial_states = {"choice_1"}
             self.accepting_states = {"choice_2"}
             self.error_states = set()
@@ -231,28 +440,29 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"exc-choice_1", "exc-choice_2", "exc-choice_3", "exc-choice_4"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["exc-choice_1"] = set()
-            self.transition_function["exc-choice_2"] = set()
-            self.transition_function["exc-choice_3"] = set()
-            self.transition_function["exc-choice_4"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["exc-choice_1"] = dict()
+            self.transition_function["exc-choice_2"] = dict()
+            self.transition_function["exc-choice_3"] = dict()
+            self.transition_function["exc-choice_4"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == target and activity != source:
-                    self.transition_function["exc-choice_1"].add((activity, "exc-choice_2"))
+                    self.transition_function["exc-choice_1"][activity] = "exc-choice_2"
                 if activity == source and activity != target:
-                    self.transition_function["exc-choice_1"].add((activity, "exc-choice_3"))
+                    self.transition_function["exc-choice_1"][activity] = "exc-choice_3"
                 if activity == source and activity == target:
-                    self.transition_function["exc-choice_1"].add((activity, "exc-choice_4"))
+                    self.transition_function["exc-choice_1"][activity] = "exc-choice_4"
                 if activity != source and activity != target:
-                    self.transition_function["exc-choice_1"].add((activity, "exc-choice_1"))
+                    self.transition_function["exc-choice_1"][activity] = "exc-choice_1"
                 if activity == source:
-                    self.transition_function["exc-choice_2"].add((activity, "exc-choice_4"))
+                    self.transition_function["exc-choice_2"][activity] = "exc-choice_4"
                 if activity == target:
-                    self.transition_function["exc-choice_3"].add((activity, "exc-choice_4"))
+                    self.transition_function["exc-choice_3"][activity] = "exc-choice_4"
                 if activity != source:
-                    self.transition_function["exc-choice_2"].add((activity, "exc-choice_2"))
+                    self.transition_function["exc-choice_2"][activity] = "exc-choice_2"
                 if activity != target:
-                    self.transition_function["exc-choice_3"].add((activity, "exc-choice_3"))
-                self.transition_function["exc-choice_4"].add((activity, "exc-choice_4"))
+                    self.transition_function["exc-choice_3"][activity] = "exc-choice_3"
+                self.transition_function["exc-choice_4"][activity] = "exc-choice_4"
+            self.collapse_default_transitions()
             self.initial_states = {"exc-choice_1"}
             self.accepting_states = {"exc-choice_2", "exc-choice_3"}
             self.error_states = set()
@@ -276,20 +486,21 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"resp-existence_1", "resp-existence_2", "resp-existence_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["resp-existence_1"] = set()
-            self.transition_function["resp-existence_2"] = set()
-            self.transition_function["resp-existence_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["resp-existence_1"] = dict()
+            self.transition_function["resp-existence_2"] = dict()
+            self.transition_function["resp-existence_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == target:
-                    self.transition_function["resp-existence_1"].add((activity, "resp-existence_2"))
-                    self.transition_function["resp-existence_3"].add((activity, "resp-existence_2"))
+                    self.transition_function["resp-existence_1"][activity] = "resp-existence_2"
+                    self.transition_function["resp-existence_3"][activity] = "resp-existence_2"
                 if activity == source and activity != target:
-                    self.transition_function["resp-existence_1"].add((activity, "resp-existence_3"))
+                    self.transition_function["resp-existence_1"][activity] = "resp-existence_3"
                 if activity != source and activity != target:
-                    self.transition_function["resp-existence_1"].add((activity, "resp-existence_1"))
+                    self.transition_function["resp-existence_1"][activity] = "resp-existence_1"
                 if activity != target:
-                    self.transition_function["resp-existence_3"].add((activity, "resp-existence_3"))
-                self.transition_function["resp-existence_2"].add((activity, "resp-existence_2"))
+                    self.transition_function["resp-existence_3"][activity] = "resp-existence_3"
+                self.transition_function["resp-existence_2"][activity] = "resp-existence_2"
+            self.collapse_default_transitions()
             self.initial_states = {"resp-existence_1"}
             self.accepting_states = {"resp-existence_1", "resp-existence_2"}
             self.error_states = set()
@@ -314,28 +525,29 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"coexistence_1", "coexistence_2", "coexistence_3", "coexistence_4"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["coexistence_1"] = set()
-            self.transition_function["coexistence_2"] = set()
-            self.transition_function["coexistence_3"] = set()
-            self.transition_function["coexistence_4"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["coexistence_1"] = dict()
+            self.transition_function["coexistence_2"] = dict()
+            self.transition_function["coexistence_3"] = dict()
+            self.transition_function["coexistence_4"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity != target and activity != source:
-                    self.transition_function["coexistence_1"].add((activity, "coexistence_1"))
+                    self.transition_function["coexistence_1"][activity] = "coexistence_1"
                 if activity == target and activity != source:
-                    self.transition_function["coexistence_1"].add((activity, "coexistence_2"))
+                    self.transition_function["coexistence_1"][activity] = "coexistence_2"
                 if activity == source and activity != target:
-                    self.transition_function["coexistence_1"].add((activity, "coexistence_3"))
+                    self.transition_function["coexistence_1"][activity] = "coexistence_3"
                 if activity == source and activity == target:
-                    self.transition_function["coexistence_1"].add((activity, "coexistence_4"))
+                    self.transition_function["coexistence_1"][activity] = "coexistence_4"
                 if activity != source:
-                    self.transition_function["coexistence_2"].add((activity, "coexistence_2"))
+                    self.transition_function["coexistence_2"][activity] = "coexistence_2"
                 if activity != target:
-                    self.transition_function["coexistence_3"].add((activity, "coexistence_3"))
+                    self.transition_function["coexistence_3"][activity] = "coexistence_3"
                 if activity == source:
-                    self.transition_function["coexistence_2"].add((activity, "coexistence_4"))
+                    self.transition_function["coexistence_2"][activity] = "coexistence_4"
                 if activity == target:
-                    self.transition_function["coexistence_3"].add((activity, "coexistence_4"))
-                self.transition_function["coexistence_4"].add((activity, "coexistence_4"))
+                    self.transition_function["coexistence_3"][activity] = "coexistence_4"
+                self.transition_function["coexistence_4"][activity] = "coexistence_4"
+            self.collapse_default_transitions()
             self.initial_states = {"coexistence_1"}
             self.accepting_states = {"coexistence_1", "coexistence_4"}
             self.error_states = set()
@@ -358,18 +570,19 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"response_1", "response_2"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["response_1"] = set()
-            self.transition_function["response_2"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["response_1"] = dict()
+            self.transition_function["response_2"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == target or activity != source:
-                    self.transition_function["response_1"].add((activity, "response_1"))
+                    self.transition_function["response_1"][activity] = "response_1"
                 if activity == source and activity != target:
-                    self.transition_function["response_1"].add((activity, "response_2"))
+                    self.transition_function["response_1"][activity] = "response_2"
                 if activity != target:
-                    self.transition_function["response_2"].add((activity, "response_2"))
+                    self.transition_function["response_2"][activity] = "response_2"
                 if activity == target:
-                    self.transition_function["response_2"].add((activity, "response_1"))
+                    self.transition_function["response_2"][activity] = "response_1"
 
+            self.collapse_default_transitions()
             self.initial_states = {"response_1"}
             self.accepting_states = {"response_1"}
             self.error_states = set()
@@ -393,18 +606,19 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"precedence_1", "precedence_2", "precedence_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["precedence_1"] = set()
-            self.transition_function["precedence_2"] = set()
-            self.transition_function["precedence_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["precedence_1"] = dict()
+            self.transition_function["precedence_2"] = dict()
+            self.transition_function["precedence_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == target and activity != source:
-                    self.transition_function["precedence_1"].add((activity, "precedence_3"))
+                    self.transition_function["precedence_1"][activity] = "precedence_3"
                 if activity == source:
-                    self.transition_function["precedence_1"].add((activity, "precedence_2"))
+                    self.transition_function["precedence_1"][activity] = "precedence_2"
                 if activity != source and activity != target:
-                    self.transition_function["precedence_1"].add((activity, "precedence_1"))
-                self.transition_function["precedence_2"].add((activity, "precedence_2"))
-                self.transition_function["precedence_3"].add((activity, "precedence_3"))
+                    self.transition_function["precedence_1"][activity] = "precedence_1"
+                self.transition_function["precedence_2"][activity] = "precedence_2"
+                self.transition_function["precedence_3"][activity] = "precedence_3"
+            self.collapse_default_transitions()
             self.initial_states = {"precedence_1"}
             self.accepting_states = {"precedence_1", "precedence_2"}
             self.error_states = set()
@@ -429,28 +643,29 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"succession_1", "succession_2", "succession_3", "succession_4"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["succession_1"] = set()
-            self.transition_function["succession_2"] = set()
-            self.transition_function["succession_3"] = set()
-            self.transition_function["succession_4"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["succession_1"] = dict()
+            self.transition_function["succession_2"] = dict()
+            self.transition_function["succession_3"] = dict()
+            self.transition_function["succession_4"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity != target and activity != source:
-                    self.transition_function["succession_1"].add((activity, "succession_1"))
+                    self.transition_function["succession_1"][activity] = "succession_1"
                 if activity == target and activity != source:
-                    self.transition_function["succession_1"].add((activity, "succession_2"))
+                    self.transition_function["succession_1"][activity] = "succession_2"
                 if activity == source and activity != target:
-                    self.transition_function["succession_1"].add((activity, "succession_3"))
+                    self.transition_function["succession_1"][activity] = "succession_3"
                 if activity == source and activity == target:
-                    self.transition_function["succession_1"].add((activity, "succession_4"))
+                    self.transition_function["succession_1"][activity] = "succession_4"
                 if activity == target:
-                    self.transition_function["succession_3"].add((activity, "succession_4"))
+                    self.transition_function["succession_3"][activity] = "succession_4"
                 if activity == source and activity != target:
-                    self.transition_function["succession_4"].add((activity, "succession_3"))
+                    self.transition_function["succession_4"][activity] = "succession_3"
                 if activity == target or activity != source:
-                    self.transition_function["succession_4"].add((activity, "succession_4"))
+                    self.transition_function["succession_4"][activity] = "succession_4"
                 if activity != target:
-                    self.transition_function["succession_3"].add((activity, "succession_3"))
-                self.transition_function["succession_2"].add((activity, "succession_2"))
+                    self.transition_function["succession_3"][activity] = "succession_3"
+                self.transition_function["succession_2"][activity] = "succession_2"
+            self.collapse_default_transitions()
             self.initial_states = {"succession_1"}
             self.accepting_states = {"succession_4"}
             self.error_states = set()
@@ -474,21 +689,22 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"alt-response_1", "alt-response_2", "alt-response_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["alt-response_1"] = set()
-            self.transition_function["alt-response_2"] = set()
-            self.transition_function["alt-response_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["alt-response_1"] = dict()
+            self.transition_function["alt-response_2"] = dict()
+            self.transition_function["alt-response_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == source:
-                    self.transition_function["alt-response_1"].add((activity, "alt-response_2"))
+                    self.transition_function["alt-response_1"][activity] = "alt-response_2"
                 if activity == source and activity != target:
-                    self.transition_function["alt-response_2"].add((activity, "alt-response_3"))
+                    self.transition_function["alt-response_2"][activity] = "alt-response_3"
                 if activity == target and activity != source:
-                    self.transition_function["alt-response_2"].add((activity, "alt-response_1"))
+                    self.transition_function["alt-response_2"][activity] = "alt-response_1"
                 if activity != source:
-                    self.transition_function["alt-response_1"].add((activity, "alt-response_1"))
+                    self.transition_function["alt-response_1"][activity] = "alt-response_1"
                 if (activity == source and activity == target) or (activity != source and activity != target):
-                    self.transition_function["alt-response_2"].add((activity, "alt-response_2"))
-                self.transition_function["alt-response_3"].add((activity, "alt-response_3"))
+                    self.transition_function["alt-response_2"][activity] = "alt-response_2"
+                self.transition_function["alt-response_3"][activity] = "alt-response_3"
+            self.collapse_default_transitions()
             self.initial_states = {"alt-response_1"}
             self.accepting_states = {"alt-response_1"}
             self.error_states = set()
@@ -512,21 +728,22 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"alt-precedence_1", "alt-precedence_2", "alt-precedence_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["alt-precedence_1"] = set()
-            self.transition_function["alt-precedence_2"] = set()
-            self.transition_function["alt-precedence_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["alt-precedence_1"] = dict()
+            self.transition_function["alt-precedence_2"] = dict()
+            self.transition_function["alt-precedence_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if (activity == source and activity == target) or (activity != source and activity != target):
-                    self.transition_function["alt-precedence_1"].add((activity, "alt-precedence_1"))
+                    self.transition_function["alt-precedence_1"][activity] = "alt-precedence_1"
                 if activity == source and activity != target:
-                    self.transition_function["alt-precedence_1"].add((activity, "alt-precedence_2"))
+                    self.transition_function["alt-precedence_1"][activity] = "alt-precedence_2"
                 if activity == target and activity != source:
-                    self.transition_function["alt-precedence_1"].add((activity, "alt-precedence_3"))
+                    self.transition_function["alt-precedence_1"][activity] = "alt-precedence_3"
                 if activity == target:
-                    self.transition_function["alt-precedence_2"].add((activity, "alt-precedence_1"))
+                    self.transition_function["alt-precedence_2"][activity] = "alt-precedence_1"
                 if activity != target:
-                    self.transition_function["alt-precedence_2"].add((activity, "alt-precedence_2"))
-                self.transition_function["alt-precedence_3"].add((activity, "alt-precedence_3"))
+                    self.transition_function["alt-precedence_2"][activity] = "alt-precedence_2"
+                self.transition_function["alt-precedence_3"][activity] = "alt-precedence_3"
+            self.collapse_default_transitions()
             self.initial_states = {"alt-precedence_1"}
             self.accepting_states = {"alt-precedence_1", "alt-precedence_2"}
             self.error_states = set()
@@ -536,22 +753,23 @@ class DeterministicFiniteAutomaton:
         self.id = id
         self.states = {"alt_succession_1", "alt_succession_2", "alt_succession_3"}
         self.alphabet = multi_process_alphabet
-        self.transition_function["alt_succession_1"] = set()
-        self.transition_function["alt_succession_2"] = set()
-        self.transition_function["alt_succession_3"] = set()
-        for activity in multi_process_alphabet:
+        self.transition_function["alt_succession_1"] = dict()
+        self.transition_function["alt_succession_2"] = dict()
+        self.transition_function["alt_succession_3"] = dict()
+        for activity in self.template_activities(multi_process_alphabet, source, target):
             if activity != source and activity != target:
-                self.transition_function["alt_succession_1"].add((activity, "alt_succession_1"))
-                self.transition_function["alt_succession_3"].add((activity, "alt_succession_3"))
+                self.transition_function["alt_succession_1"][activity] = "alt_succession_1"
+                self.transition_function["alt_succession_3"][activity] = "alt_succession_3"
             if activity == target:
-                self.transition_function["alt_succession_1"].add((activity, "alt_succession_2"))
+                self.transition_function["alt_succession_1"][activity] = "alt_succession_2"
             if activity == source:
-                self.transition_function["alt_succession_3"].add((activity, "alt_succession_2")) 
+                self.transition_function["alt_succession_3"][activity] = "alt_succession_2" 
             if activity == source and activity != target:
-                self.transition_function["alt_succession_1"].add((activity, "alt_succession_3"))
+                self.transition_function["alt_succession_1"][activity] = "alt_succession_3"
             if activity == target and activity != source:
-                self.transition_function["alt_succession_3"].add((activity, "alt_succession_1"))
-            self.transition_function["alt_succession_2"].add((activity, "alt_succession_2"))
+                self.transition_function["alt_succession_3"][activity] = "alt_succession_1"
+            self.transition_function["alt_succession_2"][activity] = "alt_succession_2"
+        self.collapse_default_transitions()
         self.initial_states = {"alt_succession_1"}
         self.accepting_states ={"alt_succession_1"}
         self.error_states = set()
@@ -575,21 +793,22 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"chain-response_1", "chain-response_2", "chain-response_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["chain-response_1"] = set()
-            self.transition_function["chain-response_2"] = set()
-            self.transition_function["chain-response_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["chain-response_1"] = dict()
+            self.transition_function["chain-response_2"] = dict()
+            self.transition_function["chain-response_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == source:
-                    self.transition_function["chain-response_1"].add((activity, "chain-response_2"))
+                    self.transition_function["chain-response_1"][activity] = "chain-response_2"
                 if activity != target:
-                    self.transition_function["chain-response_2"].add((activity, "chain-response_3"))
+                    self.transition_function["chain-response_2"][activity] = "chain-response_3"
                 if activity == target and activity != source:
-                    self.transition_function["chain-response_2"].add((activity, "chain-response_1"))
+                    self.transition_function["chain-response_2"][activity] = "chain-response_1"
                 if activity != source:
-                    self.transition_function["chain-response_1"].add((activity, "chain-response_1"))
+                    self.transition_function["chain-response_1"][activity] = "chain-response_1"
                 if (activity == source and activity == target):
-                    self.transition_function["chain-response_2"].add((activity, "chain-response_2"))
-                self.transition_function["chain-response_3"].add((activity, "chain-response_3"))
+                    self.transition_function["chain-response_2"][activity] = "chain-response_2"
+                self.transition_function["chain-response_3"][activity] = "chain-response_3"
+            self.collapse_default_transitions()
             self.initial_states = {"chain-response_1"}
             self.accepting_states = {"chain-response_1"}
             self.error_states = set()
@@ -613,21 +832,22 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"chain-precedence_1", "chain-precedence_2", "chain-precedence_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["chain-precedence_1"] = set()
-            self.transition_function["chain-precedence_2"] = set()
-            self.transition_function["chain-precedence_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["chain-precedence_1"] = dict()
+            self.transition_function["chain-precedence_2"] = dict()
+            self.transition_function["chain-precedence_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity != source:
-                    self.transition_function["chain-precedence_1"].add((activity, "chain-precedence_2"))
+                    self.transition_function["chain-precedence_1"][activity] = "chain-precedence_2"
                 if activity == target:
-                    self.transition_function["chain-precedence_2"].add((activity, "chain-precedence_3"))
+                    self.transition_function["chain-precedence_2"][activity] = "chain-precedence_3"
                 if activity == source and activity != target:
-                    self.transition_function["chain-precedence_2"].add((activity, "chain-precedence_1"))
+                    self.transition_function["chain-precedence_2"][activity] = "chain-precedence_1"
                 if activity == source:
-                    self.transition_function["chain-precedence_1"].add((activity, "chain-precedence_1"))
+                    self.transition_function["chain-precedence_1"][activity] = "chain-precedence_1"
                 if (activity != source and activity != target):
-                    self.transition_function["chain-precedence_2"].add((activity, "chain-precedence_2"))
-                self.transition_function["chain-precedence_3"].add((activity, "chain-precedence_3"))
+                    self.transition_function["chain-precedence_2"][activity] = "chain-precedence_2"
+                self.transition_function["chain-precedence_3"][activity] = "chain-precedence_3"
+            self.collapse_default_transitions()
             self.initial_states = {"chain-precedence_1"}
             self.accepting_states = {"chain-precedence_1", "chain-precedence_2"}
             self.error_states = set()
@@ -652,28 +872,29 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"chain-succession_1", "chain-succession_2", "chain-succession_3", "chain-succession_4"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["chain-succession_1"] = set()
-            self.transition_function["chain-succession_2"] = set()
-            self.transition_function["chain-succession_3"] = set()
-            self.transition_function["chain-succession_4"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["chain-succession_1"] = dict()
+            self.transition_function["chain-succession_2"] = dict()
+            self.transition_function["chain-succession_3"] = dict()
+            self.transition_function["chain-succession_4"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity != source:
-                    self.transition_function["chain-succession_1"].add((activity, "chain-succession_2"))
+                    self.transition_function["chain-succession_1"][activity] = "chain-succession_2"
                 if activity == source:
-                    self.transition_function["chain-succession_1"].add((activity, "chain-succession_3"))
+                    self.transition_function["chain-succession_1"][activity] = "chain-succession_3"
                 if activity != target:
-                    self.transition_function["chain-succession_3"].add((activity, "chain-succession_4"))
+                    self.transition_function["chain-succession_3"][activity] = "chain-succession_4"
                 if activity == target:
-                    self.transition_function["chain-succession_2"].add((activity, "chain-succession_4"))
+                    self.transition_function["chain-succession_2"][activity] = "chain-succession_4"
                 if activity == source and activity != target:
-                    self.transition_function["chain-succession_2"].add((activity, "chain-succession_3"))
+                    self.transition_function["chain-succession_2"][activity] = "chain-succession_3"
                 if activity == target and activity != source:
-                    self.transition_function["chain-succession_3"].add((activity, "chain-succession_2"))
+                    self.transition_function["chain-succession_3"][activity] = "chain-succession_2"
                 if activity != source and activity != target:
-                    self.transition_function["chain-succession_2"].add((activity, "chain-succession_2"))
+                    self.transition_function["chain-succession_2"][activity] = "chain-succession_2"
                 if activity == source and activity == target:
-                    self.transition_function["chain-succession_3"].add((activity, "chain-succession_3")) 
-                self.transition_function["chain-succession_4"].add((activity, "chain-succession_4"))
+                    self.transition_function["chain-succession_3"][activity] = "chain-succession_3" 
+                self.transition_function["chain-succession_4"][activity] = "chain-succession_4"
+            self.collapse_default_transitions()
             self.initial_states = {"chain-succession_1"}
             self.accepting_states = {"chain-succession_1", "chain-succession_2"}
             self.error_states = set()
@@ -699,28 +920,29 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"not-coexistence_1", "not-coexistence_2", "not-coexistence_3", "not-coexistence_4"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["not-coexistence_1"] = set()
-            self.transition_function["not-coexistence_2"] = set()
-            self.transition_function["not-coexistence_3"] = set()
-            self.transition_function["not-coexistence_4"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["not-coexistence_1"] = dict()
+            self.transition_function["not-coexistence_2"] = dict()
+            self.transition_function["not-coexistence_3"] = dict()
+            self.transition_function["not-coexistence_4"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == target and activity != source:
-                    self.transition_function["not-coexistence_1"].add((activity, "not-coexistence_2"))
+                    self.transition_function["not-coexistence_1"][activity] = "not-coexistence_2"
                 if activity == source and activity != target:
-                    self.transition_function["not-coexistence_1"].add((activity, "not-coexistence_3"))
+                    self.transition_function["not-coexistence_1"][activity] = "not-coexistence_3"
                 if activity == source and activity == target:
-                    self.transition_function["not-coexistence_1"].add((activity, "not-coexistence_4"))
+                    self.transition_function["not-coexistence_1"][activity] = "not-coexistence_4"
                 if activity == source:
-                    self.transition_function["not-coexistence_2"].add((activity, "not-coexistence_4"))
+                    self.transition_function["not-coexistence_2"][activity] = "not-coexistence_4"
                 if activity == target:
-                    self.transition_function["not-coexistence_3"].add((activity, "not-coexistence_4"))
+                    self.transition_function["not-coexistence_3"][activity] = "not-coexistence_4"
                 if activity != source:
-                    self.transition_function["not-coexistence_2"].add((activity, "not-coexistence_2"))
+                    self.transition_function["not-coexistence_2"][activity] = "not-coexistence_2"
                 if activity != target:
-                    self.transition_function["not-coexistence_3"].add((activity, "not-coexistence_3"))
+                    self.transition_function["not-coexistence_3"][activity] = "not-coexistence_3"
                 if activity != source and activity != target:
-                    self.transition_function["not-coexistence_1"].add((activity, "not-coexistence_1"))
-                self.transition_function["not-coexistence_4"].add((activity, "not-coexistence_4"))
+                    self.transition_function["not-coexistence_1"][activity] = "not-coexistence_1"
+                self.transition_function["not-coexistence_4"][activity] = "not-coexistence_4"
+            self.collapse_default_transitions()
             self.initial_states = {"not-coexistence_1"}
             self.accepting_states ={"not-coexistence_1", "not-coexistence_2", "not-coexistence_3"}
             self.error_states = set()
@@ -744,21 +966,22 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"neg-succession_1", "neg-succession_2", "neg-succession_3"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["neg-succession_1"] = set()
-            self.transition_function["neg-succession_2"] = set()
-            self.transition_function["neg-succession_3"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["neg-succession_1"] = dict()
+            self.transition_function["neg-succession_2"] = dict()
+            self.transition_function["neg-succession_3"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity == source and activity != target:
-                    self.transition_function["neg-succession_1"].add((activity, "neg-succession_2"))
+                    self.transition_function["neg-succession_1"][activity] = "neg-succession_2"
                 if activity == source and activity == target:
-                    self.transition_function["neg-succession_1"].add((activity, "neg-succession_3"))
+                    self.transition_function["neg-succession_1"][activity] = "neg-succession_3"
                 if activity == target:
-                    self.transition_function["neg-succession_2"].add((activity, "neg-succession_3"))
+                    self.transition_function["neg-succession_2"][activity] = "neg-succession_3"
                 if activity != source:
-                    self.transition_function["neg-succession_1"].add((activity, "neg-succession_1"))
+                    self.transition_function["neg-succession_1"][activity] = "neg-succession_1"
                 if activity != target:
-                    self.transition_function["neg-succession_2"].add((activity, "neg-succession_2"))
-                self.transition_function["neg-succession_3"].add((activity, "neg-succession_3"))
+                    self.transition_function["neg-succession_2"][activity] = "neg-succession_2"
+                self.transition_function["neg-succession_3"][activity] = "neg-succession_3"
+            self.collapse_default_transitions()
             self.initial_states = {"neg-succession_1"}
             self.accepting_states = {"neg-succession_1", "neg-succession_2"}
             self.error_states = set()
@@ -786,45 +1009,50 @@ class DeterministicFiniteAutomaton:
             self.id = id
             self.states = {"neg-chain-succession_1", "neg-chain-succession_2", "neg-chain-succession_3" "neg-chain-succession_4","neg-chain-succession_5"}
             self.alphabet = multi_process_alphabet
-            self.transition_function["neg-chain-succession_1"] = set()
-            self.transition_function["neg-chain-succession_2"] = set()
-            self.transition_function["neg-chain-succession_3"] = set()
-            self.transition_function["neg-chain-succession_4"] = set()
-            self.transition_function["neg-chain-succession_5"] = set()
-            for activity in multi_process_alphabet:
+            self.transition_function["neg-chain-succession_1"] = dict()
+            self.transition_function["neg-chain-succession_2"] = dict()
+            self.transition_function["neg-chain-succession_3"] = dict()
+            self.transition_function["neg-chain-succession_4"] = dict()
+            self.transition_function["neg-chain-succession_5"] = dict()
+            for activity in self.template_activities(multi_process_alphabet, source, target):
                 if activity != source and activity != target:
-                    self.transition_function["neg-chain-succession_1"].add((activity, "neg-chain-succession_1"))
+                    self.transition_function["neg-chain-succession_1"][activity] = "neg-chain-succession_1"
                 if activity == source and activity != target:
-                    self.transition_function["neg-chain-succession_3"].add((activity, "neg-chain-succession_3"))
+                    self.transition_function["neg-chain-succession_3"][activity] = "neg-chain-succession_3"
                 if activity == target and activity != source:
-                    self.transition_function["neg-chain-succession_2"].add((activity, "neg-chain-succession_2"))
+                    self.transition_function["neg-chain-succession_2"][activity] = "neg-chain-succession_2"
                 if activity != source and activity == target:
-                    self.transition_function["neg-chain-succession_1"].add((activity, "neg-chain-succession_2"))
+                    self.transition_function["neg-chain-succession_1"][activity] = "neg-chain-succession_2"
                 if activity != source and activity != target:
-                    self.transition_function["neg-chain-succession_2"].add((activity, "neg-chain-succession_1"))
+                    self.transition_function["neg-chain-succession_2"][activity] = "neg-chain-succession_1"
                 if activity == source and activity != target:
-                    self.transition_function["neg-chain-succession_1"].add((activity, "neg-chain-succession_3"))
+                    self.transition_function["neg-chain-succession_1"][activity] = "neg-chain-succession_3"
                 if activity != source and activity != target:
-                    self.transition_function["neg-chain-succession_3"].add((activity, "neg-chain-succession_1"))
+                    self.transition_function["neg-chain-succession_3"][activity] = "neg-chain-succession_1"
                 if activity == target and activity == source:
-                    self.transition_function["neg-chain-succession_1"].add((activity, "neg-chain-succession_4"))
+                    self.transition_function["neg-chain-succession_1"][activity] = "neg-chain-succession_4"
                 if activity != source and activity != target:
-                    self.transition_function["neg-chain-succession_4"].add((activity, "neg-chain-succession_1"))
+                    self.transition_function["neg-chain-succession_4"][activity] = "neg-chain-succession_1"
                 if activity == source:
-                    self.transition_function["neg-chain-succession_2"].add((activity, "neg-chain-succession_5"))
+                    self.transition_function["neg-chain-succession_2"][activity] = "neg-chain-succession_5"
                 if activity == target:
-                    self.transition_function["neg-chain-succession_3"].add((activity, "neg-chain-succession_5"))
+                    self.transition_function["neg-chain-succession_3"][activity] = "neg-chain-succession_5"
                 if activity == source or activity == target:
-                    self.transition_function["neg-chain-succession_4"].add((activity, "neg-chain-succession_5"))
-                self.transition_function["neg-chain-succession_5"].add((activity, "neg-chain-succession_5"))
+                    self.transition_function["neg-chain-succession_4"][activity] = "neg-chain-succession_5"
+                self.transition_function["neg-chain-succession_5"][activity] = "neg-chain-succession_5"
+            self.collapse_default_transitions()
             self.initial_states = {"neg-chain-succession_1"}
             self.accepting_states = {"neg-chain-succession_1", "neg-chain-succession_2", "neg-chain-succession_3"}
             self.error_states = set()
             return self
 
-    def add_process(self,process):
+    def add_process(self,process, reachable_only=False):
+        if reachable_only and self.states:
+            return self.add_process_reachable(process)
+
         newStates = set()
         newTransitions = {}
+        newDefaults = {}
         newInits = set()
         newAccepting = set()
         newErrors = set()
@@ -853,9 +1081,17 @@ class DeterministicFiniteAutomaton:
                 newAccepting.add((accept,))
         self.accepting_states = newAccepting
 
+        own_alphabet = set(self.alphabet)
         self.alphabet.update(process.alphabet)
 
+        def combine(s, t):
+            if type(s) is str:
+                return (s, t)
+            return s + (t,)
+
+        control = current_control()
         for state in process.states:
+            control.checkpoint(len(newStates), len(newTransitions))
             if self.states:
                 for s in self.states:
                     new_state = ()
@@ -868,43 +1104,123 @@ class DeterministicFiniteAutomaton:
                     newStates.add(new_state)
                     #newStates.add((s, state))
                     # self.states.update(state)
-                    newTransitions[new_state] = set()
-                    if s in self.transition_function:
-                        for t in self.transition_function[s]:
-                            target = ()
-                            if type(t[1]) is str:
-                                target = (t[1], state)
-                            else:
-                                target = t[1] + (state,)
-                            newTransitions[new_state].add((t[0], target))
-                    if state in process.transition_function:
-                        for trans in process.transition_function[state]:
-                            target = ()
-                            if type(s) is str:
-                                target = (s, trans[1])
-                            else: 
-                                target = s +(trans[1],)
-                            newTransitions[new_state].add((trans[0], target))
+                    moves, default = self.product_moves(process, own_alphabet, s, state)
+                    newTransitions[new_state] = {symbol: combine(*move) for symbol, move in moves.items()}
+                    if default is not None:
+                        newDefaults[new_state] = combine(*default)
             else:
                 newStates.add((state,))
                 if state in process.transition_function:
-                    newTransitions[(state,)] = set()
-                    for trans in process.transition_function[state]:
-                        newTransitions[(state,)].add((trans[0], (trans[1],)))
+                    newTransitions[(state,)] = dict()
+                    for symbol, t in process.transition_function[state].items():
+                        newTransitions[(state,)][symbol] = (t,)
+                if state in process.default_transitions:
+                    newDefaults[(state,)] = (process.default_transitions[state],)
+
+        self.states = newStates
+        self.error_states = newErrors
+        self.transition_function = newTransitions
+        self.default_transitions = newDefaults
+        return self
+
+    def product_moves(self, process, own_alphabet, s, state):
+        # Moves of the pair (s, state) as {symbol: (s_next, state_next)} plus the pair every other symbol
+        # leads to (None if there is none). A symbol shared by both sides keeps the first move unless that
+        # one is an error. Only when both default edges are errors the result can keep a default edge,
+        # otherwise every symbol is spelled out
+        own_transitions = self.transition_function.get(s, dict())
+        other_transitions = process.transition_function.get(state, dict())
+        own_default = self.default_transitions.get(s)
+        other_default = process.default_transitions.get(state)
+        keep_default = own_default in self.error_states and other_default in process.error_states
+        symbols = own_transitions.keys() | other_transitions.keys() if keep_default else own_alphabet | process.alphabet
+
+        moves = dict()
+        for symbol in symbols:
+            own_move = self.next_state(s, symbol) if symbol in own_alphabet else None
+            if own_move is not None and (own_move not in self.error_states or symbol not in process.alphabet):
+                moves[symbol] = (own_move, state)
+                continue
+            other_move = process.next_state(state, symbol) if symbol in process.alphabet else None
+            if other_move is not None:
+                moves[symbol] = (s, other_move)
+            elif own_move is not None:
+                moves[symbol] = (own_move, state)
+        return moves, (own_default, other_default) if keep_default else None
+
+    def add_process_reachable(self, process):
+        # Forward exploration from the combined initial states: only reachable tuples are built and
+        # every edge into an error state goes straight to the merged error sink, as rewire_Errors would do
+        error = tuple(("ERROR_STATE",))
+
+        def combine(s, t):
+            if type(s) is str:
+                return (s, t)
+            return s + (t,)
+
+        newStates = set()
+        newTransitions = {}
+        newDefaults = {}
+        newInits = set()
+        newAccepting = set()
+        newErrors = set()
+
+        own_alphabet = set(self.alphabet)
+        self.alphabet.update(process.alphabet)
+
+        frontier = deque()
+        for i in self.initial_states:
+            for init in process.initial_states:
+                new_state = combine(i, init)
+                newInits.add(new_state)
+                if new_state not in newStates:
+                    newStates.add(new_state)
+                    frontier.append((new_state, i, init))
+
+        control = current_control()
+        while frontier:
+            new_state, s, state = frontier.popleft()
+            control.checkpoint(len(newStates), len(newTransitions))
+            if s in self.accepting_states and state in process.accepting_states:
+                newAccepting.add(new_state)
+
+            moves, default = self.product_moves(process, own_alphabet, s, state)
+            successors = dict()
+            for symbol, (s_next, t_next) in moves.items():
+                if s_next in self.error_states or t_next in process.error_states:
+                    successors[symbol] = error
+                    continue
+                target = combine(s_next, t_next)
+                successors[symbol] = target
+                if target not in newStates:
+                    newStates.add(target)
+                    frontier.append((target, s_next, t_next))
+            newTransitions[new_state] = successors
+            if default is not None:
+                newDefaults[new_state] = error
+            if default is not None or error in successors.values():
+                newErrors.add(error)
+
+        if newErrors:
+            newStates.add(error)
+            newTransitions[error] = dict()
+            newDefaults[error] = error
 
         self.states = newStates
+        self.initial_states = newInits
+        self.accepting_states = newAccepting
         self.error_states = newErrors
         self.transition_function = newTransitions
+        self.default_transitions = newDefaults
         return self
 
-    def add_constraint(self, constraint):
-        current_elements = len(next(iter(self.states)))
+    def add_constraint(self, constraint, classes=None):
         newStates = set()
         newTransitions = {}
+        newDefaults = {}
         newInits = set()
         newAccepting = set()
         newErrors = set()
-        usedStates = set()
 
         # Create initial states
         for init in constraint.initial_states:
@@ -912,56 +1228,63 @@ class DeterministicFiniteAutomaton:
                 new_state = (*m, init)
                 newInits.add(new_state)
                 newStates.add(new_state)
-        self.initial_states = newInits
 
         # Add inputs
-        self.alphabet = set(self.alphabet) | set(constraint.alphabet)
-
-        # Process transitions
-        while usedStates != newStates:
-            for state in newStates.copy():
-                if state in usedStates:
-                    continue
-                last = len(state) - 1
-                hybrid_state = state[:-1]
-                if hybrid_state in self.error_states:
-                    newErrors.add(state)
-                constraint_state = state[-1]
-
-                trans_hybrid = self.transition_function.get(hybrid_state, set())
-                trans_constraint = constraint.transition_function.get(constraint_state, set())
-
-                symbols_hybrid = {t[0] for t in trans_hybrid}
-                symbols_constraint = {t[0] for t in trans_constraint}
-
-                for sym, tgt in trans_hybrid:
-                    matched = False
-                    for sym_c, tgt_c in trans_constraint:
-                        if sym == sym_c:
-                            matched = True
-                            next_state = (*tgt, tgt_c)
-                            newStates.add(next_state)
-                            newTransitions.setdefault(state, set()).add((sym, next_state))
-                    if not matched:
-                        next_state = (*tgt, constraint_state)
-                        newStates.add(next_state)
-                        newTransitions.setdefault(state, set()).add((sym, next_state))
-
-                if not trans_constraint:
-                    for sym, tgt in trans_hybrid:
-                        next_state = (*tgt, constraint_state)
-                        newStates.add(next_state)
-                        newTransitions.setdefault(state, set()).add((sym, next_state))
-
-                accepting = state[:current_elements]
-                if accepting in self.accepting_states:
-                    newAccepting.add(state)
-
-                usedStates.add(state)
-
+        hybrid_alphabet = set(self.alphabet)
+        alphabet = set(self.alphabet) | set(constraint.alphabet)
+        class_of, _ = classes if classes is not None else symbol_classes([constraint], alphabet)
+
+        # Process transitions, breadth first: every product state is expanded exactly once
+        frontier = deque(newInits)
+        control = current_control()
+        while frontier:
+            state = frontier.popleft()
+            control.checkpoint(len(newStates), len(newTransitions))
+            hybrid_state = state[:-1]
+            if hybrid_state in self.error_states:
+                newErrors.add(state)
+            if hybrid_state in self.accepting_states:
+                newAccepting.add(state)
+            constraint_state = state[-1]
+
+            trans_hybrid = self.transition_function.get(hybrid_state, dict())
+            trans_constraint = constraint.transition_function.get(constraint_state, dict())
+            hybrid_default = self.default_transitions.get(hybrid_state)
+            constraint_default = constraint.default_transitions.get(constraint_state, constraint_state)
+
+            # both automata are deterministic, so the product step is a lookup join on the symbol;
+            # the constraint side is looked up once per symbol class
+            successors = dict()
+            class_targets = dict()
+            for sym, tgt in trans_hybrid.items():
+                symbol_class = class_of.get(sym, sym)
+                if symbol_class not in class_targets:
+                    class_targets[symbol_class] = trans_constraint.get(sym, constraint_default)
+                successors[sym] = (*tgt, class_targets[symbol_class])
+            next_states = set(successors.values())
+            if hybrid_default is not None:
+                # symbols covered by the default edge of the hybrid only need an edge of their own where the constraint moves differently
+                for sym, tgt in trans_constraint.items():
+                    if sym not in successors and sym in hybrid_alphabet and tgt != constraint_default:
+                        successors[sym] = (*hybrid_default, tgt)
+                        next_states.add(successors[sym])
+                newDefaults[state] = (*hybrid_default, constraint_default)
+                next_states.add(newDefaults[state])
+
+            if successors:
+                newTransitions[state] = successors
+            for next_state in next_states:
+                if next_state not in newStates:
+                    newStates.add(next_state)
+                    frontier.append(next_state)
+
+        # the hybrid is only replaced once the product is complete, a build stopped by its budget keeps the previous one
+        self.initial_states = newInits
+        self.alphabet = alphabet
         self.error_states = newErrors
         self.states = newStates
         self.transition_function = newTransitions
+        self.default_transitions = newDefaults
         self.accepting_states = newAccepting
 
         return self
@@ -973,29 +1296,35 @@ class DeterministicFiniteAutomaton:
 
         self.states.add(error)
         self.error_states.add(error)
-        self.transition_function[error] = set()
+        self.transition_function[error] = dict()
 
         states = set()
         transitions = dict()
         errors = set()
 
         states.add(error)
-        transitions[error] = set()
+        transitions[error] = dict()
         errors.add(error)
 
+        defaults = dict()
+        for state, target in self.default_transitions.items():
+            if state in self.error_states:
+                continue
+            defaults[state] = error if target in self.error_states else target
+        defaults[error] = error
+
         for state in self.transition_function:
             if state in self.error_states:
                 continue
             else:
-                transitions[state] = set()
-            for transition, target in self.transition_function[state]:
+                transitions[state] = dict()
+            for transition, target in self.transition_function[state].items():
                 if target in self.error_states:
-                    transitions[state].add((transition, error))
+                    # already covered when the default edge leads to the error as well
+                    if defaults.get(state) != error:
+                        transitions[state][transition] = error
                 else: 
-                    transitions[state].add((transition, target))
-
-        for transition in self.alphabet:
-            transitions[error].add((transition, error))
+                    transitions[state][transition] = target
 
         for state in self.states:
             if state not in self.error_states:
@@ -1003,6 +1332,7 @@ class DeterministicFiniteAutomaton:
 
         self.states = states
         self.transition_function = transitions
+        self.default_transitions = defaults
         self.error_states = errors
 
     def drawSingleDFA(self,name):
@@ -1027,7 +1357,7 @@ class DeterministicFiniteAutomaton:
         for state in self.transition_function:
             has_self_loop = False
             transitions = set()
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1047,7 +1377,7 @@ class DeterministicFiniteAutomaton:
         #     if self.transition_function[state] == set():
         #         dot.edge(str(state), str(state), label= "true")
         #     else:
-        #         for activity, target in self.transition_function[state]:
+        #         for activity, target in self.transition_function[state].items():
         #             if target not in targets:
         #                 targets[target] = set()
         #             tmp = targets[target]
@@ -1075,7 +1405,7 @@ class DeterministicFiniteAutomaton:
             # has_self_loop = False
             # transition_labels = set()
             # transitions = dict()
-            # for activity, target in self.transition_function[state]:
+            # for activity, target in self.transition_function[state].items():
             #     if target == state:
             #         has_self_loop = True
             #         continue
@@ -1095,6 +1425,8 @@ class DeterministicFiniteAutomaton:
 
 
 
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
 
     def drawConstraintDFA(self,name):
@@ -1123,7 +1455,7 @@ class DeterministicFiniteAutomaton:
             transitions = set()
 
 
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1144,6 +1476,8 @@ class DeterministicFiniteAutomaton:
 
 
 
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
 
     def drawMultiDFA(self,name):
@@ -1167,7 +1501,7 @@ class DeterministicFiniteAutomaton:
         for state in self.transition_function:
             has_self_loop = False
             transitions = set()
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1178,6 +1512,8 @@ class DeterministicFiniteAutomaton:
                     dot.edge(str(state), str(state), label="true")
                 else: 
                     dot.edge(str(state), str(state), label= "!(" + " | ".join(transitions) + ")")
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
 
     def drawHybridDFA(self):
@@ -1201,7 +1537,7 @@ class DeterministicFiniteAutomaton:
         for state in self.transition_function:
             has_self_loop = False
             transitions = set()
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1212,6 +1548,8 @@ class DeterministicFiniteAutomaton:
                     dot.edge(str(state), str(state), label= "true")
                 else: 
                     dot.edge(str(state), str(state), label= "!(" + " | ".join(transitions) + ")")
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
     
 class ColoredDFA():
@@ -1223,7 +1561,10 @@ class ColoredDFA():
         self.initial_states = dfa.initial_states
         self.accepting_states = dfa.accepting_states
         self.error_states = dfa.error_states
+        self.default_transitions = dfa.default_transitions
         self.colors = dict()
+        self.predecessors = None
+        self.colouring_stats = dict()
 
     def add_colours(self,num_processes,constraint_DFAs):
         numberProcesses = num_processes
@@ -1249,78 +1590,103 @@ class ColoredDFA():
         self.colors = colouredStates
         return self
 
-    def changeColours(self, counter, index, constraintName, currentState, currentColour, visited):
-        satisfied = "satisfied"
-        violated = "violated"
-        temporary_satisfied = "temporary_satisfied"
-        temporary_violated = "temporary_violated"
-
-        if currentState in visited:
-            if currentState not in self.accepting_states and (self.colors[currentState][index][constraintName] == satisfied or self.colors[currentState][index][constraintName] == violated) and currentState in self.transition_function:
-                counter += 1
-                reachableColours = {self.colors[target[1]][index][constraintName] for target in self.transition_function[currentState] if target[1] not in self.error_states}
-                if currentColour == satisfied:
-                    if violated in reachableColours or temporary_satisfied in reachableColours:
-                        self.colors[currentState][index][constraintName] = temporary_satisfied
-                elif currentColour == violated:
-                    if satisfied in reachableColours or temporary_violated in reachableColours:
-                        self.colors[currentState][index][constraintName] = temporary_violated
-            return self, counter, visited
-
-        counter += 1
-
-        visited.add(currentState) 
-
-        # Depth First Search to explore all reachable states
-        if currentState in self.transition_function and self.transition_function[currentState]:
-            for target in self.transition_function[currentState]:
-                if target[1] in self.accepting_states or target[1] in self.error_states:
-                    continue
-                self, counter, visited_ret = self.changeColours(counter, index, constraintName, target[1], self.colors[target[1]][index][constraintName], visited.copy())
-                visited = visited_ret.copy()
-            reachableColours = {self.colors[target[1]][index][constraintName] for target in self.transition_function[currentState] if target[1] not in self.error_states}
-            if currentColour == satisfied:
-                if violated in reachableColours or temporary_satisfied in reachableColours:
-                    self.colors[currentState][index][constraintName] = temporary_satisfied
-            elif currentColour == violated:
-                if satisfied in reachableColours or temporary_violated in reachableColours:
-                    self.colors[currentState][index][constraintName] = temporary_violated
-        else:
-            self.colors[currentState][index][constraintName] = currentColour
-        
-        return self, counter, visited
-    
-    def changeColours2(self, counter, index, constraintName, currentState, currentColour, visited):
-        counter += 1
+    def minimize(self):
+        # Hopcroft minimization of the coloured hybrid: states are only merged if they agree on
+        # accepting, error and every constraint colour, so monitoring behaviour is unchanged
+        merged = minimize_automaton(self, lambda state: tuple(next(iter(colour.values())) for colour in self.colors[state]) if state in self.colors else None)
+        self.colors = {state: colours for state, colours in self.colors.items() if merged[state] == state}
+        self.current = merged[self.current]
+        self.predecessors = None
+        return self
 
+    def reverse_transitions(self):
+        # predecessor lists of every coloured state, error states are left out
+        predecessors = {state: [] for state in self.colors}
+        for state in predecessors:
+            targets = set(self.transition_function.get(state, dict()).values())
+            if state in self.default_transitions:
+                targets.add(self.default_transitions[state])
+            for target in targets:
+                if target in predecessors:
+                    predecessors[target].append(state)
+        return predecessors
+
+    def backward_reachable(self, predecessors, targets):
+        # breadth first search on the reversed edges, returns all states that can reach one of the targets
+        reached = set(targets)
+        frontier = deque(reached)
+        edges = 0
+        check = current_control().check
+        while frontier:
+            state = frontier.popleft()
+            check()
+            for predecessor in predecessors[state]:
+                edges += 1
+                if predecessor not in reached:
+                    reached.add(predecessor)
+                    frontier.append(predecessor)
+        return reached, edges
+
+    def colour_constraint(self, index, constraintName):
+        """
+        Colour every state for one constraint by the finished process runs it can still reach.
+
+        A state is violated when none of the finished runs it reaches satisfies the constraint, satisfied
+        when all of them do. A state that reaches both is inconclusive. The four-colour UI has no colour
+        for that, so it leans the way the constraint state does now: temporary_satisfied when that state
+        is accepting, temporary_violated otherwise.
+
+        This is not what the recursive changeColours it replaces showed. changeColours started from the
+        current constraint state and only marked a state temporary when a state of the other colour could
+        follow. Colours now describe the outcome of the run, so they can differ. For example, existence(p)
+        is satisfied before p on a pool that always runs p, where changeColours gave temporary_violated.
+        benchmarks/colour_check.py pins the expected colours.
+
+        Returns:
+            The work done, one unit per state classified and per edge followed backwards
+        """
         satisfied = "satisfied"
         violated = "violated"
         temporary_satisfied = "temporary_satisfied"
         temporary_violated = "temporary_violated"
 
-        # Prevent infinite recursion by checking if we've already visited this state
-        if currentState in visited:
-            #print("Already visited", currentState)
-            return self, counter
-        
-        visited.add(currentState)
-
-        # Depth First Search to explore all reachable states
-        if currentState in self.transition_function and self.transition_function[currentState]:
-            for target in self.transition_function[currentState]:
-                if target[1] not in visited:
-                    self, counter = self.changeColours2(counter, index, constraintName, target[1], self.colors[target[1]][index][constraintName], visited.copy())
-            reachableColours = {self.colors[target[1]][index][constraintName] for target in self.transition_function[currentState]}
-            if currentColour == satisfied:
-                if violated in reachableColours or temporary_satisfied in reachableColours:
-                    self.colors[currentState][index][constraintName] = temporary_satisfied
-            elif currentColour == violated:
-                if satisfied in reachableColours or temporary_violated in reachableColours:
-                    self.colors[currentState][index][constraintName] = temporary_violated
-        else:
-            self.colors[currentState][index][constraintName] = currentColour
-        
-        return self, counter
+        if self.predecessors is None:
+            self.predecessors = self.reverse_transitions()
+
+        # finished process runs split by whether the constraint holds (SatFinal / ViolFinal)
+        satFinal = set()
+        violFinal = set()
+        for state in self.accepting_states:
+            if state in self.colors:
+                if self.colors[state][index][constraintName] == satisfied:
+                    satFinal.add(state)
+                else:
+                    violFinal.add(state)
+
+        satReach, satEdges = self.backward_reachable(self.predecessors, satFinal)
+        violReach, violEdges = self.backward_reachable(self.predecessors, violFinal)
+
+        for state, stateColours in self.colors.items():
+            if state not in satReach:
+                colour = violated
+            elif state not in violReach:
+                colour = satisfied
+            elif stateColours[index][constraintName] == satisfied:
+                # both completions possible, the constraint state decides which way it leans right now
+                colour = temporary_satisfied
+            else:
+                colour = temporary_violated
+            stateColours[index][constraintName] = colour
+
+        counter = len(self.colors) + satEdges + violEdges
+        self.colouring_stats[constraintName] = {
+            "states": len(self.colors),
+            "edges": satEdges + violEdges,
+            "sat_reach": len(satReach),
+            "viol_reach": len(violReach),
+            "counter": counter,
+        }
+        return counter
     
 class ReturnColoredDFA():
     def __init__(self, dfa: ColoredDFA):
@@ -1331,6 +1697,7 @@ class ReturnColoredDFA():
         self.initial_states = next(iter(dfa.initial_states))
         self.accepting_states = dfa.accepting_states
         self.error_states = dfa.error_states
+        self.default_transitions = dfa.default_transitions
         self.colors = dfa.colors
 
     def drawColoredDFA(self):
@@ -1364,7 +1731,7 @@ class ReturnColoredDFA():
         for state in self.transition_function:
             has_self_loop = False
             transitions = set()
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1375,6 +1742,8 @@ class ReturnColoredDFA():
                     dot.edge(str(state), str(state), label= "true")
                 else: 
                     dot.edge(str(state), str(state), label= "!(" + " | ".join(transitions) + ")")
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
 
     def drawColoredDFAforConstraint(self,name,index):
@@ -1403,7 +1772,7 @@ class ReturnColoredDFA():
         for state in self.transition_function:
             has_self_loop = False
             transitions = set()
-            for activity, target in self.transition_function[state]:
+            for activity, target in self.transition_function[state].items():
                 if target == state:
                     has_self_loop = True
                     continue
@@ -1414,4 +1783,6 @@ class ReturnColoredDFA():
                     dot.edge(str(state), str(state), label= "true")
                 else: 
                     dot.edge(str(state), str(state), label= "!(" + " | ".join(transitions) + ")")
+        for state, target in self.default_transitions.items():
+            dot.edge(str(state), str(target), label="else")
         dot.render(directory="pic", view=False)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import re
+
+
+class StateSpaceLimitExceeded(RuntimeError):
+    """Raised when an exploration reaches more states than it is allowed to."""
+
+
+class UnsafeNetError(ValueError):
+    """Raised when a Petri net is not 1-safe, i.e. a marking cannot be encoded as a bitset."""
+
+
+def explore_markings(net, initial_marking, max_states=None):
+    """
+    Token game of a 1-safe pm4py Petri net, see explore_net.
+
+    Args:
+        net: pm4py PetriNet (places, transitions with in_arcs/out_arcs)
+        initial_marking: pm4py Marking of the net
+        max_states: maximum number of reachable markings, None for no limit
+    """
+    transitions = []
+    for transition in net.transitions:
+        for arc in list(transition.in_arcs) + list(transition.out_arcs):
+            if arc.weight != 1:
+                raise UnsafeNetError(f"arc weight {arc.weight} at {transition}")
+        transitions.append((repr(transition), [arc.source.name for arc in transition.in_arcs], [arc.target.name for arc in transition.out_arcs]))
+
+    initial_places = []
+    for place, count in initial_marking.items():
+        if count != 1:
+            raise UnsafeNetError(f"{count} tokens on {place} in the initial marking")
+        initial_places.append(place.name)
+
+    return explore_net([place.name for place in net.places], transitions, initial_places, max_states)
+
+
+def explore_net(places, transitions, initial_places, max_states=None):
+    """
+    Token game of a 1-safe Petri net with markings encoded as integer bitsets.
+
+    Every place is one bit, every transition a pair of pre/post masks, so enabling is a mask test and
+    firing is (marking & ~pre) | post. States get the names pm4py's reachability graph gives them.
+
+    Args:
+        places: place names
+        transitions: list of (transition name, input place names, output place names)
+        initial_places: names of the places marked initially
+        max_states: maximum number of reachable markings, None for no limit
+
+    Returns:
+        tuple (states, arcs) with
+            states: dict marking name -> (has incoming arc, has outgoing arc)
+            arcs: list of (source name, transition name, target name)
+
+    Raises:
+        UnsafeNetError: a reachable marking puts more than one token on a place
+        StateSpaceLimitExceeded: more than max_states markings are reachable
+    """
+    # bits in the order pm4py sorts the places of a marking, so names are built by walking the bits upwards
+    places = sorted(places)
+    bit_of = {place: 1 << i for i, place in enumerate(places)}
+    tokens = [re.sub(r"\W+", "", place) + "1" for place in places]
+
+    moves = []
+    for label, inputs, outputs in transitions:
+        pre = post = 0
+        for place in inputs:
+            pre |= bit_of[place]
+        for place in outputs:
+            post |= bit_of[place]
+        moves.append((pre, post, label))
+
+    initial = 0
+    for place in initial_places:
+        initial |= bit_of[place]
+
+    names = dict()
+
+    def name(marking):
+        if marking not in names:
+            parts = []
+            rest = marking
+            while rest:
+                low = rest & -rest
+                parts.append(tokens[low.bit_length() - 1])
+                rest ^= low
+            names[marking] = "".join(parts)
+        return names[marking]
+
+    seen = {initial}
+    has_incoming = set()
+    has_outgoing = set()
+    arcs = []
+    stack = [initial]
+    while stack:
+        marking = stack.pop()
+        for pre, post, label in moves:
+            if marking & pre != pre:
+                continue
+            rest = marking & ~pre
+            if rest & post:
+                raise UnsafeNetError(f"{label} puts a second token on a place")
+            target = rest | post
+            arcs.append((marking, label, target))
+            has_outgoing.add(marking)
+            has_incoming.add(target)
+            if target not in seen:
+                if max_states is not None and len(seen) >= max_states:
+                    raise StateSpaceLimitExceeded(f"more than {max_states} reachable markings")
+                seen.add(target)
+                stack.append(target)
+
+    states = {name(marking): (marking in has_incoming, marking in has_outgoing) for marking in seen}
+    return states, [(name(source), label, name(target)) for source, label, target in arcs]
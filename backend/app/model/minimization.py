@@ -0,0 +1,112 @@
+def hopcroft(table, labels):
+    """
+    Hopcroft partition refinement of a complete deterministic automaton.
+
+    Args:
+        table: per state list of successor ids, one entry per symbol (states are 0..n-1)
+        labels: per state hashable label, states with different labels never end up in the same block
+
+    Returns:
+        list with the block id of every state, block ids are numbered from 0 in order of first occurrence
+    """
+    n = len(table)
+    k = len(table[0]) if n else 0
+
+    # predecessors per symbol: inverse[a][t] lists the states s with table[s][a] == t
+    inverse = [dict() for _ in range(k)]
+    for state, row in enumerate(table):
+        for symbol, target in enumerate(row):
+            inverse[symbol].setdefault(target, []).append(state)
+
+    block_ids = dict()
+    block_of = [block_ids.setdefault(label, len(block_ids)) for label in labels]
+    blocks = [[] for _ in block_ids]
+    for state, block in enumerate(block_of):
+        blocks[block].append(state)
+
+    # every initial block but the largest one has to be used as a splitter
+    largest = max(range(len(blocks)), key=lambda block: len(blocks[block]), default=None)
+    waiting = [(block, symbol) for block in range(len(blocks)) if block != largest for symbol in range(k)]
+    in_waiting = set(waiting)
+
+    while waiting:
+        splitter = waiting.pop()
+        in_waiting.discard(splitter)
+        block, symbol = splitter
+
+        touched = dict()
+        for target in blocks[block]:
+            for state in inverse[symbol].get(target, ()):
+                touched.setdefault(block_of[state], []).append(state)
+
+        for split, inside in touched.items():
+            if len(inside) == len(blocks[split]):
+                continue
+            inside_set = set(inside)
+            new_block = len(blocks)
+            blocks.append(inside)
+            blocks[split] = [state for state in blocks[split] if state not in inside_set]
+            for state in inside:
+                block_of[state] = new_block
+            for a in range(k):
+                if (split, a) in in_waiting:
+                    entry = (new_block, a)
+                else:
+                    # only the smaller half needs to be processed
+                    entry = (new_block, a) if len(inside) <= len(blocks[split]) else (split, a)
+                waiting.append(entry)
+                in_waiting.add(entry)
+
+    # renumber in order of first occurrence so the result does not depend on the split order
+    renumbered = dict()
+    return [renumbered.setdefault(block, len(renumbered)) for block in block_of]
+
+
+def minimize_automaton(automaton, label):
+    """
+    Merge the language equivalent states of a tuple/string keyed automaton in place.
+
+    Args:
+        automaton: DeterministicFiniteAutomaton or ColoredDFA
+        label: function state -> hashable, only states with the same label can be merged
+            (accepting and error states are always kept apart)
+
+    Returns:
+        dict mapping every old state to the state that now stands for it
+    """
+    states = sorted(set(automaton.states) | set(automaton.transition_function), key=str)
+    index = {state: i for i, state in enumerate(states)}
+    alphabet = sorted(automaton.alphabet)
+
+    # missing transitions go to a virtual sink that is never merged with a real state
+    sink = len(states)
+    table = []
+    for state in states:
+        transitions = automaton.transition_function.get(state, dict())
+        default = automaton.default_transitions.get(state)
+        table.append([index.get(transitions.get(symbol, default), sink) for symbol in alphabet])
+    table.append([sink] * len(alphabet))
+    labels = [(state in automaton.accepting_states, state in automaton.error_states, label(state)) for state in states]
+    labels.append(("missing",))
+
+    block_of = hopcroft(table, labels)
+
+    # a block is named after its smallest member
+    representative = dict()
+    for i, state in enumerate(states):
+        representative.setdefault(block_of[i], state)
+    merged = {state: representative[block_of[i]] for i, state in enumerate(states)}
+
+    transitions = dict()
+    for state in states:
+        if merged[state] != state or state not in automaton.transition_function:
+            continue
+        transitions[state] = {symbol: merged[target] for symbol, target in automaton.transition_function[state].items()}
+
+    automaton.states = set(representative.values())
+    automaton.transition_function = transitions
+    automaton.default_transitions = {state: merged[target] for state, target in automaton.default_transitions.items() if merged[state] == state}
+    automaton.initial_states = {merged[state] for state in automaton.initial_states}
+    automaton.accepting_states = {merged[state] for state in automaton.accepting_states}
+    automaton.error_states = {merged[state] for state in automaton.error_states}
+    return merged
@@ -0,0 +1,207 @@
+import uuid
+
+BPMN_NS = "{http://www.omg.org/spec/BPMN/20100524/MODEL}"
+
+# process children that are neither nodes nor sequence flows and do not change the behaviour
+IGNORED_ELEMENTS = {"laneSet", "textAnnotation", "association", "documentation", "extensionElements", "dataObject",
+                    "dataObjectReference", "dataStoreReference", "group", "property", "ioSpecification"}
+
+
+class UnsupportedBpmnError(ValueError):
+    """Raised for BPMN constructs the direct translation does not handle, the pm4py conversion takes over."""
+
+
+def node_kind(tag):
+    # the node kinds of pm4py's importer the translation supports, None for everything else
+    if tag.lower().endswith("task"):
+        return "task"
+    if tag in ("startEvent", "endEvent", "exclusiveGateway", "parallelGateway"):
+        return tag
+    return None
+
+
+def translate_bpmn(root):
+    """
+    Workflow net of a pool with sequential, exclusive and parallel structure, built straight from the BPMN tree.
+
+    The net is the one pm4py's bpmn_converter (non-semantic, with simple reduction) builds from the same
+    model, so the reachability graph has the same state and transition names.
+
+    Args:
+        root: lxml root of the pool's BPMN XML
+
+    Returns:
+        tuple (places, transitions, initial_places) for marking_explorer.explore_net
+
+    Raises:
+        UnsupportedBpmnError: the pool contains something else than tasks, start/end events,
+            exclusive/parallel gateways and sequence flows
+    """
+    processes = root.findall(BPMN_NS + "process")
+    if len(processes) != 1:
+        raise UnsupportedBpmnError(f"{len(processes)} processes in one pool")
+
+    nodes = dict()
+    flows = []
+    for element in processes[0].iterchildren():
+        if not isinstance(element.tag, str) or not element.tag.startswith(BPMN_NS):
+            continue
+        tag = element.tag[len(BPMN_NS):]
+        if tag == "sequenceFlow":
+            if element.get("sourceRef") is None or element.get("targetRef") is None:
+                raise UnsupportedBpmnError(f"sequence flow {element.get('id')} without source or target")
+            flows.append((element.get("id"), element.get("sourceRef"), element.get("targetRef")))
+        elif node_kind(tag) is not None:
+            name = (element.get("name") or "").replace("\r", "").replace("\n", "")
+            nodes[element.get("id")] = (node_kind(tag), name)
+        elif tag not in IGNORED_ELEMENTS:
+            raise UnsupportedBpmnError(f"unsupported element {tag}")
+
+    net = WorkflowNet()
+    net.add_place("source")
+    net.add_place("sink")
+
+    source_count = dict.fromkeys(nodes, 0)
+    target_count = dict.fromkeys(nodes, 0)
+    for flow_id, source, target in flows:
+        if source not in nodes or target not in nodes:
+            raise UnsupportedBpmnError(f"sequence flow {flow_id} does not connect two supported nodes")
+        net.add_place(flow_id)
+        source_count[source] += 1
+        target_count[target] += 1
+
+    entering = dict()
+    exiting = dict()
+    for node_id, (kind, name) in nodes.items():
+        net.add_place("ent_" + node_id)
+        net.add_place("exi_" + node_id)
+        net.add_transition(node_id, name if kind == "task" and name else None, ["ent_" + node_id], ["exi_" + node_id])
+        entering[node_id] = ("place", "ent_" + node_id)
+        exiting[node_id] = ("place", "exi_" + node_id)
+        if kind == "parallelGateway":
+            if source_count[node_id] > 1:
+                exiting[node_id] = ("transition", net.add_transition(str(uuid.uuid4()), None, ["exi_" + node_id], []))
+            if target_count[node_id] > 1:
+                entering[node_id] = ("transition", net.add_transition(str(uuid.uuid4()), None, [], ["ent_" + node_id]))
+        elif kind == "startEvent":
+            net.add_transition(str(uuid.uuid4()), None, ["source"], ["ent_" + node_id])
+        elif kind == "endEvent":
+            net.add_transition(str(uuid.uuid4()), None, ["exi_" + node_id], ["sink"])
+
+    for flow_id, source, target in flows:
+        kind, source_object = exiting[source]
+        if kind == "place":
+            source_object = net.add_transition(f"sfl_{flow_id}", None, [source_object], [])
+        kind, target_object = entering[target]
+        if kind == "place":
+            target_object = net.add_transition(f"tfl_{flow_id}", None, [], [target_object])
+        net.add_arc(source_object, flow_id, True)
+        net.add_arc(target_object, flow_id, False)
+
+    net.reduce()
+    net.remove_isolated_places({"source", "sink"})
+    return net.places_list(), net.transitions_list(), ["source"]
+
+
+class WorkflowNet:
+    """Minimal Petri net with pm4py's simple reduction, places and transitions are identified by name."""
+
+    def __init__(self):
+        # place -> (input transitions, output transitions)
+        self.places: dict[str, tuple[set[str], set[str]]] = dict()
+        # transition -> (label, input places, output places)
+        self.transitions: dict[str, tuple[str, set[str], set[str]]] = dict()
+
+    def add_place(self, place):
+        self.places[place] = (set(), set())
+
+    def add_transition(self, transition, label, inputs, outputs):
+        self.transitions[transition] = (label, set(), set())
+        for place in inputs:
+            self.add_arc(transition, place, False)
+        for place in outputs:
+            self.add_arc(transition, place, True)
+        return transition
+
+    def add_arc(self, transition, place, outgoing):
+        # a second arc between the same nodes would be a weighted arc in pm4py
+        _, inputs, outputs = self.transitions[transition]
+        places, transitions = (outputs, self.places[place][0]) if outgoing else (inputs, self.places[place][1])
+        if place in places:
+            raise UnsupportedBpmnError(f"parallel arcs between {transition} and {place}")
+        places.add(place)
+        transitions.add(transition)
+
+    def remove_transition(self, transition):
+        _, inputs, outputs = self.transitions.pop(transition)
+        for place in inputs:
+            self.places[place][1].discard(transition)
+        for place in outputs:
+            self.places[place][0].discard(transition)
+
+    def remove_place(self, place):
+        producers, consumers = self.places.pop(place)
+        for transition in producers:
+            self.transitions[transition][2].discard(place)
+        for transition in consumers:
+            self.transitions[transition][1].discard(place)
+
+    def reduce(self):
+        # pm4py's apply_simple_reduction, including its phase order (the order decides which names survive):
+        # first merge every silent transition with a single input place into the transition feeding that
+        # place, then every silent transition with a single output place into the transition consuming it,
+        # in both cases only if the place is not shared with any other transition
+        changed = True
+        while changed:
+            size = (len(self.transitions), len(self.places))
+            while self.reduce_single_entry():
+                pass
+            while self.reduce_single_exit():
+                pass
+            changed = (len(self.transitions), len(self.places)) != size
+
+    def reduce_single_entry(self):
+        for transition in sorted(self.transitions):
+            label, inputs, outputs = self.transitions[transition]
+            if label is not None or len(inputs) != 1:
+                continue
+            place = next(iter(inputs))
+            producers, consumers = self.places[place]
+            if len(producers) == 1 and consumers == {transition}:
+                producer = next(iter(producers))
+                targets = list(outputs)
+                self.remove_transition(transition)
+                self.remove_place(place)
+                for target in targets:
+                    self.add_arc(producer, target, True)
+                return True
+        return False
+
+    def reduce_single_exit(self):
+        for transition in sorted(self.transitions):
+            label, inputs, outputs = self.transitions[transition]
+            if label is not None or len(outputs) != 1:
+                continue
+            place = next(iter(outputs))
+            producers, consumers = self.places[place]
+            if len(consumers) == 1 and producers == {transition}:
+                consumer = next(iter(consumers))
+                sources = list(inputs)
+                self.remove_transition(transition)
+                self.remove_place(place)
+                for source in sources:
+                    self.add_arc(consumer, source, False)
+                return True
+        return False
+
+    def remove_isolated_places(self, keep):
+        for place in [place for place, (producers, consumers) in self.places.items() if not producers and not consumers and place not in keep]:
+            del self.places[place]
+
+    def places_list(self):
+        return list(self.places)
+
+    def transitions_list(self):
+        # transition names as pm4py prints them, "(id, 'label')" or "(id, None)"
+        return [(f"({transition}, '{label}')" if label is not None else f"({transition}, None)", list(inputs), list(outputs))
+                for transition, (label, inputs, outputs) in self.transitions.items()]
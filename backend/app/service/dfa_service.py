@@ -1,23 +1,34 @@
 # dfa_module.py
-from app.model.main_model import BpmnData, ConstraintData, DeterministicFiniteAutomaton, ColoredDFA, ReturnColoredDFA
+from app.model.main_model import BpmnData, ConstraintData, DeterministicFiniteAutomaton, ColoredDFA, ReturnColoredDFA, symbol_classes
+from app.model.compact_model import CompactDFA, CompactColoredDFA
+from app.model.build_control import current_control, BudgetExceeded
 import copy
+import math
 import time
 
 # include all the DFA constraint templates and generator functions here...
 
-def build_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constraintsFromModel: list[ConstraintData]):
+# memory per hybrid state and edge of the tuple engine, measured on the example collaborations (colours included)
+TUPLE_STATE_BYTES = 1000
+TUPLE_STATE_BYTES_PER_CONSTRAINT = 170
+TUPLE_TRANSITION_BYTES = 100
+# peak memory per transition table cell of the compact engine while exploring (int64 rows, keys and the int32 table)
+COMPACT_CELL_BYTES = 48
 
-    # === Multi-process DFA ===
-    multi_process_DFA = DeterministicFiniteAutomaton()
+def build_multi_process_dfa(processDFAs: list[DeterministicFiniteAutomaton], compact: bool = False, reachable_only: bool = False):
+    current_control().enter_phase("multi-process product")
+    multi_process_DFA = CompactDFA() if compact else DeterministicFiniteAutomaton()
 
     for process in processDFAs:
         #process.drawSingleDFA("process.id")
-        process.updateSingleDFA()
-        #process.drawSingleDFA(process.id)
         if not multi_process_DFA.states:
-            multi_process_DFA.init_multi_process_dfa(process.states,process.alphabet,process.transition_function,process.initial_states,process.accepting_states,process.error_states)        
+            if compact:
+                multi_process_DFA = CompactDFA.from_dfa(process)
+                multi_process_DFA.id = "multi_process_DFA"
+            else:
+                multi_process_DFA.init_multi_process_dfa(process.states,process.alphabet,process.transition_function,process.initial_states,process.accepting_states,process.error_states,process.default_transitions)        
         else:
-            multi_process_DFA.add_process(process)
+            multi_process_DFA.add_process(process, reachable_only)
 
     print("\nmulti_process dfa created with:")
     print(len(multi_process_DFA.states), "states")
@@ -32,34 +43,145 @@ def build_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constrain
     print(len(multi_process_DFA.accepting_states), "accepting states")
     print(len(multi_process_DFA.error_states), "error states", "\n")
     #multi_process_DFA.drawMultiDFA("after")
-    # === Create constraint DFAs ===
+    return multi_process_DFA
+
+def create_constraint_dfas(constraintsFromModel: list[ConstraintData], alphabet):
     constraint_DFAs = []
     for constraint in constraintsFromModel:
         constraint_DFA = DeterministicFiniteAutomaton()
         
-        constraint_DFA.init_constraint_dfa(constraint,multi_process_DFA.alphabet)
+        constraint_DFA.init_constraint_dfa(constraint,set(alphabet))
         print(constraint_DFA)
         #constraint_DFA.drawConstraintDFA(constraint.id)
         constraint_DFAs.append(copy.deepcopy(constraint_DFA))
         print("DFA created for: ", constraint.id, "(",constraint.constraintType,")")
     print("Number of created constraints:", len(constraint_DFAs), "\n")
+    return constraint_DFAs
 
-    # === Create hybrid DFA ===
-    hybrid_DFA = multi_process_DFA
-    
+def build_symbol_classes(constraint_DFAs, alphabet):
+    # activities all constraints treat alike share a class, the constraint side of the product is evaluated per class
+    classes = symbol_classes(constraint_DFAs, alphabet)
+    print("Alphabet partitioned into", len(classes[1]), "symbol classes for", len(set(alphabet)), "activities\n")
+    return classes
+
+def add_constraints(hybrid_DFA, constraint_DFAs, num_processes, classes=None):
     print("Adding constraint DFA to the multi-process DFA...")
+    control = current_control()
     for index, constraint in enumerate(constraint_DFAs):
         print("Constraints left:", len(constraint_DFAs) - index)
+        control.enter_phase("constraint product", len(constraint_DFAs) - index, constraint.id)
         print("Current hybrid DFA: states=", format(len(hybrid_DFA.states),","), "transitions=", format(len(hybrid_DFA.transition_function),","), "accepting states=", len(hybrid_DFA.accepting_states))
 
         start_time = time.time()
-        hybrid_DFA.add_constraint(constraint)
-        hybrid_DFA.rewire_Errors(len(processDFAs))
+        try:
+            hybrid_DFA.add_constraint(constraint, classes)
+        except BudgetExceeded as e:
+            if not control.partial:
+                raise
+            # add_constraint replaces the hybrid only when it is done, it still holds the constraints before this one
+            print("Budget exceeded, keeping", index, "of", len(constraint_DFAs), "constraints:", e)
+            control.stop_early(e, [skipped.id for skipped in constraint_DFAs[index:]])
+            return hybrid_DFA
+        hybrid_DFA.rewire_Errors(num_processes)
         end_time = time.time()
 
         print("Constraint added to hybrid DFA:", constraint.id, "(Time taken:", float(f"{end_time - start_time:.4f}"), "seconds)")
-
-    
+    return hybrid_DFA
+
+def build_fused_hybrid_dfa(processDFAs: list[DeterministicFiniteAutomaton], constraint_DFAs, compact: bool = False, classes=None):
+    # single traversal of the n-ary product, no intermediate automaton is built
+    current_control().enter_phase("fused product", len(constraint_DFAs))
+    start_time = time.time()
+    if compact:
+        try:
+            hybrid_DFA = CompactDFA.from_product(processDFAs, constraint_DFAs, classes)
+        except OverflowError as e:
+            print("Fused product not possible:", e, "- falling back to the staged product")
+            return add_constraints(build_multi_process_dfa(processDFAs, compact, True), constraint_DFAs, len(processDFAs), classes)
+    else:
+        hybrid_DFA = DeterministicFiniteAutomaton().init_hybrid_dfa(processDFAs, constraint_DFAs, classes)
+    end_time = time.time()
+    print("Fused hybrid DFA created (Time taken:", float(f"{end_time - start_time:.4f}"), "seconds)")
+    return hybrid_DFA
+
+def estimate_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constraintsFromModel: list[ConstraintData], compact: bool = False) -> dict:
+    """
+    Bounds of the size of the hybrid DFA, computed before any product is built.
+
+    The pools interleave, so the multi-process product has exactly the product of their state counts and
+    the hybrid contains all of it (min, exact as long as no two pools share an activity). Every hybrid
+    state also carries one state per constraint DFA, so the product with the constraint DFA sizes bounds
+    it from above (max, usually far off as constraints rarely reach all their combinations).
+
+    Args:
+        processDFAs: the ingested process DFAs (before updateSingleDFA)
+        constraintsFromModel: the constraints of the request
+        compact: estimate the memory of the compact engine instead of the tuple engine
+
+    Returns:
+        dict with the constraint DFA sizes and min/max of states, transitions and bytes
+    """
+    alphabet = set().union(*(process.alphabet for process in processDFAs))
+    constraint_states = []
+    for constraint in constraintsFromModel:
+        constraint_DFA = DeterministicFiniteAutomaton()
+        constraint_DFA.init_constraint_dfa(constraint, alphabet)
+        constraint_states.append(len(set(constraint_DFA.states) | set(constraint_DFA.transition_function)))
+
+    process_states = math.prod(len(process.states) for process in processDFAs)
+    # a product state has the explicit edges of all its process states: on average over the product, at most the maximum
+    average_degree = sum(sum(len(transitions) for transitions in process.transition_function.values()) / max(len(process.states), 1) for process in processDFAs)
+    max_degree = sum(max((len(transitions) for transitions in process.transition_function.values()), default=0) for process in processDFAs)
+
+    def size(states, transitions):
+        if compact:
+            return states * len(alphabet) * COMPACT_CELL_BYTES + states * (len(processDFAs) + len(constraint_states)) * 5
+        return states * (TUPLE_STATE_BYTES + TUPLE_STATE_BYTES_PER_CONSTRAINT * len(constraint_states)) + transitions * TUPLE_TRANSITION_BYTES
+
+    # plus the error sink
+    states = {"min": process_states + 1, "max": process_states * math.prod(constraint_states) + 1}
+    transitions = {"min": round(process_states * average_degree), "max": states["max"] * min(max_degree, len(alphabet))}
+    return {
+        "constraint_states": constraint_states,
+        "states": states,
+        "transitions": transitions,
+        "bytes": {bound: size(states[bound], transitions[bound]) for bound in ("min", "max")},
+    }
+
+def prepare_process_dfas(processDFAs: list[DeterministicFiniteAutomaton], minimize_processes: bool = False):
+    # completes the ingested process DFAs with their error state, in place, before they are composed
+    for process in processDFAs:
+        process.updateSingleDFA()
+        if minimize_processes:
+            before = len(process.states)
+            process.minimize()
+            print("Minimized process DFA", process.id, ":", before, "->", len(process.states), "states")
+        #process.drawSingleDFA(process.id)
+    return processDFAs
+
+def build_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constraintsFromModel: list[ConstraintData], compact: bool = False, reachable_only: bool = False, fused: bool = False, minimize_processes: bool = False, minimize_hybrid: bool = False):
+
+    prepare_process_dfas(processDFAs, minimize_processes)
+
+    if fused:
+        # === Create constraint DFAs and the hybrid DFA in one pass ===
+        alphabet = set().union(*(process.alphabet for process in processDFAs))
+        constraint_DFAs = create_constraint_dfas(constraintsFromModel, alphabet)
+        classes = build_symbol_classes(constraint_DFAs, alphabet)
+        hybrid_DFA = build_fused_hybrid_dfa(processDFAs, constraint_DFAs, compact, classes)
+    else:
+        # === Multi-process DFA ===
+        multi_process_DFA = build_multi_process_dfa(processDFAs, compact, reachable_only)
+        # === Create constraint DFAs ===
+        constraint_DFAs = create_constraint_dfas(constraintsFromModel, multi_process_DFA.alphabet)
+        classes = build_symbol_classes(constraint_DFAs, multi_process_DFA.alphabet)
+        # === Create hybrid DFA ===
+        hybrid_DFA = add_constraints(multi_process_DFA, constraint_DFAs, len(processDFAs), classes)
+
+    control = current_control()
+    if control.skipped_constraints:
+        # partial build, only the constraints in the hybrid are coloured
+        constraint_DFAs = constraint_DFAs[:len(constraint_DFAs) - len(control.skipped_constraints)]
 
     # print("\nhybrid dfa created with:")
     # print(format(len(hybrid_DFA.states),","), "states")
@@ -76,28 +198,34 @@ def build_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constrain
     
     
     # === Colouring ===
-    colored_dfa = ColoredDFA(hybrid_DFA)
+    colored_dfa = CompactColoredDFA(hybrid_DFA) if compact else ColoredDFA(hybrid_DFA)
     colored_dfa.add_colours(len(processDFAs),constraint_DFAs)
     print("Starting colouring of constraints...")
 
     current_count_total = 0
     for index, constraint in enumerate(constraint_DFAs):
-        global current_count_single
-        current_count_single = 0
-
         print("Constraints left:", len(constraint_DFAs) - index)
+        control.enter_phase("colouring", len(constraint_DFAs) - index, constraint.id)
 
         start_time = time.time()
-        for init in colored_dfa.initial_states:
-            colored_dfa, current_count_single, visited = colored_dfa.changeColours(current_count_single, index, constraint.id, init, colored_dfa.colors[init][index][constraint.id],set())
+        current_count_single = colored_dfa.colour_constraint(index, constraint.id)
         end_time = time.time()
 
-        print("functions calls per constraint:", format(current_count_single,","))
+        stats = colored_dfa.colouring_stats[constraint.id]
+        print("work per constraint:", format(current_count_single,","), "(states:", format(stats["states"],","), "edges:", format(stats["edges"],","), ")")
         current_count_total += current_count_single
         print("Time taken for colouring of constraint", constraint.id, ":", float(f"{end_time - start_time:.4f}"), "seconds")
     
-    print("functions calls total:", format(current_count_total,","))
+    print("work total:", format(current_count_total,","))
     print("Colouring completed.\n")
+
+    if minimize_hybrid:
+        control.enter_phase("minimization")
+        before = len(colored_dfa.states)
+        start_time = time.time()
+        colored_dfa.minimize()
+        end_time = time.time()
+        print("Minimized hybrid DFA:", format(before,","), "->", format(len(colored_dfa.states),","), "states (Time taken:", float(f"{end_time - start_time:.4f}"), "seconds)")
     
     # print("current",colored_dfa.current)
     # print("states",colored_dfa.states)
@@ -107,7 +235,7 @@ def build_colored_dfa(processDFAs: list[DeterministicFiniteAutomaton], constrain
     # print("accept",colored_dfa.accepting_states)
     # print("colors",colored_dfa.colors)
 
-    if len(colored_dfa.initial_states) == 1:
+    if len(colored_dfa.initial_states) == 1 and not compact:
         colored = ReturnColoredDFA(colored_dfa)
         # for index, constraint in enumerate(constraint_DFAs):
         #     colored.drawColoredDFAforConstraint(constraint.id,len(processDFAs)+index-1)
@@ -0,0 +1,472 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from app.model.build_control import BudgetExceeded, BuildCancelled, BuildControl, BuildTimedOut, CONTROL_SIZE, using_control
+from app.model.main_model import BpmnData, BuildBudget, ConstraintData
+from app.model.marking_explorer import StateSpaceLimitExceeded
+from app.service import main_service
+from app.service.wire_format import CHUNK_BYTES, JSON, decode_response, encode_response
+
+# builds running at the same time, each in its own worker process
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# run the builds in pre-started worker processes (false keeps them in threads of the server process)
+JOB_PROCESS_POOL = os.environ.get("JOB_PROCESS_POOL", "true").lower() == "true"
+# jobs that may wait for a free worker, beyond that new jobs are turned away with 503
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "8"))
+# unfinished jobs a single client may have, beyond that its new jobs are turned away with 429
+JOB_CLIENT_LIMIT = int(os.environ.get("JOB_CLIENT_LIMIT", "2"))
+# builds whose hybrid DFA needs at least this many bytes (the min estimate) are stopped once their pools are ingested, 0 for no ceiling
+JOB_MAX_ESTIMATED_BYTES = int(os.environ.get("JOB_MAX_ESTIMATED_BYTES", str(8 * 2 ** 30)))
+# seconds a build may run before it is stopped at its next checkpoint (0 for no limit)
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "300"))
+# states any product of a build may reach, requests can only ask for less (0 for no limit)
+JOB_MAX_STATES = int(os.environ.get("JOB_MAX_STATES", "0"))
+# resident memory of a worker in MiB a build may grow to, requests can only ask for less (0 for no limit)
+JOB_MAX_RSS_MB = int(os.environ.get("JOB_MAX_RSS_MB", "0"))
+# workers write the response to a spool file while they encode it, the server streams it from there as it grows
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() == "true"
+# directory of the spool files, a fresh temporary directory when not set
+JOB_SPOOL_DIR = os.environ.get("JOB_SPOOL_DIR") or None
+# seconds between two looks at a spool file that is still being written
+SPOOL_POLL_INTERVAL = 0.05
+# seconds a finished job (and its result) stays available
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", "600"))
+# seconds between two looks at the progress of a job while streaming it
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "0.5"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+OVER_BUDGET = "over_budget"
+FINISHED = (DONE, FAILED, CANCELLED, TIMED_OUT, OVER_BUDGET)
+
+
+class QueueFull(RuntimeError):
+    """Raised when a job is submitted while all workers and queue places are taken."""
+
+
+class ClientLimitReached(RuntimeError):
+    """Raised when a client submits a job while it already has JOB_CLIENT_LIMIT unfinished ones."""
+
+
+class WorkersUnavailable(RuntimeError):
+    """Raised when a job is submitted while the worker pool is not running."""
+
+
+class EstimateTooLarge(BudgetExceeded):
+    """Raised in a worker when the estimated hybrid DFA of a job does not fit under JOB_MAX_ESTIMATED_BYTES or its state budget."""
+
+
+class Job:
+    """One /generateDfa build run in the background, with its progress, result or error."""
+
+    def __init__(self, bpmn_models: list[BpmnData], constrains: list[ConstraintData], client: str, slot: int, budget: dict, media_type: str):
+        self.id = str(uuid.uuid4())
+        self.bpmn_models = bpmn_models
+        self.constrains = constrains
+        self.client = client
+        self.slot = slot
+        self.control = BuildControl(_controls, slot * CONTROL_SIZE)
+        # bounds of the hybrid, known once the worker has ingested the pools
+        self.estimate = None
+        # limits the worker builds with, see job_budget
+        self.budget = budget
+        # shortest job first, see queue_cost
+        self.cost = None
+        # the media type the worker encodes the response in, see wire_format.negotiate
+        self.media_type = media_type
+        # file the worker writes the encoded response to (STREAM_RESPONSES), the result stays None then
+        self.spool = os.path.join(spool_directory(), self.id) if STREAM_RESPONSES else None
+        # handed to a worker (only as many jobs as there are workers are)
+        self.dispatched = False
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        # budget, limit, value, phase and constraint when the build outgrew its budget
+        self.details = None
+        # HTTP status a synchronous endpoint answers a failed job with
+        self.error_code = None
+        # progress at the end, the control slot is handed to the next job
+        self.final_progress = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def current_status(self) -> str:
+        # the worker does not report back before it is done, a dispatched job is running
+        if self.status == QUEUED and self.dispatched:
+            return RUNNING
+        return self.status
+
+    def snapshot(self) -> dict:
+        progress = self.final_progress if self.final_progress is not None else self.control.progress()
+        return {"job_id": self.id, "status": self.current_status(), **progress, "error": self.error, "details": self.details, "estimate": self.estimate}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_jobs: dict[str, Job] = dict()
+_jobs_lock = threading.Lock()
+# one control per worker and queue place, in shared memory so the worker processes can report and be cancelled
+_controls = multiprocessing.get_context("spawn").Array("q", (JOB_WORKERS + JOB_QUEUE_LIMIT) * CONTROL_SIZE, lock=False)
+_free_slots = list(range(JOB_WORKERS + JOB_QUEUE_LIMIT))
+# jobs waiting for a worker as (cost, submission number, job), the cheapest goes first
+_pending = []
+_submissions = itertools.count()
+_in_flight = 0
+_spool_directory = None
+# lookups the worker processes made in their own pool caches and result stores, see cache_counters
+_worker_cache_counters = {"pool_cache": dict(), "result_store": dict()}
+
+
+def spool_directory() -> str:
+    # created by the server on first use, the workers only get the paths of the files
+    global _spool_directory
+    if _spool_directory is None:
+        _spool_directory = JOB_SPOOL_DIR or tempfile.mkdtemp(prefix="bpmn_dfa_spool_")
+        os.makedirs(_spool_directory, exist_ok=True)
+    return _spool_directory
+
+
+def init_worker(controls):
+    global _controls
+    _controls = controls
+    # pool workers are daemonic and cannot start the ingestion workers of their own
+    main_service.INGESTION_WORKERS = 1
+
+
+def start_workers():
+    # starts all worker processes up front, each imports pm4py and the services before the first job arrives
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if JOB_PROCESS_POOL:
+                _pool = multiprocessing.get_context("spawn").Pool(JOB_WORKERS, initializer=init_worker, initargs=(_controls,))
+            else:
+                _pool = ThreadPool(JOB_WORKERS)
+    return _pool
+
+
+def stop_workers():
+    global _pool, _spool_directory
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+    # a temporary spool directory goes with the server, a configured one only loses its files with their jobs
+    if _spool_directory is not None and JOB_SPOOL_DIR is None:
+        shutil.rmtree(_spool_directory, ignore_errors=True)
+        _spool_directory = None
+
+
+def job_budget(budget: BuildBudget = None) -> dict:
+    # the limits of a build: those of the request, capped by the server's own
+    budget = budget if budget is not None else BuildBudget()
+    def tighter(requested, server):
+        limits = [limit for limit in (requested, server) if limit]
+        return min(limits) if limits else None
+    max_rss_mb = tighter(budget.max_rss_mb, JOB_MAX_RSS_MB)
+    return {
+        "seconds": tighter(budget.max_seconds, JOB_TIMEOUT),
+        "max_states": tighter(budget.max_states, JOB_MAX_STATES),
+        "max_rss": max_rss_mb * 2 ** 20 if max_rss_mb else None,
+        "partial": budget.partial,
+    }
+
+
+def queue_cost(bpmn_models: list[BpmnData], constrains: list[ConstraintData]) -> int:
+    # shortest job first without ingesting anything: a pool has about as many markings as sequence flows (more
+    # with parallel branches), the pools interleave and every constraint adds a pass over the hybrid
+    flows = [len(main_service.get_sequence_flow_ids(main_service.parse_bpmn_xml(bpmn_model.xml))) + 1 for bpmn_model in bpmn_models]
+    return math.prod(flows) * (len(constrains) + 1)
+
+
+def submit_job(bpmn_models: list[BpmnData], constrains: list[ConstraintData], client: str = None, budget: BuildBudget = None, media_type: str = JSON) -> Job:
+    """
+    Queue a build for the worker pool, smaller builds (by queue_cost) are handed to the workers first.
+    The worker encodes the response in media_type.
+
+    Nothing is ingested in the server process: the worker estimates the hybrid once it has ingested the
+    pools and stops with OVER_BUDGET when the estimate does not fit (see run_build).
+
+    Raises:
+        ClientLimitReached: the client already has JOB_CLIENT_LIMIT unfinished jobs
+        QueueFull: every worker and queue place is taken
+        WorkersUnavailable: the worker pool is not running
+    """
+    pool = start_workers()
+    with _jobs_lock:
+        prune_jobs()
+        if client is not None and sum(1 for job in _jobs.values() if job.client == client and job.status not in FINISHED) >= JOB_CLIENT_LIMIT:
+            raise ClientLimitReached(f"{JOB_CLIENT_LIMIT} unfinished jobs per client")
+        if not _free_slots:
+            raise QueueFull(f"{JOB_WORKERS} jobs running and {JOB_QUEUE_LIMIT} waiting")
+        # admitted: the job holds its slot and counts for its client from here on
+        job = Job(bpmn_models, constrains, client, _free_slots.pop(), job_budget(budget), media_type)
+        job.control.reset()
+        _jobs[job.id] = job
+    try:
+        job.cost = queue_cost(bpmn_models, constrains)
+    except Exception as e:
+        with _jobs_lock:
+            if job.status not in FINISHED:
+                finish(job, FAILED, None, f"Invalid BPMN XML: {e}", 400)
+                _free_slots.append(job.slot)
+        return job
+    with _jobs_lock:
+        if job.status in FINISHED:
+            # cancelled while its cost was computed, stop_job gave the slot back
+            return job
+        heapq.heappush(_pending, (job.cost, next(_submissions), job))
+        dispatch(pool)
+    if job.status == FAILED and job.error_code == 503:
+        raise WorkersUnavailable(job.error)
+    return job
+
+
+def dispatch(pool):
+    # caller holds the lock; hands the cheapest waiting jobs to the workers that are free
+    global _in_flight
+    while _pending and _in_flight < JOB_WORKERS:
+        _, _, job = heapq.heappop(_pending)
+        if job.status in FINISHED:
+            continue
+        try:
+            pool.apply_async(run_build, (job.slot, job.bpmn_models, job.constrains, job.budget, job.spool, job.media_type),
+                             callback=lambda outcome, job=job: finish_job(job, *outcome, release=True),
+                             error_callback=lambda e, job=job: finish_job(job, FAILED, None, repr(e), 500, release=True))
+        except ValueError as e:
+            # the pool has been closed
+            finish(job, FAILED, None, str(e), 503)
+            _free_slots.append(job.slot)
+            continue
+        job.dispatched = True
+        _in_flight += 1
+
+
+def run_build(slot: int, bpmn_models: list[BpmnData], constrains: list[ConstraintData], budget: dict, spool: str = None, media_type: str = JSON):
+    # runs in a worker, returns (status, result, error, error code, details, estimate, cache counters); with a spool
+    # file the response is written there in media_type and the result is None
+    control = BuildControl(_controls, slot * CONTROL_SIZE, **budget)
+    estimates = []
+    counters = main_service.cache_counters()
+
+    def admit(estimate):
+        # the pools are ingested once, here, and the estimate decides whether the product is built at all
+        estimates.append(estimate)
+        if JOB_MAX_ESTIMATED_BYTES and estimate["bytes"]["min"] > JOB_MAX_ESTIMATED_BYTES:
+            raise EstimateTooLarge("estimated_bytes", JOB_MAX_ESTIMATED_BYTES, estimate["bytes"]["min"], "ingestion")
+        if budget["max_states"] is not None and not budget["partial"] and estimate["states"]["min"] > budget["max_states"]:
+            raise EstimateTooLarge("estimated_states", budget["max_states"], estimate["states"]["min"], "ingestion")
+
+    def outcome(status, result, error, error_code, details):
+        # a worker process has caches of its own, how their counters changed goes back to the server with the job
+        changed = None
+        if multiprocessing.parent_process() is not None:
+            changed = {cache: {name: count - counters[cache][name] for name, count in now.items()} for cache, now in main_service.cache_counters().items()}
+        return status, result, error, error_code, details, estimates[0] if estimates else None, changed
+
+    try:
+        control.enter_phase("ingestion")
+        with using_control(control):
+            if spool is None:
+                return outcome(DONE, main_service.generate_dfa(bpmn_models, constrains, admit=admit), None, None, None)
+            write_spool(spool, control, bpmn_models, constrains, media_type, admit)
+            return outcome(DONE, None, None, None, None)
+    except BuildTimedOut as e:
+        print("Build", e)
+        return outcome(TIMED_OUT, None, f"Build {e}", 504, e.report())
+    except BudgetExceeded as e:
+        print("Build", e)
+        return outcome(OVER_BUDGET, None, f"Build {e}", 422, e.report())
+    except BuildCancelled as e:
+        print("Build", e)
+        return outcome(CANCELLED, None, None, 409, None)
+    except StateSpaceLimitExceeded as e:
+        return outcome(FAILED, None, f"State space too large: {e}", 422, None)
+    except Exception as e:
+        print("Build failed:", repr(e))
+        return outcome(FAILED, None, str(e), 500, None)
+
+
+def write_spool(spool: str, control: BuildControl, bpmn_models: list[BpmnData], constrains: list[ConstraintData], media_type: str, admit):
+    # the file exists from the start, so the server can open it as soon as the build reaches its serialization
+    with open(spool, "wb") as file:
+        if media_type == JSON:
+            # encoded chunk by chunk from the automaton, every chunk is on disk before the next one is encoded
+            chunks = main_service.generate_dfa(bpmn_models, constrains, encoded=True, admit=admit)
+        else:
+            # the columnar formats are built in columns straight from the automaton, never through the JSON form
+            chunks = [encode_response(main_service.generate_dfa(bpmn_models, constrains, admit=admit, columnar=True), media_type)]
+        for chunk in chunks:
+            control.check()
+            file.write(chunk)
+            file.flush()
+
+
+def finish_job(job: Job, status: str, result: dict, error: str, error_code: int, details: dict = None, estimate: dict = None,
+               counters: dict = None, release: bool = False):
+    # release: the worker is done with the job, so its control slot and the worker go to the next ones
+    global _in_flight
+    with _jobs_lock:
+        if release:
+            _free_slots.append(job.slot)
+            _in_flight -= 1
+        for cache, changed in (counters or dict()).items():
+            totals = _worker_cache_counters[cache]
+            for name, count in changed.items():
+                totals[name] = totals.get(name, 0) + count
+        finish(job, status, result, error, error_code, details, estimate)
+        if release and _pool is not None:
+            dispatch(_pool)
+
+
+def finish(job: Job, status: str, result: dict, error: str, error_code: int, details: dict = None, estimate: dict = None):
+    # caller holds the lock
+    if job.status in FINISHED:
+        return
+    job.final_progress = job.control.progress()
+    # the pools are not needed any more, only the result is kept until the job is pruned
+    job.bpmn_models = None
+    job.result = result
+    job.error = error
+    job.error_code = error_code
+    job.details = details
+    job.estimate = estimate
+    job.finished = time.time()
+    job.status = status
+    job.done.set()
+    if status != DONE:
+        remove_spool(job)
+
+
+def remove_spool(job: Job):
+    # a reader that still has the file open keeps reading it (and stops, as the job did not finish DONE)
+    if job.spool is not None:
+        try:
+            os.remove(job.spool)
+        except FileNotFoundError:
+            pass
+
+
+def prune_jobs():
+    # caller holds the lock
+    now = time.time()
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished is not None and now - job.finished > JOB_RETENTION]:
+        remove_spool(_jobs.pop(job_id))
+
+
+def wait_for_output(job: Job):
+    # returns once the job finished or started to write its response, which is streamed from then on
+    while not job.done.wait(SPOOL_POLL_INTERVAL):
+        if job.spool is not None and job.control.phase == "serialization":
+            return
+
+
+def spool_chunks(job: Job):
+    """
+    The response of a job streamed from its spool file, also while the worker still writes it.
+
+    Raises:
+        RuntimeError: the job did not finish DONE, the response stops short
+    """
+    with open(job.spool, "rb") as file:
+        while True:
+            finished = job.done.is_set()
+            chunk = file.read(CHUNK_BYTES)
+            if chunk:
+                yield chunk
+            elif finished:
+                break
+            else:
+                job.done.wait(SPOOL_POLL_INTERVAL)
+    if job.status != DONE:
+        raise RuntimeError(f"Job {job.status} while its response was streamed")
+
+
+def job_response(job: Job) -> dict:
+    # the response of a DONE job as a dictionary, its colored DFA is in columns unless the job encoded JSON
+    if job.spool is None:
+        return job.result
+    with open(job.spool, "rb") as file:
+        return decode_response(file.read(), job.media_type)
+
+
+def get_job(job_id: str) -> Job | None:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id: str) -> Job | None:
+    job = get_job(job_id)
+    if job is not None and job.status not in FINISHED:
+        stop_job(job)
+    return job
+
+
+def cancel_client_jobs(client: str) -> list[str]:
+    # only the jobs the client submitted itself, the server is shared by many clients
+    with _jobs_lock:
+        jobs = [job for job in _jobs.values() if job.client == client and job.status not in FINISHED]
+    for job in jobs:
+        stop_job(job)
+    return [job.id for job in jobs]
+
+
+def stop_job(job: Job):
+    job.control.cancel()
+    with _jobs_lock:
+        # a job still waiting for a worker is over right away, dispatch skips it
+        if not job.dispatched and job.status not in FINISHED:
+            finish(job, CANCELLED, None, None, 409)
+            _free_slots.append(job.slot)
+
+
+def cache_counters() -> dict:
+    # lookups of the worker processes, by cache; builds in threads count in the caches of the server itself
+    with _jobs_lock:
+        return {cache: dict(totals) for cache, totals in _worker_cache_counters.items()}
+
+
+def get_job_stats() -> dict:
+    with _jobs_lock:
+        unfinished = [job for job in _jobs.values() if job.status not in FINISHED]
+        return {
+            "workers": JOB_WORKERS,
+            "process_pool": JOB_PROCESS_POOL,
+            "queue_limit": JOB_QUEUE_LIMIT,
+            "max_estimated_bytes": JOB_MAX_ESTIMATED_BYTES,
+            "timeout": JOB_TIMEOUT,
+            "max_states": JOB_MAX_STATES,
+            "max_rss_mb": JOB_MAX_RSS_MB,
+            "running": sum(1 for job in unfinished if job.current_status() == RUNNING),
+            "queued": sum(1 for job in unfinished if job.current_status() == QUEUED),
+            "free_slots": len(_free_slots),
+        }
+
+
+async def job_events(job: Job):
+    # server-sent events with the progress of the job, one whenever it changed, the last one has a finished status
+    last = None
+    while True:
+        snapshot = job.snapshot()
+        if snapshot != last:
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            last = snapshot
+        if snapshot["status"] in FINISHED:
+            return
+        await asyncio.sleep(JOB_PROGRESS_INTERVAL)
@@ -1,47 +1,114 @@
-from app.model.main_model import BpmnData, ConstraintData, DeterministicFiniteAutomaton, ColoredDFA
-from pm4py.objects.bpmn.importer import importer as bpmn_importer
+from app.model.main_model import BpmnData, ConstraintData, PoolReference, DeterministicFiniteAutomaton, ColoredDFA
+from app.model.compact_model import CompactColoredDFA, ERROR_STATE, COLOUR_NAMES
+from app.model.marking_explorer import explore_markings, explore_net, UnsafeNetError
+from app.model.build_control import current_control
+from app.service.bpmn_translator import translate_bpmn, UnsupportedBpmnError
+from app.service.pool_cache import ProcessDfaCache
+from app.service.result_store import ResultStore
+from app.service.wire_format import LazyObject, columnar_response, json_chunks
+from pm4py.objects.bpmn.importer.variants import lxml as bpmn_importer
 from pm4py.objects.conversion.bpmn import converter as bpmn_converter
 import pm4py.objects.bpmn.util.bpmn_utils as bpmn_utils 
 from pm4py.objects.transition_system.obj import TransitionSystem
 from pm4py.objects.petri_net.utils import reachability_graph, petri_utils
 from pm4py.visualization.petri_net import visualizer as pn_visualizer
 from pm4py.visualization.transition_system import visualizer as ts_visualizer
-import tempfile
+from lxml import etree, objectify
 import os
+import hashlib
+import json
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import shutil
-import xml.etree.ElementTree as ET
 import re
+import numpy as np
 
-from app.service.dfa_service import build_colored_dfa
+from app.service.dfa_service import build_colored_dfa, estimate_colored_dfa
 
 SATISFIED = 'satisfied'
 TEMPORARY_SATISFIED = "temporary_satisfied"
 TEMPORARY_VIOLATED = "temporary_violated"
 VIOLATED = "violated"
 
-def generate_dfa(bpmn_models: list[BpmnData], constrains: list[ConstraintData]) -> dict:
+# build the hybrid on the integer-interned CompactDFA instead of tuple states
+USE_COMPACT_DFA = os.environ.get("USE_COMPACT_DFA", "false").lower() == "true"
+# only build the reachable part of the multi-process product
+REACHABLE_ONLY_PRODUCT = os.environ.get("REACHABLE_ONLY_PRODUCT", "false").lower() == "true"
+# explore the product of all processes and constraints in a single pass
+FUSED_PRODUCT = os.environ.get("FUSED_PRODUCT", "false").lower() == "true"
+# Hopcroft minimization of the per-pool DFAs before composition and of the coloured hybrid
+MINIMIZE_PROCESS_DFAS = os.environ.get("MINIMIZE_PROCESS_DFAS", "false").lower() == "true"
+MINIMIZE_HYBRID_DFA = os.environ.get("MINIMIZE_HYBRID_DFA", "false").lower() == "true"
+# collapse the silent routing steps of every pool and make its automaton deterministic (subset construction)
+DETERMINIZE_PROCESS_DFAS = os.environ.get("DETERMINIZE_PROCESS_DFAS", "false").lower() == "true"
+# reachable markings a single pool may have before the request is rejected
+MAX_POOL_STATES = int(os.environ.get("MAX_POOL_STATES", "200000"))
+# translate sequential/XOR/AND pools directly from the BPMN XML, the pm4py conversion remains the fallback
+DIRECT_BPMN_TRANSLATION = os.environ.get("DIRECT_BPMN_TRANSLATION", "true").lower() == "true"
+# worker processes for the per-pool ingestion (BPMN import up to the process DFA), 1 keeps it in the request thread
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "1"))
+
+# finished per-pool DFAs kept by content hash (0 disables the cache), optionally backed by a directory
+POOL_CACHE_SIZE = int(os.environ.get("POOL_CACHE_SIZE", "256"))
+POOL_CACHE_DIR = os.environ.get("POOL_CACHE_DIR") or None
+# bytes the files of POOL_CACHE_DIR may take, the least recently used ones are removed beyond that (0 for no limit)
+POOL_CACHE_DISK_MAX_BYTES = int(os.environ.get("POOL_CACHE_DISK_MAX_BYTES", str(1 * 2 ** 30)))
+# part of every cache key, to be bumped whenever the process DFAs change shape
+POOL_CACHE_VERSION = "pool-dfa-2"
+
+# finished responses shared by all server workers in a SQLite file, evicted by total size; off unless a path is set
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH") or None
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_BYTES", str(512 * 2 ** 20)))
+RESULT_STORE_VERSION = "result-2"
+# pool XML uploaded through /generateDfaDelta, kept by its hash in a SQLite file (empty path disables it); the XML
+# is checked against its hash, so unlike results it cannot go stale
+POOL_STORE_PATH = os.environ.get("POOL_STORE_PATH", os.path.join(tempfile.gettempdir(), "bpmn_dfa_pools.sqlite3"))
+POOL_STORE_MAX_BYTES = int(os.environ.get("POOL_STORE_MAX_BYTES", str(128 * 2 ** 20)))
+
+_ingestion_executor = None
+pool_cache = ProcessDfaCache(POOL_CACHE_SIZE, POOL_CACHE_DIR, POOL_CACHE_DISK_MAX_BYTES) if POOL_CACHE_SIZE > 0 else None
+result_store = ResultStore(RESULT_STORE_PATH, RESULT_STORE_MAX_BYTES) if RESULT_STORE_PATH else None
+pool_store = ResultStore(POOL_STORE_PATH, POOL_STORE_MAX_BYTES, table="pools") if POOL_STORE_PATH else None
+
+UUID_PATTERN = re.compile(r'^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}$')
+
+def generate_dfa(bpmn_models: list[BpmnData], constrains: list[ConstraintData], encoded: bool = False, admit=None, columnar: bool = False):
+    """
+    Build the colored hybrid DFA of the pools and constraints and the /generateDfa response for it.
+
+    Args:
+        bpmn_models: one BPMN XML per pool
+        constrains: the constraint flows between the pools
+        encoded: return the response as an iterator of UTF-8 JSON chunks (see json_chunks), encoded state
+            by state from the automaton while it is consumed, instead of building the response dictionary
+        admit: called with the estimate of the hybrid (see estimate_colored_dfa) once the pools are
+            ingested and before any product is built, it raises to refuse the build
+        columnar: build the colored DFA of the response in columns (see colored_dfa_columns) for the
+            columnar media types, straight from the automaton; not together with encoded
+
+    Returns:
+        The response dictionary, or an iterator over its encoded chunks
+    """
     # shutil.rmtree("pic")
     # os.mkdir("pic")
 
     process_dfas = []
     process_dfa_param = []
 
-    for idx, bpmn_model in enumerate(bpmn_models):
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".bpmn") as tmp:
-            tmp.write(bpmn_model.xml.encode("utf-8"))
-            tmp_path = tmp.name
+    roots = [parse_bpmn_xml(bpmn_model.xml) for bpmn_model in bpmn_models]
 
-        bpmn_graph = bpmn_importer.apply(tmp_path)
-        os.unlink(tmp_path)
+    # a finished response for the same pools, constraints and settings, possibly computed by another worker
+    if result_store is not None:
+        result_key = result_store_key(roots, constrains, columnar)
+        response = result_store.get_encoded(result_key) if encoded else result_store.get(result_key)
+        if response is not None:
+            return [response] if encoded else response
 
-        flow_ids = get_sequence_flow_ids(bpmn_model.xml)
-        petri_net = convert_bpmn_to_petri_net(bpmn_graph)
-
-        #save_visualized_petri_net("pic/" + str(idx) + "_petri_net.png", petri_net)
-        transition_system = convert_petri_net_to_ts(petri_net)
-        #save_visualized_transition_system("pic/" + str(idx) + "_transition_system.png", transition_system)
-        dfa = convert_transition_system_to_dfa(transition_system, str(idx), flow_ids)
-        process_dfas.append(dfa)
+    process_dfas = load_process_dfas(bpmn_models, roots)
+    if admit is not None:
+        admit(estimate_colored_dfa(process_dfas, constrains, compact=USE_COMPACT_DFA))
 
     # for p_dfa in process_dfas:
     #     process_dfa_param.append((p_dfa.id, p_dfa.states, p_dfa.alphabet, p_dfa.transition_function, p_dfa.initial_states, p_dfa.accepting_states))
@@ -50,21 +117,192 @@ def generate_dfa(bpmn_models: list[BpmnData], constrains: list[ConstraintData])
     # for p_const in constrains:
     #     constraint_param.append((p_const.constraintType, p_const.id, p_const.sourceRef, p_const.targetRef))
 
-    result = build_colored_dfa(process_dfas, constrains)
+    result = build_colored_dfa(process_dfas, constrains, compact=USE_COMPACT_DFA, reachable_only=REACHABLE_ONLY_PRODUCT, fused=FUSED_PRODUCT,
+                               minimize_processes=MINIMIZE_PROCESS_DFAS, minimize_hybrid=MINIMIZE_HYBRID_DFA)
+    control = current_control()
+    control.enter_phase("serialization")
 
     # Convert the ColoredDFA to JSON-serializable format
-    json_result = colored_dfa_to_json(result)
+    if columnar:
+        json_result = colored_dfa_columns(result)
+    else:
+        json_result = colored_dfa_fields(result) if encoded else colored_dfa_to_json(result)
 
-    return {
+    response = {
         "message": "DFA generation completed successfully",
         "colored_dfa": json_result
     }
+    if DETERMINIZE_PROCESS_DFAS:
+        # lets the frontend map the collapsed process states back to the states of the pm4py reachability graph
+        response["process_state_mapping"] = {dfa.id: {state: sorted(members) for state, members in dfa.state_mapping.items()} for dfa in process_dfas}
+    if control.stopped_by is not None:
+        # the budget only fitted some of the constraints, the response depends on the budget and is not stored
+        response["message"] = "DFA generation stopped by its budget, the hybrid covers only part of the constraints"
+        response["partial"] = {**control.stopped_by.report(), "skipped_constraints": control.skipped_constraints}
+        return json_chunks(response) if encoded else response
+    if encoded:
+        # stored as the chunks go by, once the last one has been consumed
+        return result_store.put_chunks(result_key, json_chunks(response)) if result_store is not None else json_chunks(response)
+    if result_store is not None:
+        # the compact engine gives its columns as arrays, they are stored as lists
+        result_store.put(result_key, columnar_response(response) if columnar else response)
+    return response
+
+def load_process_dfas(bpmn_models: list[BpmnData], roots) -> list[DeterministicFiniteAutomaton]:
+    control = current_control()
+    control.enter_phase("ingestion")
+
+    # unchanged pools are served from the cache, the rest is ingested (in the worker pool if configured)
+    process_dfas = [None] * len(bpmn_models)
+    missing = []
+    for idx, (bpmn_model, root) in enumerate(zip(bpmn_models, roots)):
+        key = pool_cache_key(root, idx, DETERMINIZE_PROCESS_DFAS)
+        process_dfas[idx] = pool_cache.get(key) if pool_cache is not None else None
+        if process_dfas[idx] is None:
+            missing.append((idx, bpmn_model, root, key))
+
+    # the pools are independent, so import, Petri net, reachability graph and DFA conversion run per pool
+    if INGESTION_WORKERS > 1 and len(missing) > 1:
+        ingested = list(get_ingestion_executor().map(ingest_pool, [idx for idx, _, _, _ in missing], [bpmn_model.xml for _, bpmn_model, _, _ in missing], itertools.repeat(DETERMINIZE_PROCESS_DFAS)))
+    else:
+        ingested = []
+        for idx, _, root, _ in missing:
+            control.check()
+            ingested.append(ingest_parsed_pool(idx, root, DETERMINIZE_PROCESS_DFAS))
+
+    for (idx, _, _, key), dfa in zip(missing, ingested):
+        if pool_cache is not None:
+            pool_cache.put(key, dfa)
+        process_dfas[idx] = dfa
+    return process_dfas
+
+def estimate_dfa(bpmn_models: list[BpmnData], constrains: list[ConstraintData]) -> dict:
+    """
+    Upper bound of the size of the hybrid DFA a request would build, see estimate_colored_dfa.
+
+    Only the pools are ingested (or taken from the pool cache), no product is built.
+    """
+    roots = [parse_bpmn_xml(bpmn_model.xml) for bpmn_model in bpmn_models]
+    return estimate_colored_dfa(load_process_dfas(bpmn_models, roots), constrains, compact=USE_COMPACT_DFA)
+
+class InvalidPoolReference(ValueError):
+    """Raised when a pool comes without hash and XML, or its XML does not have the hash it was announced with."""
+
+
+def resolve_pool_references(pool_references: list[PoolReference]) -> tuple[list[BpmnData], list[str]]:
+    """
+    Pools announced by hash, for clients that only upload the XML the server does not know yet.
+
+    Args:
+        pool_references: id, sha256 of the XML and, if the server asked for it, the XML of every pool
+
+    Returns:
+        (bpmn_models, missing): the pools with their XML, uploaded or from the pool store, and the
+        hashes of the pools whose XML still has to be sent
+
+    Raises:
+        InvalidPoolReference: a pool has neither hash nor XML, or an uploaded XML does not match its hash
+    """
+    bpmn_models = []
+    missing = []
+    for reference in pool_references:
+        xml = reference.xml
+        if xml is None and reference.hash is None:
+            raise InvalidPoolReference(f"pool {reference.id} has neither hash nor XML")
+        if xml is not None:
+            xml_hash = pool_xml_hash(xml)
+            if reference.hash is not None and xml_hash != reference.hash:
+                raise InvalidPoolReference(f"pool {reference.id} does not match hash {reference.hash}")
+            if pool_store is not None:
+                pool_store.put(xml_hash, xml)
+        elif pool_store is not None and reference.hash is not None:
+            xml = pool_store.get(reference.hash)
+        if xml is None:
+            missing.append(reference.hash)
+        else:
+            bpmn_models.append(BpmnData(id=reference.id, xml=xml))
+    return bpmn_models, list(dict.fromkeys(missing))
+
+def pool_xml_hash(bpmn_xml: str) -> str:
+    # the hash the client computes, over the XML exactly as sent
+    return hashlib.sha256(bpmn_xml.encode("utf-8")).hexdigest()
+
+def get_ingestion_executor() -> ProcessPoolExecutor:
+    # one pool per server process, the workers keep pm4py imported between requests
+    global _ingestion_executor
+    if _ingestion_executor is None:
+        _ingestion_executor = ProcessPoolExecutor(max_workers=INGESTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _ingestion_executor
+
+def ingest_pool(idx: int, bpmn_xml: str, determinize: bool = False) -> DeterministicFiniteAutomaton:
+    # runs in a worker process, takes and returns only picklable data
+    return ingest_parsed_pool(idx, parse_bpmn_xml(bpmn_xml), determinize)
+
+def ingest_parsed_pool(idx: int, root, determinize: bool = False) -> DeterministicFiniteAutomaton:
+    flow_ids = get_sequence_flow_ids(root)
+
+    if DIRECT_BPMN_TRANSLATION:
+        try:
+            return convert_bpmn_to_dfa(root, str(idx), flow_ids, determinize)
+        except (UnsupportedBpmnError, UnsafeNetError) as e:
+            print(f"Pool {idx}: {e}, using the pm4py conversion")
+
+    bpmn_graph = bpmn_importer.import_xml_tree_from_root(root)
+    petri_net = convert_bpmn_to_petri_net(bpmn_graph)
+
+    #save_visualized_petri_net("pic/" + str(idx) + "_petri_net.png", petri_net)
+    #save_visualized_transition_system("pic/" + str(idx) + "_transition_system.png", convert_petri_net_to_ts(petri_net))
+    return convert_petri_net_to_dfa(petri_net, str(idx), flow_ids, determinize)
+
+def parse_bpmn_xml(bpmn_xml: str):
+    # parsed once in memory with the parser pm4py's importer uses, the tree serves the import and the flow ids
+    return objectify.fromstring(bpmn_xml.encode("utf-8"), parser=etree.XMLParser(remove_comments=True))
+
+def process_content_hash(root) -> str:
+    # hash of the canonical process elements, the diagram (layout), exporter attributes and formatting do not count
+    digest = hashlib.sha256()
+    for process in root.iter("{http://www.omg.org/spec/BPMN/20100524/MODEL}process"):
+        digest.update(re.sub(rb">\s+<", b"><", etree.tostring(process, method="c14n")))
+    return digest.hexdigest()
+
+def pool_cache_key(root, idx: int, determinize: bool) -> str:
+    # the index is part of the key because the state names carry it
+    return hashlib.sha256(f"{POOL_CACHE_VERSION}|{idx}|{determinize}|{DIRECT_BPMN_TRANSLATION}|{process_content_hash(root)}".encode("utf-8")).hexdigest()
+
+def result_store_key(roots, constrains: list[ConstraintData], columnar: bool = False) -> str:
+    # pools and constraints stay in request order: the order decides the state names and the colour order of the output
+    # every setting that changes the response, or whether there is one at all (the pool limit)
+    settings = (RESULT_STORE_VERSION, USE_COMPACT_DFA, REACHABLE_ONLY_PRODUCT, FUSED_PRODUCT, MINIMIZE_PROCESS_DFAS, MINIMIZE_HYBRID_DFA, DETERMINIZE_PROCESS_DFAS,
+                DIRECT_BPMN_TRANSLATION, MAX_POOL_STATES)
+    canonical = {
+        "settings": settings,
+        "pools": [process_content_hash(root) for root in roots],
+        "constraints": [(constraint.constraintType, constraint.sourceRef, constraint.targetRef, constraint.id) for constraint in constrains],
+        # a columnar response is stored apart from the JSON one of the same build
+        "columnar": columnar,
+    }
+    return hashlib.sha256(json.dumps(canonical, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def cache_counters() -> dict:
+    # lookups of the caches of this process; a build worker process reports how they changed with every job
+    return {
+        "pool_cache": pool_cache.counters() if pool_cache is not None else dict(),
+        "result_store": result_store.counters() if result_store is not None else dict(),
+    }
+
+def get_pool_cache_stats(workers: dict = None) -> dict:
+    return pool_cache.stats(workers) if pool_cache is not None else {"enabled": False}
 
-def get_sequence_flow_ids(bpmn_xml) -> list[(str,str,str)]:
-    root = ET.fromstring(bpmn_xml)
-    flow_ids = set()
-    for flow in root.findall(".//{http://www.omg.org/spec/BPMN/20100524/MODEL}sequenceFlow"):
-        flow_ids.add((flow.get("id"), flow.get("sourceRef"), flow.get("targetRef")))
+def get_result_store_stats(workers: dict = None) -> dict:
+    return result_store.stats(workers) if result_store is not None else {"enabled": False}
+
+def get_pool_store_stats() -> dict:
+    return pool_store.stats() if pool_store is not None else {"enabled": False}
+
+def get_sequence_flow_ids(root) -> list[(str,str,str)]:
+    flow_ids = []
+    for flow in root.iter("{http://www.omg.org/spec/BPMN/20100524/MODEL}sequenceFlow"):
+        flow_ids.append((flow.get("id"), flow.get("sourceRef"), flow.get("targetRef")))
     return flow_ids
 
 def convert_bpmn_to_petri_net(bpmn_graph: any) -> tuple[any, any, any]:
@@ -82,9 +320,34 @@ def save_visualized_transition_system(ts_output_path: str, ts: TransitionSystem)
     ts_gviz = ts_visualizer.apply(ts)
     ts_visualizer.save(ts_gviz, ts_output_path)
 
-def convert_transition_system_to_dfa(ts: TransitionSystem, id: str, flow_ids: list[(str,str,str)]) -> DeterministicFiniteAutomaton:
+def convert_bpmn_to_dfa(root, id: str, flow_ids: list[(str,str,str)], determinize: bool = False) -> DeterministicFiniteAutomaton:
+    # sequential/XOR/AND pools: workflow net straight from the BPMN tree, no pm4py objects on the way
+    places, transitions, initial_places = translate_bpmn(root)
+    states, arcs = explore_net(places, transitions, initial_places, MAX_POOL_STATES)
+    return build_process_dfa(states, arcs, id, flow_ids, determinize)
+
+def convert_petri_net_to_dfa(pn: tuple[any, any, any], id: str, flow_ids: list[(str,str,str)], determinize: bool = False) -> DeterministicFiniteAutomaton:
+    # bitset token game for the 1-safe nets the BPMN conversion produces, pm4py's reachability graph otherwise
+    try:
+        states, arcs = explore_markings(pn[0], pn[1], MAX_POOL_STATES)
+    except UnsafeNetError as e:
+        print(f"Pool {id} is not 1-safe ({e}), using the pm4py reachability graph")
+        return convert_transition_system_to_dfa(convert_petri_net_to_ts(pn), id, flow_ids, determinize)
+    return build_process_dfa(states, arcs, id, flow_ids, determinize)
+
+def convert_transition_system_to_dfa(ts: TransitionSystem, id: str, flow_ids: list[(str,str,str)], determinize: bool = False) -> DeterministicFiniteAutomaton:
+    states = {state.name: (len(state.incoming) != 0, len(state.outgoing) != 0) for state in ts.states}
+    arcs = [(transition.from_state.name, transition.name, transition.to_state.name) for transition in ts.transitions]
+    return build_process_dfa(states, arcs, id, flow_ids, determinize)
+
+def build_process_dfa(states: dict[str, tuple[bool, bool]], arcs: list[tuple[str, str, str]], id: str, flow_ids: list[(str,str,str)], determinize: bool = False) -> DeterministicFiniteAutomaton:
+    # states: reachability graph state name -> (has incoming, has outgoing), arcs: (from state, transition name, to state)
     dfa = DeterministicFiniteAutomaton()
     dfa.id = id
+    edges = []
+    # labels of the routing transitions (pm4py gives them no visible label) that are no BPMN element, followed
+    # silently when determinizing; routing through flows and gateways stays visible, the token simulation fires them
+    silent = set()
 
     def normalize_state_name(state_name):
         if state_name.startswith("sink") or state_name.startswith("source"):
@@ -95,65 +358,86 @@ def convert_transition_system_to_dfa(ts: TransitionSystem, id: str, flow_ids: li
             return f"P{id}_{state_name.strip('exi_')}"
         return state_name
 
-    def is_random_id(uuid_string):
-        # regex pattern for UUID
-        uuid_pattern = r'^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}$'
-        return bool(re.match(uuid_pattern, uuid_string))
-
-    for state in ts.states:
-        dfa.states.add(normalize_state_name(state.name))
-        if len(state.outgoing) == 0 and len(state.incoming) != 0:
-            dfa.accepting_states.add(normalize_state_name(state.name))
-        if len(state.incoming) == 0 and len(state.outgoing) != 0:
-            dfa.initial_states.add(normalize_state_name(state.name))
-
-    for transition in ts.transitions:
-        from_state = normalize_state_name(transition.from_state.name)
-        to_state = normalize_state_name(transition.to_state.name)
-
-        # Extract just the activity part from the transition label
-        label = transition.name
-
-        # If the label is a string like "(Activity_1xqawls, 'G')", extract just the activity part
-        if isinstance(label, str) and label.startswith('(') and ',' in label:
-            try:
-                # Remove parentheses and split by comma
-                inner_content = label.strip('()')
-                parts = inner_content.split(',')
-                if len(parts) > 0:
-                    # Get the first part (activity) and clean it up
-                    activity_part = parts[0].strip().strip('\'"')
-                    label = activity_part
-
-                    # Remove sfl prefix
-                    if label.startswith("sfl_"):
-                        label = label.strip("sfl_")
-                    # change random ids to flow_id
-                    if is_random_id(label):
-                        if "source" in from_state and "Gateway" in to_state:
-                            #print("    ",from_state, label, to_state)
-                            for flow in flow_ids:
-                                flow_id = flow[0]
-                                source = flow[1]
-                                target = flow[2]
-                                #print("    ",flow_id, source, target)
-                                if target in to_state:
-                                    if "StartEvent_" in source or "Event_" in source:
-                                        label = flow_id
-            except Exception as e:
-                # If parsing fails, use the original label
-                print(f"Failed to parse label {label}: {e}")
-
-        print('label: ', label)
+    # the transitions of one Petri net transition share their name, so every name is parsed once
+    parsed_names = dict()
+    # flows leaving an event indexed by their target, the only flows a UUID label can be renamed to
+    event_flows = dict()
+    for flow_id, source, target in flow_ids:
+        if source is not None and target is not None and "Event_" in source:
+            event_flows.setdefault(target, []).append(flow_id)
+    # flow a UUID labelled transition into a gateway state is renamed to, per target state
+    gateway_flows = dict()
+
+    def parse_name(name):
+        # "(Activity_1xqawls, 'G')" -> activity part, whether pm4py gave it no visible label, whether it is a random id
+        if not (isinstance(name, str) and name.startswith('(') and ',' in name):
+            return name, False, False
+        try:
+            parts = name.strip('()').split(',')
+            label = parts[0].strip().strip('\'"')
+            routing = len(parts) > 1 and parts[1].strip() == "None"
+            # Remove sfl prefix
+            if label.startswith("sfl_"):
+                label = label.strip("sfl_")
+            return label, routing, UUID_PATTERN.match(label) is not None
+        except Exception as e:
+            # If parsing fails, use the original label
+            print(f"Failed to parse label {name}: {e}")
+            return name, False, False
+
+    for state, (has_incoming, has_outgoing) in states.items():
+        dfa.states.add(normalize_state_name(state))
+        if not has_outgoing and has_incoming:
+            dfa.accepting_states.add(normalize_state_name(state))
+        if not has_incoming and has_outgoing:
+            dfa.initial_states.add(normalize_state_name(state))
+
+    for from_name, name, to_name in arcs:
+        from_state = normalize_state_name(from_name)
+        to_state = normalize_state_name(to_name)
+
+        if name not in parsed_names:
+            parsed_names[name] = parse_name(name)
+        label, routing, random_id = parsed_names[name]
+
+        # change random ids to the id of the flow from the start event into the gateway
+        if random_id and "source" in from_state and "Gateway" in to_state:
+            if to_state not in gateway_flows:
+                matches = [flow_id for target, flows in event_flows.items() if target in to_state for flow_id in flows]
+                gateway_flows[to_state] = matches[-1] if matches else None
+            if gateway_flows[to_state] is not None:
+                label = gateway_flows[to_state]
+        if routing and UUID_PATTERN.match(label):
+            silent.add(label)
+
+        edges.append((from_state, label, to_state))
+
+    if determinize:
+        edge_count = len(edges)
+        dfa.init_determinized_dfa(id, edges, dfa.initial_states, dfa.accepting_states, silent)
+        print(f"Pool {id} determinized: {len(states)} states / {edge_count} edges -> {len(dfa.states)} states / {sum(len(targets) for targets in dfa.transition_function.values())} edges")
+        return dfa
+
+    for from_state, label, to_state in edges:
         dfa.alphabet.add(label)
         if from_state not in dfa.transition_function:
-            dfa.transition_function[from_state] = set()
-        dfa.transition_function[from_state].add((label, to_state))
+            dfa.transition_function[from_state] = dict()
+        dfa.transition_function[from_state][label] = to_state
 
     return dfa
 
 
 
+def serialize_state(state):
+    """Convert state (which might be a tuple) to a string representation"""
+    if isinstance(state, tuple):
+        return f"({','.join(str(s) for s in state)})"
+    # if isinstance(state, set):
+    #     if len(state) == 1:
+    #         return str(tuple(next(iter(state))))
+    return str(state)
+
+
 def colored_dfa_to_json(colored_dfa: ColoredDFA) -> dict:
     """
     Convert a ColoredDFA object to a JSON-serializable dictionary.
@@ -164,6 +448,17 @@ def colored_dfa_to_json(colored_dfa: ColoredDFA) -> dict:
     Returns:
         A dictionary that can be serialized to JSON
     """
+    return {name: value.materialize() if isinstance(value, LazyObject) else value for name, value in colored_dfa_fields(colored_dfa).items()}
+
+
+def colored_dfa_fields(colored_dfa: ColoredDFA) -> dict:
+    """
+    The fields of colored_dfa_to_json, with the per-state maps (transitions, default transitions, colours)
+    as LazyObjects, so json_chunks encodes them state by state without building the nested dictionary.
+    """
+    if isinstance(colored_dfa, CompactColoredDFA):
+        return compact_colored_dfa_fields(colored_dfa)
+
     def convert_set_to_list(obj):
         """Helper function to convert sets to lists recursively"""
         if isinstance(obj, set):
@@ -175,53 +470,216 @@ def colored_dfa_to_json(colored_dfa: ColoredDFA) -> dict:
         else:
             return obj
 
-    def serialize_state(state):
-        """Convert state (which might be a tuple) to a string representation"""
-        if isinstance(state, tuple):
-            return f"({','.join(str(s) for s in state)})"
-        # if isinstance(state, set):
-        #     if len(state) == 1:
-        #         return str(tuple(next(iter(state))))
-        return str(state)
-
     def serialize_transitions(transitions):
         """Convert transition dictionary to JSON-serializable format"""
-        serialized = {}
-        for state, transition_set in transitions.items():
-            state_key = serialize_state(state)
-            # Convert set of transitions to list of dictionaries
-            transition_list = []
-            for transition in transition_set:
-                if isinstance(transition, tuple) and len(transition) == 2:
-                    symbol, target_state = transition
-                    transition_list.append({
-                        "symbol": str(symbol),
-                        "target": serialize_state(target_state)
-                    })
-                else:
-                    transition_list.append(str(transition))
-            serialized[state_key] = transition_list
-        return serialized
+        for state, state_transitions in transitions.items():
+            # Convert symbol -> target mapping to list of dictionaries
+            yield serialize_state(state), [
+                {"symbol": str(symbol), "target": serialize_state(target_state)}
+                for symbol, target_state in state_transitions.items()
+            ]
 
     def serialize_colors(colors):
         """Convert colors dictionary to JSON-serializable format"""
-        serialized = {}
         for state, color_list in colors.items():
-            state_key = serialize_state(state)
-            serialized[state_key] = convert_set_to_list(color_list)
-        return serialized
+            yield serialize_state(state), convert_set_to_list(color_list)
 
-    # Build the JSON-serializable dictionary
-    json_data = {
+    return {
         "current": serialize_state(colored_dfa.current),
         "states": [serialize_state(state) for state in colored_dfa.states],
         "alphabet": list(colored_dfa.alphabet),
-        "transition_function": serialize_transitions(colored_dfa.transition_function),
+        "transition_function": LazyObject(serialize_transitions(colored_dfa.transition_function)),
+        # target of every alphabet symbol that has no entry in transition_function
+        "default_transitions": LazyObject((serialize_state(state), serialize_state(target)) for state, target in colored_dfa.default_transitions.items()),
         "init_state": serialize_state(colored_dfa.initial_states),
         "accept_states": [serialize_state(state) for state in colored_dfa.accepting_states],
-        "colors": serialize_colors(colored_dfa.colors)
+        "colors": LazyObject(serialize_colors(colored_dfa.colors))
     }
 
-    return json_data
 
 
+
+def compact_colored_dfa_fields(colored_dfa: CompactColoredDFA) -> dict:
+    """
+    The fields of colored_dfa_to_json for a CompactColoredDFA.
+    This is the only place where the interned state ids are decoded back to names.
+    """
+    dfa = colored_dfa.automaton
+    names = dfa.state_names()
+    error_name = dfa.state_name(ERROR_STATE)
+    alphabet = [str(symbol) for symbol in dfa.alphabet]
+    has_error = bool(colored_dfa.error_states)
+
+    # edges into the error sink are not listed, they are the default transition of their state
+    def transition_function():
+        for state, targets in enumerate(dfa.transition_table.tolist()):
+            yield names[state], [
+                {"symbol": symbol, "target": names[target]}
+                for symbol, target in zip(alphabet, targets) if target != ERROR_STATE
+            ]
+        if has_error:
+            yield error_name, []
+
+    def default_transitions():
+        has_default = (dfa.transition_table == ERROR_STATE).any(axis=1).tolist()
+        for state in range(dfa.num_states):
+            if has_default[state]:
+                yield names[state], error_name
+        if has_error:
+            yield error_name, error_name
+
+    def colors():
+        for state, codes in enumerate(colored_dfa.colors.tolist()):
+            yield names[state], [{constraint_id: COLOUR_NAMES[code]} for constraint_id, code in zip(colored_dfa.constraint_ids, codes)]
+
+    states = list(names)
+    if has_error:
+        states.append(error_name)
+
+    initial = names[next(iter(colored_dfa.initial_states))]
+    return {
+        "current": initial,
+        "states": states,
+        "alphabet": alphabet,
+        "transition_function": LazyObject(transition_function()),
+        "default_transitions": LazyObject(default_transitions()),
+        "init_state": initial,
+        "accept_states": [names[state] for state in sorted(colored_dfa.accepting_states)],
+        "colors": LazyObject(colors())
+    }
+
+
+def colored_dfa_columns(colored_dfa: ColoredDFA) -> dict:
+    """
+    The colored DFA in the columnar form of wire_format.columnar_colored_dfa, built straight from the automaton.
+
+    States get their ids in the order the JSON form lists them, so both forms of a build agree, but no
+    transition or colour is serialized by name: every state name is converted to a string once, for the
+    `states` table.
+    """
+    if isinstance(colored_dfa, CompactColoredDFA):
+        return compact_colored_dfa_columns(colored_dfa)
+
+    transition_function = colored_dfa.transition_function
+    default_transitions = colored_dfa.default_transitions
+    # every state the transitions mention gets an id, also ones missing from the state list
+    states = list(dict.fromkeys([*colored_dfa.states, *transition_function, *default_transitions.values(),
+                                 *(target for transitions in transition_function.values() for target in transitions.values())]))
+    ids = {state: id for id, state in enumerate(states)}
+    alphabet = list(colored_dfa.alphabet)
+    symbol_ids = {symbol: id for id, symbol in enumerate(alphabet)}
+
+    offsets = [0]
+    symbols = []
+    targets = []
+    for state in states:
+        for symbol, target in transition_function.get(state, dict()).items():
+            symbols.append(symbol_ids[symbol])
+            targets.append(ids[target])
+        offsets.append(len(targets))
+    default_targets = [ids[default_transitions[state]] if state in default_transitions else -1 for state in states]
+
+    constraints = []
+    statuses = []
+    status_ids = dict()
+    palette = dict()
+    colors = []
+    for state in states:
+        colours = colored_dfa.colors.get(state)
+        if not colours:
+            colors.append(-1)
+            continue
+        if not constraints:
+            constraints = [next(iter(colour)) for colour in colours]
+        row = []
+        for colour in colours:
+            status = next(iter(colour.values()))
+            if status not in status_ids:
+                status_ids[status] = len(statuses)
+                statuses.append(status)
+            row.append(status_ids[status])
+        colors.append(palette.setdefault(tuple(row), len(palette)))
+
+    initial = colored_dfa.initial_states
+    return {
+        "format": "columnar",
+        "states": [serialize_state(state) for state in states],
+        "alphabet": alphabet,
+        "current": ids[colored_dfa.current],
+        "init_state": ids[next(iter(initial)) if isinstance(initial, set) else initial],
+        "accepting": [ids[state] for state in colored_dfa.accepting_states],
+        "offsets": offsets,
+        "symbols": symbols,
+        "targets": targets,
+        "default_targets": default_targets,
+        "constraints": constraints,
+        "statuses": statuses,
+        "colors": colors,
+        "palette": [status for row in palette for status in row],
+    }
+
+
+def compact_colored_dfa_columns(colored_dfa: CompactColoredDFA) -> dict:
+    """
+    colored_dfa_columns for a CompactColoredDFA, the columns are taken from its int32 table as numpy arrays.
+    The error sink, when there is one, is the last state, like in compact_colored_dfa_fields.
+    """
+    dfa = colored_dfa.automaton
+    table = dfa.transition_table
+    n = dfa.num_states
+    has_error = bool(colored_dfa.error_states)
+    states = dfa.state_names()
+    if has_error:
+        states.append(dfa.state_name(ERROR_STATE))
+
+    # edges into the error sink are not listed, they are the default transition of their state
+    listed = table != ERROR_STATE
+    counts = listed.sum(axis=1)
+    if has_error:
+        counts = np.append(counts, 0)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    symbols = np.nonzero(listed)[1]
+    targets = table[listed]
+    default_targets = np.where(listed.all(axis=1), -1, n)
+    if has_error:
+        default_targets = np.append(default_targets, n)
+
+    # statuses and palette rows are numbered by first occurrence, like columnar_colored_dfa does for the JSON form
+    codes = colored_dfa.colors
+    constraints = list(colored_dfa.constraint_ids) if codes.shape[1] else []
+    if constraints and n:
+        used, first = np.unique(codes.ravel(), return_index=True)
+        used = used[np.argsort(first)]
+        status_of = np.full(len(COLOUR_NAMES), -1, dtype=np.int64)
+        status_of[used] = np.arange(used.size)
+        rows, first, inverse = np.unique(status_of[codes], axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.size)
+        colors = rank[inverse.reshape(-1)]
+        statuses = [COLOUR_NAMES[code] for code in used.tolist()]
+        palette = rows[order].ravel()
+    else:
+        colors = np.full(n, -1, dtype=np.int64)
+        statuses = []
+        palette = np.zeros(0, dtype=np.int64)
+    if has_error:
+        colors = np.append(colors, -1)
+
+    initial = next(iter(colored_dfa.initial_states))
+    return {
+        "format": "columnar",
+        "states": states,
+        "alphabet": [str(symbol) for symbol in dfa.alphabet],
+        "current": initial,
+        "init_state": initial,
+        "accepting": sorted(colored_dfa.accepting_states),
+        "offsets": offsets,
+        "symbols": symbols,
+        "targets": targets,
+        "default_targets": default_targets,
+        "constraints": constraints,
+        "statuses": statuses,
+        "colors": colors,
+        "palette": palette,
+    }
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.model.case_monitor import CaseMonitor
+from app.service.job_service import DONE, Job, job_response
+from app.service.wire_format import columnar_response
+
+# case monitors kept at the same time, the least recently used one is dropped for a new one
+MONITOR_LIMIT = int(os.environ.get("MONITOR_LIMIT", "8"))
+# cases a single monitor follows before events of new cases are rejected (0 for no limit)
+MONITOR_MAX_CASES = int(os.environ.get("MONITOR_MAX_CASES", "1000000"))
+# events a single batch may hold
+MONITOR_MAX_BATCH = int(os.environ.get("MONITOR_MAX_BATCH", "100000"))
+
+
+class MonitorNotReady(RuntimeError):
+    pass
+
+
+class TooManyCases(RuntimeError):
+    pass
+
+
+class Monitor:
+    """Many cases of one finished build monitored together, fed with batches of events."""
+
+    def __init__(self, job_id: str, cases: CaseMonitor):
+        self.id = str(uuid.uuid4())
+        self.job_id = job_id
+        self.cases = cases
+        self.batches = 0
+        self.created = time.time()
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        # caller holds the lock
+        return {"monitor_id": self.id, "job_id": self.job_id, "batches": self.batches, **self.cases.stats()}
+
+
+_monitors: OrderedDict[str, Monitor] = OrderedDict()
+_monitors_lock = threading.Lock()
+
+
+def create_monitor(job: Job) -> dict:
+    """
+    Start monitoring cases against the colored DFA a finished job built.
+
+    The DFA is read through its columnar form, so a result of either engine, in any format the worker
+    encoded it in, works the same way.
+
+    Raises:
+        MonitorNotReady: the job is not done
+    """
+    if job.status != DONE:
+        raise MonitorNotReady(f"Job is {job.current_status()}")
+    monitor = Monitor(job.id, CaseMonitor(columnar_response(job_response(job))["colored_dfa"]))
+    with monitor.lock:
+        snapshot = monitor.snapshot()
+    with _monitors_lock:
+        _monitors[monitor.id] = monitor
+        while len(_monitors) > MONITOR_LIMIT:
+            _monitors.popitem(last=False)
+    return snapshot
+
+
+def get_monitor(monitor_id: str) -> Monitor | None:
+    with _monitors_lock:
+        monitor = _monitors.get(monitor_id)
+        if monitor is not None:
+            _monitors.move_to_end(monitor_id)
+        return monitor
+
+
+def monitor_snapshot(monitor: Monitor) -> dict:
+    with monitor.lock:
+        return monitor.snapshot()
+
+
+def advance(monitor: Monitor, events: list) -> dict:
+    """
+    Apply a batch of (case id, activity) events, in the order they are listed.
+
+    Raises:
+        ValueError: the batch holds more than MONITOR_MAX_BATCH events
+        TooManyCases: the events would make the monitor follow more than MONITOR_MAX_CASES cases
+    """
+    if len(events) > MONITOR_MAX_BATCH:
+        raise ValueError(f"{len(events)} events in one batch, at most {MONITOR_MAX_BATCH} are accepted")
+    with monitor.lock:
+        cases = monitor.cases
+        if MONITOR_MAX_CASES:
+            new_cases = {str(case_id) for case_id, _ in events} - cases.case_ids.keys()
+            if len(cases.case_ids) + len(new_cases) > MONITOR_MAX_CASES:
+                raise TooManyCases(f"{len(cases.case_ids) + len(new_cases)} cases, at most {MONITOR_MAX_CASES} are monitored")
+        seconds = cases.seconds
+        changes = cases.advance(events)
+        monitor.batches += 1
+        return {"events": len(events), "seconds": cases.seconds - seconds, "changes": changes}
+
+
+def case_status(monitor: Monitor, case_id: str) -> dict | None:
+    with monitor.lock:
+        return monitor.cases.case(case_id)
+
+
+def delete_monitor(monitor_id: str) -> bool:
+    with _monitors_lock:
+        return _monitors.pop(monitor_id, None) is not None
+
+
+def get_monitor_stats() -> dict:
+    with _monitors_lock:
+        return {"monitors": len(_monitors), "limit": MONITOR_LIMIT, "max_cases": MONITOR_MAX_CASES, "max_batch": MONITOR_MAX_BATCH}
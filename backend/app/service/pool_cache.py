@@ -0,0 +1,143 @@
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ProcessDfaCache:
+    """
+    LRU cache of finished per-pool DFAs keyed by a content hash, with an optional directory as second tier.
+
+    Entries are stored pickled, so every hit hands out a fresh DFA the caller may modify (updateSingleDFA
+    and the minimization work in place). The directory is bounded on its own by max_disk_bytes: a hit touches
+    the file, and the files with the oldest modification time are removed first. Worker processes sharing the
+    directory evict from it alike.
+    """
+
+    def __init__(self, max_entries: int, directory: str = None, max_disk_bytes: int = 0):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def touch(self, key):
+        # the modification time is the recency the disk tier evicts by
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if data is not None:
+            # an entry served from memory is still in use, its file must not age out of the directory
+            if self.directory:
+                self.touch(key)
+            return pickle.loads(data)
+
+        if self.directory:
+            try:
+                with open(self.path(key), "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self.touch(key)
+                with self.lock:
+                    self.disk_hits += 1
+                    self.remember(key, data)
+                return pickle.loads(data)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, dfa):
+        data = pickle.dumps(dfa, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.remember(key, data)
+        if self.directory:
+            # write and rename, so other workers never read half a file
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+                file.write(data)
+            os.replace(file.name, self.path(key))
+            self.evict_files()
+
+    def disk_files(self) -> list:
+        # (modification time, size, path) of every cached file, temporary files being written are not counted
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    status = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another worker in the meantime
+                    continue
+                files.append((status.st_mtime, status.st_size, entry.path))
+        return files
+
+    def evict_files(self):
+        if not self.max_disk_bytes:
+            return
+        files = self.disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self.lock:
+                self.disk_evictions += 1
+
+    def remember(self, key, data):
+        # caller holds the lock
+        self.entries[key] = data
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def counters(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+    def stats(self, workers: dict = None) -> dict:
+        # workers: lookups the worker processes made in their own caches (see counters), added to those of this one
+        counters = self.counters()
+        for name, count in (workers or dict()).items():
+            counters[name] += count
+        lookups = sum(counters.values())
+        with self.lock:
+            entries = len(self.entries)
+            disk_evictions = self.disk_evictions
+        files = self.disk_files() if self.directory else []
+        return {
+            # entries of this process only, every worker process keeps a cache of its own
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "disk_tier": self.directory is not None,
+            # the directory is shared, its files and bytes are those of all processes
+            "disk_entries": len(files),
+            "disk_bytes": sum(size for _, size, _ in files),
+            "max_disk_bytes": self.max_disk_bytes,
+            "disk_evictions": disk_evictions,
+            **counters,
+            "hit_rate": (counters["hits"] + counters["disk_hits"]) / lookups if lookups else 0.0,
+        }
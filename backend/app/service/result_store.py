@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ResultStore:
+    """
+    JSON values (finished /generateDfa responses, uploaded pool XML) in a SQLite file that all server workers share.
+
+    Values are stored as zlib compressed JSON, one table per kind of value. When the stored data grows beyond
+    max_bytes the least recently used values are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int, table: str = "results"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.table = table
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self.connection() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads, every request thread gets its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key: str):
+        data = self.get_encoded(key)
+        return json.loads(data) if data is not None else None
+
+    def get_encoded(self, key: str) -> bytes | None:
+        # the value as the UTF-8 JSON it was stored as
+        connection = self.connection()
+        row = connection.execute(f"SELECT data FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        with connection:
+            connection.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+        return zlib.decompress(row[0])
+
+    def put(self, key: str, value):
+        self.put_encoded(key, [json.dumps(value, separators=(",", ":")).encode("utf-8")])
+
+    def put_encoded(self, key: str, chunks):
+        # a value already encoded as UTF-8 JSON, in chunks that are compressed one after another
+        for _ in self.put_chunks(key, chunks):
+            pass
+
+    def put_chunks(self, key: str, chunks):
+        # passes the chunks on while compressing them, the value is stored once the last one went through;
+        # only the compressed value is held, and not even that once it outgrows the store
+        compressor = zlib.compressobj()
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if size <= self.max_bytes:
+                part = compressor.compress(chunk)
+                parts.append(part)
+                size += len(part)
+            yield chunk
+        if size > self.max_bytes:
+            return
+        data = b"".join(parts + [compressor.flush()])
+        if len(data) > self.max_bytes:
+            return
+        connection = self.connection()
+        with connection:
+            connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, data, size, last_access) VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+            self.evict(connection)
+
+    def evict(self, connection: sqlite3.Connection):
+        # runs inside the transaction of put
+        total = connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in connection.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
+
+    def counters(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def stats(self, workers: dict = None) -> dict:
+        # workers: lookups the build worker processes made (see counters), added to those of this process
+        entries, size = self.connection().execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        counters = self.counters()
+        for name, count in (workers or dict()).items():
+            counters[name] += count
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "path": self.path,
+            "table": self.table,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            # counters of this server worker, the entries are shared by all of them
+            **counters,
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        }
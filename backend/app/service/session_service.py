@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.model.build_control import BuildControl, using_control
+from app.model.lazy_product import ERROR_STATE, LazyHybridDFA
+from app.model.main_model import BpmnData, ConstraintData
+from app.service import main_service
+from app.service.dfa_service import create_constraint_dfas, prepare_process_dfas
+
+# monitoring sessions kept at the same time, the least recently used one is dropped for a new one
+SESSION_LIMIT = int(os.environ.get("SESSION_LIMIT", "32"))
+# memoized process moves and colours per session, least recently used ones are evicted
+SESSION_CACHE_ENTRIES = int(os.environ.get("SESSION_CACHE_ENTRIES", "200000"))
+# states a single colour exploration may visit before the request is rejected (0 for no limit)
+SESSION_MAX_EXPLORED = int(os.environ.get("SESSION_MAX_EXPLORED", "2000000"))
+
+
+class MonitoringSession:
+    """One token simulation stepped on the server, on the lazily explored hybrid of its pools and constraints."""
+
+    def __init__(self, dfa: LazyHybridDFA):
+        self.id = str(uuid.uuid4())
+        self.dfa = dfa
+        self.current = dfa.initial_state()
+        self.fired = 0
+        self.created = time.time()
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        # caller holds the lock
+        return {
+            "session_id": self.id,
+            "state": state_name(self.current),
+            "accepting": self.dfa.is_accepting(self.current),
+            "colors": self.dfa.state_colours(self.current),
+            "available": self.dfa.available_symbols(self.current),
+            "fired": self.fired,
+            "cache": self.dfa.stats(),
+        }
+
+
+_sessions: OrderedDict[str, MonitoringSession] = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def state_name(state) -> str:
+    # the name colored_dfa_to_json gives the same state
+    return f"({','.join(str(component) for component in state)})"
+
+
+def exploration_control() -> BuildControl:
+    return BuildControl(max_states=SESSION_MAX_EXPLORED or None)
+
+
+def create_session(bpmn_models: list[BpmnData], constrains: list[ConstraintData]) -> dict:
+    """
+    Start monitoring the pools and constraints without building their hybrid DFA.
+
+    Raises:
+        StateSpaceLimitExceeded: a pool has more reachable markings than MAX_POOL_STATES
+        BudgetExceeded: colouring the initial state visits more than SESSION_MAX_EXPLORED states
+    """
+    roots = [main_service.parse_bpmn_xml(bpmn_model.xml) for bpmn_model in bpmn_models]
+    process_dfas = prepare_process_dfas(main_service.load_process_dfas(bpmn_models, roots), main_service.MINIMIZE_PROCESS_DFAS)
+    constraint_dfas = create_constraint_dfas(constrains, set().union(*(process.alphabet for process in process_dfas)))
+    session = MonitoringSession(LazyHybridDFA(process_dfas, constraint_dfas, SESSION_CACHE_ENTRIES))
+    with session.lock, using_control(exploration_control()):
+        snapshot = session.snapshot()
+    with _sessions_lock:
+        _sessions[session.id] = session
+        while len(_sessions) > SESSION_LIMIT:
+            _sessions.popitem(last=False)
+    return snapshot
+
+
+def get_session(session_id: str) -> MonitoringSession | None:
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is not None:
+            _sessions.move_to_end(session_id)
+        return session
+
+
+def session_snapshot(session: MonitoringSession) -> dict:
+    with session.lock, using_control(exploration_control()):
+        return session.snapshot()
+
+
+def fire(session: MonitoringSession, activity: str) -> dict:
+    """
+    Step the session with a fired activity, an activity the current state has no edge for leaves it where it is.
+
+    Raises:
+        BudgetExceeded: colouring the next state visits more than SESSION_MAX_EXPLORED states
+    """
+    with session.lock, using_control(exploration_control()):
+        previous = session.current
+        next_state = session.dfa.step(previous, activity)
+        if next_state is not None:
+            session.current = next_state
+            session.fired += 1
+        return {**session.snapshot(), "previous": state_name(previous), "moved": next_state is not None, "error_state": session.current == ERROR_STATE}
+
+
+def reset_session(session: MonitoringSession) -> dict:
+    # back to the initial state, the memoized part of the hybrid is kept
+    with session.lock, using_control(exploration_control()):
+        session.current = session.dfa.initial_state()
+        session.fired = 0
+        return session.snapshot()
+
+
+def delete_session(session_id: str) -> bool:
+    with _sessions_lock:
+        return _sessions.pop(session_id, None) is not None
+
+
+def get_session_stats() -> dict:
+    with _sessions_lock:
+        return {"sessions": len(_sessions), "limit": SESSION_LIMIT, "cache_entries": SESSION_CACHE_ENTRIES, "max_explored": SESSION_MAX_EXPLORED}
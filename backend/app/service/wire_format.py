@@ -0,0 +1,252 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    # optional, without it application/msgpack is not offered
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    # optional, the json module encodes and decodes without it
+    orjson = None
+
+JSON = "application/json"
+# the colored DFA as columns of integer ids, as JSON or as a binary of int32 arrays
+COLUMNAR_JSON = "application/vnd.dfa.columnar+json"
+COLUMNAR_BINARY = "application/vnd.dfa.columnar"
+MSGPACK = "application/msgpack"
+
+# bytes the pieces of a streamed response are gathered into before they are handed on
+CHUNK_BYTES = 64 * 1024
+
+BINARY_MAGIC = b"CDFA"
+BINARY_VERSION = 1
+# integer columns of the columnar colored DFA, in the order the binary format stores them
+ARRAYS = ("offsets", "symbols", "targets", "default_targets", "accepting", "colors", "palette")
+
+
+class LazyObject:
+    """A JSON object whose (key, value) pairs are produced while json_chunks encodes it."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def materialize(self) -> dict:
+        return dict(self.items)
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_chunks(value):
+    """
+    Encode value as JSON in chunks of about CHUNK_BYTES.
+
+    Dicts are walked key by key and a LazyObject pair by pair, everything else is encoded in one piece, so
+    only the chunk being filled is held in encoded form, never the whole document.
+    """
+    buffer = bytearray()
+    for piece in json_pieces(value):
+        buffer += piece
+        if len(buffer) >= CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def json_pieces(value):
+    if isinstance(value, dict):
+        yield b"{"
+        for index, (key, item) in enumerate(value.items()):
+            yield (b"," if index else b"") + dumps(key) + b":"
+            yield from json_pieces(item)
+        yield b"}"
+    elif isinstance(value, LazyObject):
+        yield b"{"
+        for index, (key, item) in enumerate(value.items):
+            yield (b"," if index else b"") + dumps(key) + b":" + dumps(item)
+        yield b"}"
+    else:
+        yield dumps(value)
+
+
+def columnar_colored_dfa(colored_dfa: dict) -> dict:
+    """
+    Re-encode the colored DFA of a /generateDfa response with integer state ids.
+
+    For a response that is already JSON (a stored result, a job encoded as JSON); a build asked for in
+    columns gets them straight from its automaton, see main_service.colored_dfa_columns.
+
+    Every state name is listed once in `states`, its position is the id used everywhere else. The transitions
+    of state i are entries offsets[i] to offsets[i + 1] of `symbols` (index into `alphabet`) and `targets`,
+    default_targets[i] is the target of every other symbol (-1 for none). The colours are dictionary encoded:
+    colors[i] is a row of `palette` (-1 for an uncoloured state), a row holds one index into `statuses` per
+    entry of `constraints`, so the palette is flat with len(constraints) values per row.
+
+    Args:
+        colored_dfa: the "colored_dfa" of a response, as built by colored_dfa_to_json
+
+    Returns:
+        The columnar colored DFA, all its values are lists of strings or ints
+    """
+    transition_function = colored_dfa["transition_function"]
+    default_transitions = colored_dfa.get("default_transitions", {})
+    # every state the transitions mention gets an id, also ones missing from the state list
+    states = list(dict.fromkeys([*colored_dfa["states"], *transition_function, *default_transitions.values(),
+                                 *(transition["target"] for transitions in transition_function.values() for transition in transitions)]))
+    ids = {name: id for id, name in enumerate(states)}
+    alphabet = list(colored_dfa["alphabet"])
+    symbol_ids = {symbol: id for id, symbol in enumerate(alphabet)}
+
+    offsets = [0]
+    symbols = []
+    targets = []
+    for name in states:
+        for transition in transition_function.get(name, ()):
+            symbols.append(symbol_ids[transition["symbol"]])
+            targets.append(ids[transition["target"]])
+        offsets.append(len(targets))
+    default_targets = [ids[default_transitions[name]] if name in default_transitions else -1 for name in states]
+
+    constraints = []
+    statuses = []
+    status_ids = dict()
+    palette = dict()
+    colors = []
+    for name in states:
+        colours = colored_dfa["colors"].get(name)
+        if not colours:
+            colors.append(-1)
+            continue
+        if not constraints:
+            constraints = [next(iter(colour)) for colour in colours]
+        row = []
+        for colour in colours:
+            status = next(iter(colour.values()))
+            if status not in status_ids:
+                status_ids[status] = len(statuses)
+                statuses.append(status)
+            row.append(status_ids[status])
+        colors.append(palette.setdefault(tuple(row), len(palette)))
+
+    return {
+        "format": "columnar",
+        "states": states,
+        "alphabet": alphabet,
+        "current": ids[colored_dfa["current"]],
+        "init_state": ids[colored_dfa["init_state"]],
+        "accepting": [ids[name] for name in colored_dfa["accept_states"]],
+        "offsets": offsets,
+        "symbols": symbols,
+        "targets": targets,
+        "default_targets": default_targets,
+        "constraints": constraints,
+        "statuses": statuses,
+        "colors": colors,
+        "palette": [status for row in palette for status in row],
+    }
+
+
+def columnar_response(response: dict) -> dict:
+    # the response with its colored DFA in columns, the other fields are kept as they are
+    if "colored_dfa" not in response:
+        return response
+    colored_dfa = response["colored_dfa"]
+    if colored_dfa.get("format") == "columnar":
+        # already in columns, as decode_response reads them (the binary format as arrays)
+        return {**response, "colored_dfa": {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in colored_dfa.items()}}
+    return {**response, "colored_dfa": columnar_colored_dfa(colored_dfa)}
+
+
+def encode_binary(response: dict) -> bytes:
+    """
+    Encode a response for COLUMNAR_BINARY.
+
+    Layout: the magic "CDFA", the format version and the header length as little endian uint32, a UTF-8 JSON
+    header padded with spaces to a multiple of 4 bytes, then the integer columns as little endian int32 arrays
+    one after another. The header is the columnar response without those columns plus "arrays", the name and
+    length of every column in the order they follow; every column starts 4 byte aligned, so the client can
+    view the buffer as typed arrays without copying.
+    """
+    colored_dfa = response.get("colored_dfa")
+    if colored_dfa is not None and colored_dfa.get("format") != "columnar":
+        response = columnar_response(response)
+    colored_dfa = response.get("colored_dfa")
+    arrays = []
+    if colored_dfa is not None:
+        arrays = [(name, colored_dfa[name]) for name in ARRAYS]
+        response = {**response, "colored_dfa": {key: value for key, value in colored_dfa.items() if key not in ARRAYS}}
+    header = dumps({**response, "arrays": [[name, len(values)] for name, values in arrays]})
+    header += b" " * (-len(header) % 4)
+    return b"".join([BINARY_MAGIC, struct.pack("<II", BINARY_VERSION, len(header)), header]
+                    + [np.asarray(values, dtype="<i4").tobytes() for _, values in arrays])
+
+
+def decode_binary(data: bytes) -> dict:
+    # the columnar response encode_binary wrote, with the columns as int32 arrays viewing the buffer
+    magic = data[:4]
+    version, header_length = struct.unpack_from("<II", data, 4)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"not a columnar binary of version {BINARY_VERSION}")
+    response = loads(data[12:12 + header_length])
+    offset = 12 + header_length
+    for name, length in response.pop("arrays"):
+        response["colored_dfa"][name] = np.frombuffer(data, dtype="<i4", count=length, offset=offset)
+        offset += length * 4
+    return response
+
+
+def decode_response(data: bytes, media_type: str) -> dict:
+    # the response encode_response wrote, the colored DFA is in columns for every type but JSON
+    if media_type == COLUMNAR_BINARY:
+        return decode_binary(data)
+    if media_type == MSGPACK:
+        return msgpack.unpackb(data)
+    return loads(data)
+
+
+def negotiate(accept: str | None) -> str:
+    # media type of the response: the preferred one of the Accept header this server can produce, JSON otherwise
+    offered = [COLUMNAR_JSON, COLUMNAR_BINARY, JSON] + ([MSGPACK] if msgpack is not None else [])
+    ranges = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *parameters = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, media_type.lower()))
+    for quality, _, media_type in sorted(ranges):
+        if quality == 0:
+            break
+        if media_type in offered:
+            return media_type
+        if media_type in ("*/*", "application/*"):
+            return JSON
+    return JSON
+
+
+def encode_response(response: dict, media_type: str) -> bytes:
+    if media_type == COLUMNAR_JSON:
+        return dumps(columnar_response(response))
+    if media_type == COLUMNAR_BINARY:
+        return encode_binary(response)
+    if media_type == MSGPACK:
+        return msgpack.packb(columnar_response(response))
+    return dumps(response)
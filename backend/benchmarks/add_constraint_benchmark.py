@@ -0,0 +1,52 @@
+"""
+Scaling benchmark for DeterministicFiniteAutomaton.add_constraint.
+
+Builds a synthetic two-process hybrid (two chains of length n interleaved, i.e. n*n states)
+and adds a response constraint on top of it. Run from the backend directory:
+
+    python -m benchmarks.add_constraint_benchmark 10000 100000 1000000
+"""
+import math
+import sys
+import time
+
+from app.model.main_model import ConstraintData, DeterministicFiniteAutomaton
+
+
+def build_interleaved_chains(length):
+    # two processes with `length` steps each, labels repeat every four steps
+    dfa = DeterministicFiniteAutomaton()
+    dfa.id = "benchmark"
+    dfa.alphabet = {f"A{i}" for i in range(4)} | {f"B{i}" for i in range(4)}
+    for i in range(length):
+        for j in range(length):
+            state = (f"P0_{i}", f"P1_{j}")
+            dfa.states.add(state)
+            transitions = dict()
+            if i + 1 < length:
+                transitions[f"A{i % 4}"] = (f"P0_{i + 1}", f"P1_{j}")
+            if j + 1 < length:
+                transitions[f"B{j % 4}"] = (f"P0_{i}", f"P1_{j + 1}")
+            dfa.transition_function[state] = transitions
+    dfa.initial_states = {("P0_0", "P1_0")}
+    dfa.accepting_states = {(f"P0_{length - 1}", f"P1_{length - 1}")}
+    return dfa
+
+
+def run(target_states):
+    length = max(2, round(math.sqrt(target_states)))
+    hybrid = build_interleaved_chains(length)
+    constraint = DeterministicFiniteAutomaton()
+    constraint.init_constraint_dfa(ConstraintData(id="bench", sourceRef="A0", targetRef="B0", constraintType="response"), set(hybrid.alphabet))
+
+    hybrid_states = len(hybrid.states)
+    start_time = time.perf_counter()
+    hybrid.add_constraint(constraint)
+    elapsed = time.perf_counter() - start_time
+    print(f"{hybrid_states:>12,} hybrid states -> {len(hybrid.states):>12,} product states in {elapsed:8.2f}s ({len(hybrid.states) / elapsed:,.0f} states/s)")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        run(size)
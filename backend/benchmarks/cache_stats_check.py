@@ -0,0 +1,85 @@
+"""
+Check that the builds of the worker processes show up in the /cacheStats counters.
+
+Starts a server with empty caches (no POOL_CACHE_DIR, no result store) on a free port and sends every
+/generateDfa request body (JSON with `models` and `constrains`) to it twice. The first round trip has to
+count one pool-cache miss per pool, the second one lookup per pool (a hit, unless it went to the other
+worker process). Exits with status 1 when a counter did not move. Run from the backend directory:
+
+    python -m benchmarks.cache_stats_check request.json [request.json ...]
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+STARTUP_SECONDS = 60
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def call(url, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def pool_cache(base_url):
+    stats = call(base_url + "/cacheStats")["pool_cache"]
+    return stats["hits"], stats["disk_hits"], stats["misses"]
+
+
+def wait_for(base_url, server):
+    deadline = time.monotonic() + STARTUP_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit("server exited with status " + str(server.returncode))
+        try:
+            return call(base_url + "/lol")
+        except OSError:
+            time.sleep(0.5)
+    sys.exit(f"server did not answer within {STARTUP_SECONDS} seconds")
+
+
+def check(base_url, path):
+    body = json.load(open(path))
+    pools = len(body["models"])
+    failures = 0
+    for round_trip in (1, 2):
+        hits, disk_hits, misses = pool_cache(base_url)
+        call(base_url + "/generateDfa", body)
+        after_hits, after_disk_hits, after_misses = pool_cache(base_url)
+        lookups = (after_hits - hits) + (after_disk_hits - disk_hits) + (after_misses - misses)
+        # the first build ingests every pool, the second one looks every pool up again
+        expected = after_misses - misses if round_trip == 1 else lookups
+        ok = expected == pools
+        failures += not ok
+        print(f"  {path} round trip {round_trip}: {after_hits - hits} hits, {after_misses - misses} misses for {pools} pools", "ok" if ok else "FAILED")
+    return failures
+
+
+def main(paths):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {name: value for name, value in os.environ.items() if name not in ("POOL_CACHE_DIR", "RESULT_STORE_PATH")}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(base_url, server)
+        failures = sum(check(base_url, path) for path in paths)
+    finally:
+        server.terminate()
+        server.wait()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
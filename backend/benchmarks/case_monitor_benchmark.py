@@ -0,0 +1,87 @@
+"""
+Events per second of the batched case monitor against stepping every case on its own.
+
+Reads /generateDfa request bodies (JSON with `models` and `constrains`), builds the colored DFA once and
+replays the same interleaved random walks of many cases through it twice: event by event on the dict of
+the response, the way a per-case monitor steps, and in batches through CaseMonitor. Both report the same
+colour changes (case, event, state and changed colours), so their counts can be checked against each
+other. Run from the backend directory:
+
+    python -m benchmarks.case_monitor_benchmark request.json [request.json ...]
+"""
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+
+from app.model.case_monitor import CaseMonitor
+from app.model.main_model import GenerateDfaRequest
+from app.service import main_service
+from app.service.wire_format import columnar_colored_dfa
+
+CASES = 10000
+EVENTS = 1000000
+BATCH_SIZES = (100, 1000, 10000)
+
+
+def random_walks(colored_dfa, rng):
+    # interleaved events of CASES cases, every case follows edges of the DFA so it rarely ends in the error sink
+    transitions = {state: [transition["symbol"] for transition in transitions] for state, transitions in colored_dfa["transition_function"].items()}
+    targets = {(state, transition["symbol"]): transition["target"] for state, transitions in colored_dfa["transition_function"].items() for transition in transitions}
+    positions = [colored_dfa["init_state"]] * CASES
+    events = []
+    for _ in range(EVENTS):
+        case = rng.randrange(CASES)
+        symbols = transitions.get(positions[case])
+        if not symbols:
+            # a finished case starts over
+            positions[case] = colored_dfa["init_state"]
+            symbols = transitions[positions[case]]
+        symbol = rng.choice(symbols)
+        positions[case] = targets[(positions[case], symbol)]
+        events.append((f"case-{case}", symbol))
+    return events
+
+
+def step_each(colored_dfa, events):
+    targets = {(state, transition["symbol"]): transition["target"] for state, transitions in colored_dfa["transition_function"].items() for transition in transitions}
+    default_transitions = colored_dfa.get("default_transitions", {})
+    colors = {state: {constraint: status for colour in colours for constraint, status in colour.items()} for state, colours in colored_dfa["colors"].items() if colours}
+    positions = dict()
+    changes = []
+    for event, (case, symbol) in enumerate(events):
+        state = positions.get(case, colored_dfa["init_state"])
+        target = targets.get((state, symbol)) or default_transitions.get(state) or state
+        positions[case] = target
+        before = colors.get(state, {})
+        after = colors.get(target, {})
+        if before != after:
+            changed = {constraint: after.get(constraint) for constraint in before.keys() | after.keys() if before.get(constraint) != after.get(constraint)}
+            changes.append({"case": case, "event": event, "state": target, "colors": changed})
+    return changes
+
+
+def run(path):
+    request = GenerateDfaRequest(**json.load(open(path)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        colored_dfa = main_service.generate_dfa(request.models, request.constrains)["colored_dfa"]
+    events = random_walks(colored_dfa, random.Random(0))
+    print(path, f"({len(colored_dfa['states']):,} states, {CASES:,} cases, {len(events):,} events)")
+
+    start_time = time.perf_counter()
+    changes = len(step_each(colored_dfa, events))
+    seconds = time.perf_counter() - start_time
+    print(f"  {'per event':>16}: {len(events) / seconds:14,.0f} events/s {changes:>10,} colour changes")
+
+    columnar = columnar_colored_dfa(colored_dfa)
+    for batch_size in BATCH_SIZES:
+        monitor = CaseMonitor(columnar)
+        changes = sum(len(monitor.advance(events[start:start + batch_size])) for start in range(0, len(events), batch_size))
+        print(f"  {f'batches of {batch_size}':>16}: {monitor.stats()['events_per_second']:14,.0f} events/s {changes:>10,} colour changes")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        run(path)
@@ -0,0 +1,141 @@
+"""
+Expected constraint colours on two small fixed collaborations, for every colouring engine.
+
+A colour says how the constraint ends in the finished runs a state can still reach (see
+ColoredDFA.colour_constraint): satisfied or violated when all of them agree, temporary_satisfied or
+temporary_violated, by the current constraint state, when they do not. Pool P runs A and then B, or A and
+then one of B and C; pool Q only runs D, which no constraint looks at. The colours are checked after every
+prefix of the run of P, on the tuple, the compact and the lazy engine. Exits with status 1 on a difference.
+Run from the backend directory:
+
+    python -m benchmarks.colour_check
+"""
+import contextlib
+import io
+import sys
+
+from app.model.lazy_product import LazyHybridDFA
+from app.model.main_model import BpmnData, ConstraintData
+from app.service import main_service
+from app.service.dfa_service import build_colored_dfa, create_constraint_dfas, prepare_process_dfas
+
+SATISFIED = "satisfied"
+TEMPORARY_SATISFIED = "temporary_satisfied"
+TEMPORARY_VIOLATED = "temporary_violated"
+VIOLATED = "violated"
+
+CONSTRAINTS = [
+    ConstraintData(id="existence_B", sourceRef="B", targetRef="B", constraintType="existence"),
+    ConstraintData(id="response_A_B", sourceRef="A", targetRef="B", constraintType="response"),
+    ConstraintData(id="precedence_A_B", sourceRef="A", targetRef="B", constraintType="precedence"),
+    ConstraintData(id="precedence_B_A", sourceRef="B", targetRef="A", constraintType="precedence"),
+]
+
+# steps of pool P, then the colours (in the order of CONSTRAINTS) after each prefix of its run
+CASES = {
+    # every run of P ends with A and then B, so nothing is left open; changeColours showed existence_B as
+    # temporary_violated before B, response_A_B as temporary_violated between A and B, precedence_B_A as
+    # temporary_satisfied before A
+    "sequential": (["A", "B"], {
+        (): (SATISFIED, SATISFIED, SATISFIED, VIOLATED),
+        ("A",): (SATISFIED, SATISFIED, SATISFIED, VIOLATED),
+        ("A", "B"): (SATISFIED, SATISFIED, SATISFIED, VIOLATED),
+    }),
+    # B may or may not run: until the choice existence_B and response_A_B are inconclusive and lean the
+    # way their constraint state does
+    "choice": (["A", ("B", "C")], {
+        (): (TEMPORARY_VIOLATED, TEMPORARY_SATISFIED, SATISFIED, VIOLATED),
+        ("A",): (TEMPORARY_VIOLATED, TEMPORARY_VIOLATED, SATISFIED, VIOLATED),
+        ("A", "B"): (SATISFIED, SATISFIED, SATISFIED, VIOLATED),
+        ("A", "C"): (VIOLATED, VIOLATED, SATISFIED, VIOLATED),
+    }),
+}
+
+
+def pool(process, steps):
+    # a pool from start to end through the steps, a step is a task id or a tuple of task ids one of which runs
+    nodes = []
+    flows = []
+
+    def node(kind, id):
+        nodes.append((kind, id))
+        return id
+
+    def flow(source, target):
+        flows.append((f"Flow_{source}_{target}", source, target))
+
+    last = node("startEvent", "Start_" + process)
+    for step in steps:
+        if isinstance(step, tuple):
+            split = node("exclusiveGateway", "Split_" + step[0])
+            join = node("exclusiveGateway", "Join_" + step[0])
+            flow(last, split)
+            for task in step:
+                flow(split, node("task", task))
+                flow(task, join)
+            last = join
+        else:
+            flow(last, node("task", step))
+            last = step
+    flow(last, node("endEvent", "End_" + process))
+
+    xml = [f'<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="Definitions_{process}" targetNamespace="http://bpmn.io/schema/bpmn">',
+           f'<bpmn:process id="{process}">']
+    for kind, id in nodes:
+        edges = "".join(f"<bpmn:incoming>{flow_id}</bpmn:incoming>" for flow_id, _, target in flows if target == id)
+        edges += "".join(f"<bpmn:outgoing>{flow_id}</bpmn:outgoing>" for flow_id, source, _ in flows if source == id)
+        xml.append(f'<bpmn:{kind} id="{id}" name="{id}">{edges}</bpmn:{kind}>')
+    xml += [f'<bpmn:sequenceFlow id="{flow_id}" sourceRef="{source}" targetRef="{target}" />' for flow_id, source, target in flows]
+    xml.append("</bpmn:process></bpmn:definitions>")
+    return BpmnData(id=process, xml="".join(xml))
+
+
+def load(models):
+    roots = [main_service.parse_bpmn_xml(model.xml) for model in models]
+    return main_service.load_process_dfas(models, roots)
+
+
+def built_colours(models, compact):
+    # colours along a run of the built hybrid, read from its JSON form like the frontend does
+    colored_dfa = main_service.colored_dfa_to_json(build_colored_dfa(load(models), CONSTRAINTS, compact=compact))
+    targets = {state: {transition["symbol"]: transition["target"] for transition in transitions} for state, transitions in colored_dfa["transition_function"].items()}
+
+    def colours(run):
+        state = colored_dfa["init_state"]
+        for symbol in run:
+            state = targets[state][symbol]
+        return tuple(colour[constraint.id] for colour, constraint in zip(colored_dfa["colors"][state], CONSTRAINTS))
+    return colours
+
+
+def lazy_colours(models):
+    processes = prepare_process_dfas(load(models))
+    lazy = LazyHybridDFA(processes, create_constraint_dfas(CONSTRAINTS, set().union(*(process.alphabet for process in processes))), 10000)
+
+    def colours(run):
+        state = lazy.initial_state()
+        for symbol in run:
+            state = lazy.step(state, symbol)
+        return tuple(colour[constraint.id] for colour, constraint in zip(lazy.state_colours(state), CONSTRAINTS))
+    return colours
+
+
+def main():
+    failures = 0
+    for name, (steps, expected) in CASES.items():
+        models = [pool("P", steps), pool("Q", ["D"])]
+        with contextlib.redirect_stdout(io.StringIO()):
+            engines = {"tuple": built_colours(models, False), "compact": built_colours(models, True), "lazy": lazy_colours(models)}
+        for engine, colours in engines.items():
+            for run, colours_expected in expected.items():
+                got = colours(run)
+                if got != colours_expected:
+                    failures += 1
+                    print(f"{name} {engine} after {','.join(run) or 'start'}:",
+                          ", ".join(f"{constraint.id} {colour} (expected {wanted})" for constraint, colour, wanted in zip(CONSTRAINTS, got, colours_expected) if colour != wanted))
+        print(f"{name}: {len(engines)} engines, {len(expected)} prefixes")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
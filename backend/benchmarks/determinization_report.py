@@ -0,0 +1,56 @@
+"""
+State/edge reduction of the silent-step closure and subset construction per pool.
+
+Reads /generateDfa request bodies (JSON with `models` and `constrains`) and prints, for every
+pool, the size of the reachability graph next to the size of the determinized DFA, and
+the size of the final hybrid without and with determinization. Run from the backend directory:
+
+    python -m benchmarks.determinization_report request.json [request.json ...]
+"""
+import contextlib
+import io
+import json
+import sys
+
+from app.model.main_model import GenerateDfaRequest
+from app.service.dfa_service import build_colored_dfa
+from app.model.marking_explorer import explore_markings
+from app.service.main_service import build_process_dfa, convert_bpmn_to_petri_net, get_sequence_flow_ids, parse_bpmn_xml
+from pm4py.objects.bpmn.importer.variants import lxml as bpmn_importer
+
+
+def edge_count(dfa):
+    return sum(len(targets) for targets in dfa.transition_function.values())
+
+
+def build_processes(request, determinize):
+    processes = []
+    for idx, bpmn_model in enumerate(request.models):
+        root = parse_bpmn_xml(bpmn_model.xml)
+        petri_net = convert_bpmn_to_petri_net(bpmn_importer.import_xml_tree_from_root(root))
+        states, arcs = explore_markings(petri_net[0], petri_net[1])
+        with contextlib.redirect_stdout(io.StringIO()):
+            dfa = build_process_dfa(states, arcs, str(idx), get_sequence_flow_ids(root), determinize)
+        processes.append(((states, arcs), dfa))
+    return processes
+
+
+def run(path):
+    request = GenerateDfaRequest(**json.load(open(path)))
+    print(path)
+    hybrid_sizes = []
+    for determinize in (False, True):
+        processes = build_processes(request, determinize)
+        if determinize:
+            for (states, arcs), dfa in processes:
+                print(f"  pool {dfa.id}: {len(states):>6} states {len(arcs):>6} edges -> {len(dfa.states):>6} states {edge_count(dfa):>6} edges")
+        with contextlib.redirect_stdout(io.StringIO()):
+            hybrid = build_colored_dfa([dfa for _, dfa in processes], request.constrains)
+        hybrid_sizes.append((len(hybrid.states), edge_count(hybrid)))
+    (states, edges), (determinized_states, determinized_edges) = hybrid_sizes
+    print(f"  hybrid: {states:>6} states {edges:>6} edges -> {determinized_states:>6} states {determinized_edges:>6} edges")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        run(path)
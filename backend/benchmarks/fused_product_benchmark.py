@@ -0,0 +1,81 @@
+"""
+Staged vs fused hybrid construction: wall time and peak memory.
+
+Builds synthetic process DFAs (two interleaved branches of `length` steps per pool, i.e.
+length*length states per pool) and a few constraints across pools, then builds the hybrid
+with the staged pipeline (add_process, add_constraint, rewire_Errors) and with the fused
+n-ary product. Every variant runs in its own child process, peak memory is the peak
+resident set size of that child. Run from the backend directory:
+
+    python -m benchmarks.fused_product_benchmark [pools] [length]
+"""
+import contextlib
+import io
+import multiprocessing
+import resource
+import sys
+import time
+
+from app.model.main_model import ConstraintData, DeterministicFiniteAutomaton
+from app.service.dfa_service import add_constraints, build_fused_hybrid_dfa, build_multi_process_dfa, create_constraint_dfas
+
+CONSTRAINT_TYPES = ["response", "precedence", "not-coexistence", "chain-response", "exc-choice"]
+
+
+def build_pool(pool, length):
+    dfa = DeterministicFiniteAutomaton()
+    dfa.id = f"pool{pool}"
+    for i in range(length):
+        for j in range(length):
+            state = f"P{pool}_{i}_{j}"
+            dfa.states.add(state)
+            dfa.transition_function[state] = dict()
+            if i + 1 < length:
+                dfa.transition_function[state][f"p{pool}_a{i}"] = f"P{pool}_{i + 1}_{j}"
+            if j + 1 < length:
+                dfa.transition_function[state][f"p{pool}_b{j}"] = f"P{pool}_{i}_{j + 1}"
+    dfa.alphabet = {f"p{pool}_a{i}" for i in range(length - 1)} | {f"p{pool}_b{j}" for j in range(length - 1)}
+    dfa.initial_states = {f"P{pool}_0_0"}
+    dfa.accepting_states = {f"P{pool}_{length - 1}_{length - 1}"}
+    dfa.updateSingleDFA()
+    return dfa
+
+
+def build_constraints(pools, length):
+    constraints = []
+    for index, constraintType in enumerate(CONSTRAINT_TYPES):
+        source, target = index % pools, (index + 1) % pools
+        constraints.append(ConstraintData(id=f"c{index}", sourceRef=f"p{source}_a{index % (length - 1)}", targetRef=f"p{target}_b{(index + 1) % (length - 1)}", constraintType=constraintType))
+    return constraints
+
+
+def build_hybrid(pools, length, compact, fused):
+    processes = [build_pool(pool, length) for pool in range(pools)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        constraint_DFAs = create_constraint_dfas(build_constraints(pools, length), set().union(*(process.alphabet for process in processes)))
+        start_time = time.perf_counter()
+        if fused:
+            hybrid = build_fused_hybrid_dfa(processes, constraint_DFAs, compact)
+        else:
+            hybrid = add_constraints(build_multi_process_dfa(processes, compact), constraint_DFAs, pools)
+    elapsed = time.perf_counter() - start_time
+    return len(hybrid.states), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(pools, length, compact, fused):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(build_hybrid, (pools, length, compact, fused))
+
+
+def run(pools, length):
+    print(f"{pools} pools of {length * length} states, {len(CONSTRAINT_TYPES)} constraints")
+    for compact in (False, True):
+        for fused in (False, True):
+            states, elapsed, peak = measure(pools, length, compact, fused)
+            print(f"  {'compact' if compact else 'tuple':>7} {'fused' if fused else 'staged':>6}: {states:>10,} states {elapsed:8.2f}s peak RSS {peak / 2 ** 10:9.1f} MiB")
+
+
+if __name__ == "__main__":
+    pools = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(pools, length)
@@ -0,0 +1,62 @@
+"""
+Per-pool ingestion time: direct BPMN translation vs the pm4py conversion.
+
+Reads /generateDfa request bodies (JSON with `models` and `constrains`) and times, for every pool,
+the pm4py path (BPMN import, bpmn_converter, Petri net token game, DFA conversion) and the direct
+path (workflow net from the BPMN tree, token game, DFA conversion). Pools the direct translation
+does not support are reported as such. Run from the backend directory:
+
+    python -m benchmarks.ingestion_benchmark request.json [request.json ...]
+"""
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+
+from app.model.main_model import GenerateDfaRequest
+from app.service.bpmn_translator import UnsupportedBpmnError
+from app.service.main_service import convert_bpmn_to_dfa, convert_bpmn_to_petri_net, convert_petri_net_to_dfa, get_sequence_flow_ids, parse_bpmn_xml
+from pm4py.objects.bpmn.importer.variants import lxml as bpmn_importer
+
+REPEATS = 20
+
+
+def pm4py_path(bpmn_xml, id):
+    root = parse_bpmn_xml(bpmn_xml)
+    petri_net = convert_bpmn_to_petri_net(bpmn_importer.import_xml_tree_from_root(root))
+    return convert_petri_net_to_dfa(petri_net, id, get_sequence_flow_ids(root))
+
+
+def direct_path(bpmn_xml, id):
+    root = parse_bpmn_xml(bpmn_xml)
+    return convert_bpmn_to_dfa(root, id, get_sequence_flow_ids(root))
+
+
+def median_time(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args)
+        times.append(time.perf_counter() - start_time)
+    return result, statistics.median(times)
+
+
+def run(path):
+    request = GenerateDfaRequest(**json.load(open(path)))
+    print(path)
+    for idx, bpmn_model in enumerate(request.models):
+        reference, pm4py_time = median_time(pm4py_path, bpmn_model.xml, str(idx))
+        try:
+            dfa, direct_time = median_time(direct_path, bpmn_model.xml, str(idx))
+        except UnsupportedBpmnError as e:
+            print(f"  {bpmn_model.id:>20}: {len(reference.states):>7} states pm4py {pm4py_time * 1000:8.2f} ms, direct not supported ({e})")
+            continue
+        print(f"  {bpmn_model.id:>20}: {len(dfa.states):>7} states pm4py {pm4py_time * 1000:8.2f} ms direct {direct_time * 1000:8.2f} ms ({pm4py_time / direct_time:5.1f}x)")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        run(path)
@@ -0,0 +1,65 @@
+"""
+Response size, encode and decode time of the /generateDfa wire formats.
+
+Reads /generateDfa request bodies (JSON with `models` and `constrains`), builds the colored DFA once and
+encodes it as plain JSON, columnar JSON, the columnar binary and (when msgpack is installed) MessagePack.
+Encode time starts at the automaton, the way a worker serializes: JSON state by state, the columnar formats
+from the columns colored_dfa_columns takes straight from it. Decode time is what the client spends before
+it can walk the DFA: parsing the body, and for the binary format reading the header and viewing the
+columns. Run from the backend directory:
+
+    python -m benchmarks.wire_format_benchmark request.json [request.json ...]
+"""
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+
+from app.model.main_model import GenerateDfaRequest
+from app.service import main_service
+from app.service.dfa_service import build_colored_dfa
+from app.service.wire_format import COLUMNAR_BINARY, COLUMNAR_JSON, JSON, MSGPACK, decode_binary, encode_response, json_chunks, msgpack
+
+REPEATS = 10
+
+
+DECODERS = {
+    JSON: json.loads,
+    COLUMNAR_JSON: json.loads,
+    COLUMNAR_BINARY: decode_binary,
+    MSGPACK: lambda data: msgpack.unpackb(data),
+}
+
+
+def median_time(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start_time)
+    return result, statistics.median(times)
+
+
+def encode(colored_dfa, media_type):
+    if media_type == JSON:
+        return b"".join(json_chunks({"colored_dfa": main_service.colored_dfa_fields(colored_dfa)}))
+    return encode_response({"colored_dfa": main_service.colored_dfa_columns(colored_dfa)}, media_type)
+
+
+def run(path):
+    request = GenerateDfaRequest(**json.load(open(path)))
+    roots = [main_service.parse_bpmn_xml(bpmn_model.xml) for bpmn_model in request.models]
+    with contextlib.redirect_stdout(io.StringIO()):
+        colored_dfa = build_colored_dfa(main_service.load_process_dfas(request.models, roots), request.constrains, compact=main_service.USE_COMPACT_DFA)
+    print(path, f"({len(colored_dfa.states):,} states)")
+    for media_type in [JSON, COLUMNAR_JSON, COLUMNAR_BINARY] + ([MSGPACK] if msgpack is not None else []):
+        data, encode_time = median_time(encode, colored_dfa, media_type)
+        _, decode_time = median_time(DECODERS[media_type], data)
+        print(f"  {media_type:>36}: {len(data):>12,} bytes encode {encode_time * 1000:8.2f} ms decode {decode_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        run(path)
@@ -20,43 +20,54 @@ export async function test(bpmnjs) {
   // Store constraint information globally for ID mapping
   globalConstraints = constrains;
 
-  // Show loading popup
+  // eslint-disable-next-line no-undef
+  const backendUrl = process.env.BACKEND_URL || 'http://localhost:8000';
+
+  // eslint-disable-next-line no-undef
+  if (process.env.MONITOR_SESSIONS === 'true') {
+    startMonitoringSession(bpmnjs, backendUrl, bpmnsByPools, constrains);
+    return;
+  }
+
+  // Show loading popup, its button cancels the build on the server
   swal({
     title: 'Generating DFA...',
     text: 'Please wait while we process your model',
     icon: 'info',
-    buttons: false,
+    buttons: {
+      abort: { text: 'Cancel', value: 'abort' }
+    },
     closeOnClickOutside: false,
     closeOnEsc: false
+  }).then(value => {
+    if (value === 'abort') {
+      cancelRunningJob(backendUrl);
+    }
   });
 
-  // eslint-disable-next-line no-undef
-  const backendUrl = process.env.BACKEND_URL || 'http://localhost:8000';
-
-  fetch(`${backendUrl}/generateDfa`, {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json'
-    },
-    body: JSON.stringify(
-      {
-        models: bpmnsByPools,
-        constrains: constrains
-      }
-    )
-  })
-    .then(response => response.json())
+  requestColoredDfa(backendUrl, bpmnsByPools, constrains)
     .then(data => {
       swal.close();
 
       console.log('API response:', data);
 
+      if (data.cancelled) {
+        swal({
+          title: 'Cancelled',
+          text: 'DFA generation was cancelled.',
+          icon: 'info',
+          button: 'OK'
+        });
+        return;
+      }
+
       // Parse the colored DFA from the server response
       if (data.colored_dfa) {
-        const coloredDFA = parseColoredDFA(data.colored_dfa);
+        const coloredDFA = data.colored_dfa.format === 'columnar' ? parseColumnarDFA(data.colored_dfa) : parseColoredDFA(data.colored_dfa);
         console.log('Parsed ColoredDFA:', coloredDFA);
 
         globalColoredDFA = coloredDFA;
+        globalSession = null;
         currentDFAState = coloredDFA.initState;
 
         initializeSimulationMonitoring(bpmnjs);
@@ -83,6 +94,220 @@ export async function test(bpmnjs) {
     });
 }
 
+let runningJobId = null;
+
+// Posts the pools and constraints to path, announcing the pools by hash and uploading only the XML
+// the server does not know yet; accept is the Accept header, for a job the format its result is encoded in
+async function postPools(backendUrl, path, pools, constrains, accept = 'application/json') {
+  const post = models => fetch(`${backendUrl}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Accept': accept
+    },
+    body: JSON.stringify({ models: models, constrains: constrains })
+  }).then(readJson);
+
+  // crypto.subtle is only available in secure contexts, elsewhere every pool is sent in full
+  if (!globalThis.crypto || !globalThis.crypto.subtle) {
+    return post(pools);
+  }
+  const references = await Promise.all(pools.map(async pool => ({ id: pool.id, hash: await sha256(pool.xml) })));
+  const response = await post(references);
+  if (!response.missing) {
+    return response;
+  }
+  console.log(`[Upload] Server asked for ${response.missing.length} of ${pools.length} pools`);
+  const missing = new Set(response.missing);
+  return post(references.map((reference, i) =>
+    missing.has(reference.hash) ? { ...reference, xml: pools[i].xml } : reference
+  ));
+}
+
+// Submits the build as a job, then follows its progress until the result is there
+async function requestColoredDfa(backendUrl, pools, constrains) {
+  const job = await postPools(backendUrl, '/jobs', pools, constrains, RESULT_ACCEPT);
+
+  runningJobId = job.job_id;
+  try {
+    return await waitForJob(backendUrl, job.job_id);
+  } finally {
+    runningJobId = null;
+  }
+}
+
+function waitForJob(backendUrl, jobId) {
+  return new Promise((resolve, reject) => {
+    const events = new EventSource(`${backendUrl}/jobs/${jobId}/events`);
+    events.onmessage = event => {
+      const progress = JSON.parse(event.data);
+      showJobProgress(progress);
+      if (progress.status === 'done') {
+        events.close();
+        fetch(`${backendUrl}/jobs/${jobId}/result`, { headers: { Accept: RESULT_ACCEPT } }).then(readResult).then(resolve, reject);
+      } else if (progress.status === 'cancelled') {
+        events.close();
+        resolve({ cancelled: true });
+      } else if ([ 'failed', 'timed_out', 'over_budget' ].includes(progress.status)) {
+        events.close();
+        reject(new Error(progress.error));
+      }
+    };
+    events.onerror = () => {
+      events.close();
+      reject(new Error('Lost the connection to the progress stream'));
+    };
+  });
+}
+
+function showJobProgress(progress) {
+  const text = document.querySelector('.swal-text');
+  if (!text || !progress.phase) {
+    return;
+  }
+  let message = `${progress.phase}: ${progress.states.toLocaleString()} states, ${progress.transitions.toLocaleString()} transitions`;
+  if (progress.constraints_left !== null) {
+    message += `, ${progress.constraints_left} constraints left`;
+  }
+  text.textContent = message;
+}
+
+function cancelRunningJob(backendUrl) {
+  if (runningJobId) {
+    fetch(`${backendUrl}/jobs/${runningJobId}/cancel`, { method: 'POST' })
+      .catch(error => console.error('Cancel failed:', error));
+  }
+}
+
+// the colored DFA as typed arrays is the smallest and fastest to decode, plain JSON is the fallback
+const COLUMNAR_BINARY = 'application/vnd.dfa.columnar';
+const RESULT_ACCEPT = `${COLUMNAR_BINARY}, application/vnd.dfa.columnar+json;q=0.9, application/json;q=0.8`;
+
+async function readResult(response) {
+  if (response.ok && (response.headers.get('Content-Type') || '').startsWith(COLUMNAR_BINARY)) {
+    return decodeColumnarBinary(await response.arrayBuffer());
+  }
+  return readJson(response);
+}
+
+function decodeColumnarBinary(buffer) {
+
+  /**
+   * Decode a binary columnar response: "CDFA", version and header length (uint32 LE), the JSON header
+   * and the int32 LE columns listed in header.arrays, viewed in place
+   *
+   * @param {ArrayBuffer} buffer - The response body
+   * @returns {Object} The response with a columnar colored_dfa
+   */
+
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== 'CDFA' || view.getUint32(4, true) !== 1) {
+    throw new Error('Unknown binary DFA format');
+  }
+  const headerLength = view.getUint32(8, true);
+  const response = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength)));
+  let offset = 12 + headerLength;
+  for (const [ name, length ] of response.arrays) {
+    response.colored_dfa[name] = new Int32Array(buffer, offset, length);
+    offset += length * 4;
+  }
+  delete response.arrays;
+  return response;
+}
+
+async function readJson(response) {
+  const body = await response.json();
+  if (!response.ok) {
+    // structured errors (budgets) carry their text in detail.message
+    throw new Error((body.detail && body.detail.message) || body.detail || response.statusText);
+  }
+  return body;
+}
+
+// Monitors on the server instead of building the whole DFA first: the session explores the states
+// and colours of the hybrid as the simulation fires activities
+async function startMonitoringSession(bpmnjs, backendUrl, pools, constrains) {
+  swal({
+    title: 'Starting monitoring...',
+    text: 'Please wait while we process your model',
+    icon: 'info',
+    buttons: false,
+    closeOnClickOutside: false,
+    closeOnEsc: false
+  });
+
+  try {
+    const session = await postPools(backendUrl, '/sessions', pools, constrains);
+    console.log('Monitoring session:', session);
+    globalSession = { backendUrl: backendUrl, id: session.session_id, queue: Promise.resolve() };
+    globalColoredDFA = null;
+    currentDFAState = session.state;
+
+    initializeSimulationMonitoring(bpmnjs);
+
+    swal.close();
+    swal({
+      title: 'Success!',
+      text: 'Monitoring session started!',
+      icon: 'success',
+      button: 'OK'
+    });
+  } catch (error) {
+    swal.close();
+    console.error('API error:', error);
+    swal({
+      title: 'Error!',
+      text: 'Failed to start monitoring. error: ' + error.message,
+      icon: 'error',
+      button: 'OK'
+    });
+  }
+}
+
+function sessionRequest(path, body) {
+  return fetch(`${globalSession.backendUrl}/sessions/${globalSession.id}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: body ? JSON.stringify(body) : undefined
+  }).then(readJson);
+}
+
+function enqueueSessionRequest(request) {
+  // session requests are sent one after another, in the order the simulation fired them
+  globalSession.queue = globalSession.queue.then(request).catch(error => console.error('[Session] Request failed:', error));
+}
+
+function fireInSession(activityId, activityName) {
+  enqueueSessionRequest(async () => {
+    const result = await sessionRequest('/fire', { activity: activityId });
+    if (!result.moved) {
+      console.warn(`[DFA Warning] Cannot transition from ${result.previous} with activity ${activityId}`);
+      return;
+    }
+    console.log(`[DFA Transition] ${result.previous} --[${activityId}]--> ${result.state}`);
+    currentDFAState = result.state;
+    console.log('[DFA State Color]', result.colors);
+    checkConstraintViolations(result.previous, result.state, activityId, result.colors);
+    fireActivityEvents(activityId, activityName, result.previous, result.state, result.colors);
+  });
+}
+
+function resetSession() {
+  enqueueSessionRequest(async () => {
+    const session = await sessionRequest('/reset');
+    currentDFAState = session.state;
+    console.log('DFA reset to state:', currentDFAState);
+  });
+}
+
+async function sha256(text) {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
 function parseXml(strXml) {
   const parser = new DOMParser();
   return parser.parseFromString(strXml, 'text/xml');
@@ -514,6 +739,105 @@ function splitBpmnByPool(xmlDoc) {
   return results;
 }
 
+// Helper function to parse state strings back to original format if needed
+function parseState(stateStr) {
+  if (typeof stateStr === 'string' && stateStr.startsWith('(') && stateStr.endsWith(')')) {
+    const inner = stateStr.slice(1, -1); // Remove parentheses
+    return inner.split(',').map(s => s.trim());
+  }
+  return stateStr;
+}
+
+function stateKey(state) {
+  return typeof state === 'object' ? `(${state.join(',')})` : state;
+}
+
+function parseColumnarDFA(data) {
+
+  /**
+   * Wrap the columnar colored DFA (integer state ids, CSR transitions, colour palette) in the interface of
+   * parseColoredDFA; transitions and colours are read from the columns when asked for, nothing is expanded
+   *
+   * @param {Object} data - The columnar colored DFA, its columns as arrays or Int32Arrays
+   * @returns {Object} Parsed ColoredDFA object
+   */
+
+  const ids = new Map(data.states.map((name, id) => [ name, id ]));
+  const symbolIds = new Map(data.alphabet.map((symbol, id) => [ symbol, id ]));
+  const accepting = new Set(data.accepting);
+  const width = data.constraints.length;
+  // colours of a palette row in the { constraintId: status } form, built once per row
+  const paletteColors = [];
+
+  const idOf = state => ids.get(stateKey(state));
+
+  return {
+    current: parseState(data.states[data.current]),
+    states: data.states.map(state => parseState(state)),
+    alphabet: [ ...data.alphabet ],
+    initState: parseState(data.states[data.init_state]),
+    acceptStates: Array.from(data.accepting, id => parseState(data.states[id])),
+
+    getTransitionsFrom: function(state) {
+      const id = idOf(state);
+      const transitions = [];
+      if (id === undefined) {
+        return transitions;
+      }
+      for (let i = data.offsets[id]; i < data.offsets[id + 1]; i++) {
+        transitions.push({ symbol: data.alphabet[data.symbols[i]], target: data.states[data.targets[i]] });
+      }
+      return transitions;
+    },
+
+    getDefaultTarget: function(state) {
+      const id = idOf(state);
+      return id !== undefined && data.default_targets[id] >= 0 ? data.states[data.default_targets[id]] : null;
+    },
+
+    getStateColor: function(state) {
+      const id = idOf(state);
+      const row = id !== undefined ? data.colors[id] : -1;
+      if (row < 0) {
+        return null;
+      }
+      if (!paletteColors[row]) {
+        paletteColors[row] = data.constraints.map((constraint, i) => ({ [constraint]: data.statuses[data.palette[row * width + i]] }));
+      }
+      return paletteColors[row];
+    },
+
+    canTransition: function(fromState, symbol) {
+      return this.getNextState(fromState, symbol) !== null;
+    },
+
+    getNextState: function(fromState, symbol) {
+      const id = idOf(fromState);
+      const symbolId = symbolIds.get(symbol);
+      if (id === undefined || symbolId === undefined) {
+        return null;
+      }
+      for (let i = data.offsets[id]; i < data.offsets[id + 1]; i++) {
+        if (data.symbols[i] === symbolId) {
+          return data.states[data.targets[i]];
+        }
+      }
+      return this.getDefaultTarget(fromState);
+    },
+
+    isAcceptState: function(state) {
+      return accepting.has(idOf(state));
+    },
+
+    getAvailableSymbols: function(state) {
+      if (this.getDefaultTarget(state) !== null) {
+        return [ ...this.alphabet ];
+      }
+      return [ ...new Set(this.getTransitionsFrom(state).map(t => t.symbol)) ];
+    }
+  };
+}
+
 function parseColoredDFA(coloredDfaData) {
 
   /**
@@ -523,15 +847,6 @@ function parseColoredDFA(coloredDfaData) {
    * @returns {Object} Parsed ColoredDFA object
    */
 
-  // Helper function to parse state strings back to original format if needed
-  function parseState(stateStr) {
-    if (typeof stateStr === 'string' && stateStr.startsWith('(') && stateStr.endsWith(')')) {
-      const inner = stateStr.slice(1, -1); // Remove parentheses
-      return inner.split(',').map(s => s.trim());
-    }
-    return stateStr;
-  }
-
   // Helper function to parse transitions
   function parseTransitions(transitionData) {
     const transitions = {};
@@ -569,26 +884,36 @@ function parseColoredDFA(coloredDfaData) {
     acceptStates: coloredDfaData.accept_states.map(state => parseState(state)),
     colors: parseColors(coloredDfaData.colors),
 
+    // Target of every alphabet symbol without an explicit transition, per state
+    defaultTransitions: { ...(coloredDfaData.default_transitions || {}) },
+
     // Add utility methods
     getTransitionsFrom: function(state) {
       const stateKey = typeof state === 'object' ? `(${state.join(',')})` : state;
       return this.transitionFunction[stateKey] || [];
     },
 
+    getDefaultTarget: function(state) {
+      const stateKey = typeof state === 'object' ? `(${state.join(',')})` : state;
+      return this.defaultTransitions[stateKey] || null;
+    },
+
     getStateColor: function(state) {
       const stateKey = typeof state === 'object' ? `(${state.join(',')})` : state;
       return this.colors[stateKey] || null;
     },
 
     canTransition: function(fromState, symbol) {
-      const transitions = this.getTransitionsFrom(fromState);
-      return transitions.some(t => t.symbol === symbol);
+      return this.getNextState(fromState, symbol) !== null;
     },
 
     getNextState: function(fromState, symbol) {
       const transitions = this.getTransitionsFrom(fromState);
       const transition = transitions.find(t => t.symbol === symbol);
-      return transition ? transition.target : null;
+      if (transition) {
+        return transition.target;
+      }
+      return this.alphabet.includes(symbol) ? this.getDefaultTarget(fromState) : null;
     },
 
     isAcceptState: function(state) {
@@ -601,6 +926,9 @@ function parseColoredDFA(coloredDfaData) {
 
     // Method to get all possible symbols from a state
     getAvailableSymbols: function(state) {
+      if (this.getDefaultTarget(state) !== null) {
+        return [ ...this.alphabet ];
+      }
       const transitions = this.getTransitionsFrom(state);
       return [ ...new Set(transitions.map(t => t.symbol)) ];
     }
@@ -610,6 +938,7 @@ function parseColoredDFA(coloredDfaData) {
 }
 
 let globalColoredDFA = null;
+let globalSession = null;
 let currentDFAState = null;
 let simulationEventBus = null;
 let globalConstraints = null;
@@ -663,6 +992,8 @@ export function initializeSimulationMonitoring(bpmnjs) {
         // Simulation mode activated
         currentDFAState = globalColoredDFA.initState;
         console.log('DFA initialized to state:', currentDFAState);
+      } else if (event.active && globalSession) {
+        resetSession();
       }
     };
     simulationEventBus.on('tokenSimulation.toggleMode', toggleModeListener);
@@ -673,6 +1004,8 @@ export function initializeSimulationMonitoring(bpmnjs) {
       if (globalColoredDFA) {
         currentDFAState = globalColoredDFA.initState;
         console.log('DFA initialized to state:', currentDFAState);
+      } else if (globalSession) {
+        resetSession();
       }
     };
     simulationEventBus.on('tokenSimulation.playSimulation', playSimulationListener);
@@ -689,6 +1022,8 @@ export function initializeSimulationMonitoring(bpmnjs) {
       if (globalColoredDFA) {
         currentDFAState = globalColoredDFA.initState;
         console.log('DFA reset to state:', currentDFAState);
+      } else if (globalSession) {
+        resetSession();
       }
     };
     simulationEventBus.on('tokenSimulation.resetSimulation', resetSimulationListener);
@@ -699,7 +1034,7 @@ export function initializeSimulationMonitoring(bpmnjs) {
 
     console.log('Simulation monitoring initialized');
     console.log('EventBus available:', !!simulationEventBus);
-    console.log('DFA available:', !!globalColoredDFA);
+    console.log('DFA available:', !!globalColoredDFA || !!globalSession);
   } catch (error) {
     console.error('Failed to initialize simulation monitoring:', error);
   }
@@ -738,6 +1073,13 @@ function handleActivityFired(element, eventType) {
   // const activityType = element.businessObject.$type;
 
 
+  if (globalSession) {
+    if (eventType === 'exit') {
+      fireInSession(activityId, activityName);
+    }
+    return;
+  }
+
   if (eventType === 'exit' && globalColoredDFA.getAvailableSymbols(currentDFAState).includes(activityId)) {
     console.log(`[Activity Processing] Processing activity: ${activityId}`);
     processActivityInDFA(activityId, activityName);
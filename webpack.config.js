@@ -36,7 +36,8 @@ module.exports = (env, argv) => {
       }),
       new DefinePlugin({
         'process.env.TOKEN_SIMULATION_VERSION': JSON.stringify(require('./package.json').version),
-        'process.env.BACKEND_URL': JSON.stringify(process.env.BACKEND_URL || 'http://localhost:8000')
+        'process.env.BACKEND_URL': JSON.stringify(process.env.BACKEND_URL || 'http://localhost:8000'),
+        'process.env.MONITOR_SESSIONS': JSON.stringify(process.env.MONITOR_SESSIONS || 'false')
       })
     ],
     devtool,